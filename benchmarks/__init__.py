@@ -0,0 +1,5 @@
+"""
+Benchmarks for the scan loop, run against a simulated network on loopback.
+
+    python -m benchmarks.run --hosts 1,16,64 --mixes web,server,mixed --output bench.json
+"""
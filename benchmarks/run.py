@@ -0,0 +1,218 @@
+"""
+Times the scan loop against a simulated network and reports JSON.
+
+For every host count and port mix, each case is run `--repeat` times:
+- scan_ports:      common-port scan of every host
+- check_metrics:   /metrics probing of every host (probe cache cleared)
+- identify_device: vendor lookup (stub API) + port scan of every host
+- process_device:  full enrichment (identify + probe) of every host
+- cycle_cold:      one main-loop cycle (run_cycle) with an empty database
+- cycle_warm:      one main-loop cycle with every device already known
+
+Per-host cases run on ENRICH_WORKERS threads like the pipeline does.
+Results include throughput (operations/s), p50/p99 latency per operation
+and the process's peak RSS so far (it only grows, so compare runs of the
+same command line).
+
+    python -m benchmarks.run --hosts 1,16,64 --mixes web,mixed --repeat 3 --output bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.simnet import MIXES, MIXED, SimulatedNetwork
+
+import network_scanner.__main__ as scan_loop
+from network_scanner.core import identifier, oui, probe
+from network_scanner.core.identifier import COMMON_PORTS, identify_device, scan_ports
+from network_scanner.core.probe import check_metrics
+from network_scanner.storage import database, registry
+
+logger = logging.getLogger(__name__)
+
+CASES = ("scan_ports", "check_metrics", "identify_device", "process_device", "cycle_cold", "cycle_warm")
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def time_each(func, items, workers):
+    """
+    Runs func(item) for every item on `workers` threads.
+
+    Returns:
+        tuple: (wall seconds, list of per-item latencies in seconds)
+    """
+    def timed(item):
+        start = time.perf_counter()
+        func(item)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as executor:
+        latencies = list(executor.map(timed, items))
+    return time.perf_counter() - start, latencies
+
+
+def reset_state(clear_devices=False):
+    probe._cache.clear()
+    # Let queued device writes land before clearing tables under them
+    registry.get_registry().flush()
+    with database.get_pool().writer() as conn:
+        conn.execute("DELETE FROM vendors")
+        if clear_devices:
+            conn.execute("DELETE FROM devices")
+            conn.execute("DELETE FROM device_ports")
+            conn.execute("DELETE FROM device_events")
+    registry.load_from_db()
+
+
+def run_cycle(net):
+    # Discovery is replaced by the simulated hosts; everything after it is the real pipeline
+    scan_loop.iter_network = lambda scan_range: iter(list(net.devices))
+    return scan_loop.run_cycle(["127.0.1.0/24"])
+
+
+def run_case(case, net, repeat, workers):
+    devices = net.devices
+    ips = [device["ip"] for device in devices]
+    wall = 0.0
+    latencies = []
+    ops = 0
+
+    for _ in range(repeat):
+        if case == "scan_ports":
+            reset_state()
+            seconds, lat = time_each(scan_ports, ips, workers)
+        elif case == "check_metrics":
+            reset_state()
+            seconds, lat = time_each(check_metrics, ips, workers)
+        elif case == "identify_device":
+            reset_state()
+            seconds, lat = time_each(lambda d: identify_device(d["ip"], d["mac"]), devices, workers)
+        elif case == "process_device":
+            reset_state()
+            seconds, lat = time_each(lambda d: scan_loop.process_device(dict(d)), devices, workers)
+        elif case == "cycle_cold":
+            reset_state(clear_devices=True)
+            seconds, lat = time_each(lambda _: run_cycle(net), [None], 1)
+        elif case == "cycle_warm":
+            reset_state(clear_devices=True)
+            run_cycle(net)
+            seconds, lat = time_each(lambda _: run_cycle(net), [None], 1)
+        else:
+            raise ValueError(f"Unknown case: {case}")
+        wall += seconds
+        latencies.extend(lat)
+        ops += len(lat)
+
+    result = {
+        "case": case,
+        "hosts": net.hosts,
+        "mix": net.mix,
+        "repeat": repeat,
+        "operations": ops,
+        "seconds": round(wall, 6),
+        "throughput_ops": round(ops / wall, 3) if wall else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    if case == "scan_ports":
+        result["ports_per_second"] = round(ops * len(COMMON_PORTS) / wall, 1) if wall else None
+    if case.startswith("cycle"):
+        result["hosts_per_second"] = round(ops * net.hosts / wall, 3) if wall else None
+    return result
+
+
+def parse_list(value, convert=str):
+    return [convert(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan loop benchmarks on a simulated network")
+    parser.add_argument("--hosts", help="Comma-separated host counts", default="1,16,64")
+    parser.add_argument("--mixes", help=f"Comma-separated port mixes ({', '.join(sorted(MIXES))}, {MIXED})",
+                        default=MIXED)
+    parser.add_argument("--cases", help="Comma-separated cases to run", default=",".join(CASES))
+    parser.add_argument("--repeat", help="Runs per case", type=int, default=3)
+    parser.add_argument("--workers", help="Threads for per-host cases", type=int, default=scan_loop.ENRICH_WORKERS)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--loglevel", help="Log level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(getattr(logging, args.loglevel.upper(), logging.WARNING))
+    cases = parse_list(args.cases)
+    for case in cases:
+        if case not in CASES:
+            parser.error(f"Unknown case: {case}")
+    mixes = parse_list(args.mixes)
+    for mix in mixes:
+        if mix != MIXED and mix not in MIXES:
+            parser.error(f"Unknown mix: {mix}")
+
+    # Isolated database; vendors come from the stub API only
+    workdir = tempfile.mkdtemp(prefix="network-scanner-bench-")
+    database.DB_FILE = os.path.join(workdir, "bench.db")
+    database.init_db()
+    oui.set_registry_paths([])
+    identifier.vendor_api_mode = "on"
+
+    results = []
+    try:
+        for hosts in parse_list(args.hosts, int):
+            for mix in mixes:
+                with SimulatedNetwork(hosts, mix) as net:
+                    identifier.VENDOR_API_URL = net.vendor_api_url
+                    for case in cases:
+                        result = run_case(case, net, args.repeat, args.workers)
+                        result["skipped_ports"] = net.skipped_ports
+                        logger.info(f"{case} hosts={hosts} mix={mix}: {result['throughput_ops']} ops/s, "
+                                    f"p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms")
+                        results.append(result)
+    finally:
+        registry.get_registry().flush()
+        database.close_db()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Simulated network on loopback addresses for benchmarks.
+
+Every simulated host is an address in 127.0.0.0/8 (Linux routes the whole
+block to the loopback interface; other platforms may only answer on
+127.0.0.1). Per host, ports can be:
+- open: the connection is accepted and closed;
+- metrics: a minimal HTTP server answering /metrics in the Prometheus
+  exposition format (and 404 for anything else);
+- filtered: a listener with a full backlog, so connects time out like a
+  firewall dropping SYNs;
+- closed: anything else (connection refused).
+
+A stub of the online vendor API answers every lookup on 127.0.0.1. All
+sockets are served by one selector thread.
+"""
+
+import selectors
+import socket
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# First simulated address is 127.0.1.1; 127.0.0.x is left alone
+BASE_ADDRESS = (127 << 24) | (1 << 8)
+
+# Port mixes: which ports each host exposes
+MIXES = {
+    "web": {"open": [80, 443], "metrics": [8080], "filtered": [8443]},
+    "server": {"open": [22], "metrics": [9100], "filtered": [3389, 5900]},
+    "iot": {"open": [1883, 8008], "metrics": [], "filtered": [23]},
+    "bare": {"open": [], "metrics": [], "filtered": []},
+}
+# "mixed" cycles through every other mix
+MIXED = "mixed"
+
+METRICS_BODY = (
+    b"# HELP node_load1 1m load average.\n"
+    b"# TYPE node_load1 gauge\n"
+    b"node_load1 0.42\n"
+)
+
+STUB_VENDOR = "Simulated Devices Inc."
+
+
+def _response(status, body, content_type="text/plain; version=0.0.4"):
+    return (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode() + body
+
+
+def host_ip(index):
+    return socket.inet_ntoa((BASE_ADDRESS + index).to_bytes(4, "big"))
+
+
+def host_mac(index):
+    # Universally administered, so vendor lookups aren't skipped
+    value = (0x00163E << 24) | index
+    digits = f"{value:012x}"
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+class SimulatedNetwork:
+    """
+    Builds `hosts` simulated hosts with the given port mix.
+
+    Use as a context manager; `devices` lists {"ip", "mac", "discovery"}
+    dicts as discovery would yield them, and `vendor_api_url` is the stub
+    vendor API URL template.
+    """
+
+    def __init__(self, hosts, mix=MIXED):
+        self.hosts = hosts
+        self.mix = mix
+        self.devices = []
+        self.profiles = {}  # ip -> port mix
+        self.vendor_api_url = None
+        self._selector = selectors.DefaultSelector()
+        self._sockets = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.skipped_ports = 0
+
+    def _profile(self, index):
+        if self.mix == MIXED:
+            names = sorted(MIXES)
+            return MIXES[names[index % len(names)]]
+        return MIXES[self.mix]
+
+    def _listen(self, ip, port, backlog=128):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((ip, port))
+        except OSError as e:
+            # Privileged ports without root, or the address isn't routed to loopback
+            logger.warning(f"Cannot bind {ip}:{port}: {e}")
+            sock.close()
+            self.skipped_ports += 1
+            return None
+        sock.listen(backlog)
+        self._sockets.append(sock)
+        return sock
+
+    def _add_filtered(self, ip, port):
+        sock = self._listen(ip, port, backlog=0)
+        if sock is None:
+            return
+        # Fill the accept queue; further SYNs are dropped and connects time out
+        filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        filler.settimeout(1)
+        try:
+            filler.connect((ip, port))
+        except OSError:
+            pass
+        self._sockets.append(filler)
+
+    def _add_server(self, ip, port, handler):
+        sock = self._listen(ip, port)
+        if sock is None:
+            return
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, ("listen", handler))
+
+    def start(self):
+        for index in range(1, self.hosts + 1):
+            ip = host_ip(index)
+            profile = self._profile(index)
+            self.profiles[ip] = profile
+            for port in profile["open"]:
+                self._add_server(ip, port, None)
+            for port in profile["metrics"]:
+                self._add_server(ip, port, self._metrics_response)
+            for port in profile["filtered"]:
+                self._add_filtered(ip, port)
+            self.devices.append({"ip": ip, "mac": host_mac(index), "discovery": "arp"})
+
+        vendor_sock = self._listen("127.0.0.1", 0)
+        vendor_sock.setblocking(False)
+        self._selector.register(vendor_sock, selectors.EVENT_READ, ("listen", self._vendor_response))
+        self.vendor_api_url = f"http://127.0.0.1:{vendor_sock.getsockname()[1]}/{{mac}}"
+
+        self._thread = threading.Thread(target=self._serve, name="simnet", daemon=True)
+        self._thread.start()
+        return self
+
+    @staticmethod
+    def _metrics_response(path):
+        if path == "/metrics":
+            return _response("200 OK", METRICS_BODY)
+        return _response("404 Not Found", b"not found", "text/plain")
+
+    @staticmethod
+    def _vendor_response(path):
+        return _response("200 OK", STUB_VENDOR.encode(), "text/plain")
+
+    def _serve(self):
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(timeout=0.1):
+                role, handler = key.data
+                if role == "listen":
+                    self._accept(key.fileobj, handler)
+                else:
+                    self._read(key.fileobj, handler)
+
+    def _accept(self, sock, handler):
+        try:
+            conn, _ = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        if handler is None:
+            conn.close()
+            return
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ, ("conn", (handler, bytearray())))
+
+    def _read(self, conn, state):
+        handler, buffer = state
+        try:
+            data = conn.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        buffer.extend(data)
+        if data and b"\r\n\r\n" not in buffer:
+            return
+        self._selector.unregister(conn)
+        if data:
+            request_line = bytes(buffer).split(b"\r\n", 1)[0].decode("latin-1").split()
+            path = request_line[1] if len(request_line) > 1 else "/"
+            try:
+                # Responses are small enough for the socket buffer
+                conn.setblocking(True)
+                conn.sendall(handler(path))
+            except OSError:
+                pass
+        conn.close()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        for sock in self._sockets:
+            sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
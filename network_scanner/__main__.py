@@ -5,18 +5,25 @@ This module serves as the main entry point for the network scanner application.
 It orchestrates network scanning, device identification, metrics collection, and export.
 """
 
-import time
 import argparse
-import socket
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import socket
+from functools import partial
+import time
+STARTED_AT = time.monotonic()  # Start of the startup timing report, before the package imports below
 
-from network_scanner.core.scanner import scan_network
+from network_scanner.core.scanner import iter_network, get_interface_network, parse_ranges
+from network_scanner.core import (budget, enrichment, fingerprint, identifier, instrumentation, oui, passive, portmodel,
+                                  portscan, rtt, scheduler, synscan, udpdiscovery)
 from network_scanner.core.identifier import identify_device
-from network_scanner.core.probe import check_metrics
-from network_scanner.exporters.prometheus import start_exporter, update_metrics
-from network_scanner.storage.database import init_db, upsert_device, get_all_devices
-from network_scanner.web.server import start_web_server_thread
+from network_scanner.core.probe import check_metrics, check_metrics_many
+from network_scanner.core.pipeline import Pipeline, Stage, BatchStage
+from network_scanner.exporters import prometheus
+from network_scanner.exporters.prometheus import start_exporter, update_metrics, publish_devices
+from network_scanner.storage import database, registry
+from network_scanner.storage.database import init_db, prune_history
+# The web server (and Flask) is only imported when the web interface is enabled
+from network_scanner.web import events, jobs
 
 # Configure logging
 logging.basicConfig(
@@ -27,24 +34,60 @@ logger = logging.getLogger(__name__)
 
 def get_local_network():
     """
-    Detects the local network range (assuming /24).
+    Detects the local network range from the routing table (falls back to /24).
     """
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         # Connect to an external server to determine the interface
         s.connect(('8.8.8.8', 80))
         local_ip = s.getsockname()[0]
-        # Assume /24 for simplicity
-        return ".".join(local_ip.split(".")[:3]) + ".0/24"
     except Exception:
         return "192.168.1.0/24" # Fallback
     finally:
         s.close()
 
-def process_device(device):
+    network = get_interface_network(local_ip)
+    if network is not None:
+        return str(network)
+    return ".".join(local_ip.split(".")[:3]) + ".0/24"
+
+# Worker threads per pipeline stage
+ENRICH_WORKERS = 20
+PROBE_WORKERS = 20
+# Items buffered between stages before upstream stages block
+STAGE_QUEUE_SIZE = 200
+# Hosts probed per UDP discovery round (about one segment)
+UDP_BATCH_SIZE = 256
+# Seconds between device history retention/compaction runs
+HISTORY_PRUNE_INTERVAL = 3600
+
+def udp_stage(batch, discovery=None):
     """
-    Enriches a single device with identification and metrics probing.
+    Probes a batch of discovered devices over UDP (SNMP, NetBIOS) and
+    attaches what they, and the cycle's multicast queries, revealed.
     """
+    results = discovery.probe([device['ip'] for device in batch])
+    for device in batch:
+        found = results.get(device['ip']) or {}
+        hostname = found.pop('hostname', None)
+        if hostname and not device.get('hostname'):
+            device['hostname'] = hostname
+        if found:
+            device['udp_services'] = found
+    return batch
+
+def identify_stage(device, known=None, deadline=None):
+    """
+    Identifies a single device.
+
+    Devices already in `known` (stored rows keyed by MAC) with an unchanged
+    IP only get a light port sample; the full profile is rebuilt when the
+    refresh interval expires or the sample shows a change. Devices getting
+    a full profile are flagged for the metrics probing stage. Once the
+    cycle is past its `deadline` (monotonic time), known devices keep their
+    stored profile without any probe, so the cycle ends as soon as possible.
+    """
+    start = time.monotonic()
     ip = device['ip']
     mac = device['mac']
     
@@ -52,22 +95,269 @@ def process_device(device):
     if mac == "Unknown":
         mac = f"unknown_{ip}"
         device['mac'] = mac
-    
-    # Identify Device
-    info = identify_device(ip, mac)
-    
-    # Probe for Metrics
-    metrics_urls = check_metrics(ip)
-    info['metrics_urls'] = metrics_urls
-    
+
+    stored = known.get(mac) if known else None
+
+    # Start from the stored RTT estimate, else from the discovery reply time.
+    # An address that moved to another device starts over.
+    rtt_table = rtt.get_table()
+    if stored and stored.get('ip') == ip:
+        rtt_table.seed(ip, srtt=stored.get('srtt'), rttvar=stored.get('rttvar'))
+    else:
+        rtt_table.forget(ip)
+    rtt_table.seed(ip, rtt=device.get('rtt'))
+
+    now = time.time()
+    overdue = deadline is not None and time.monotonic() > deadline
+    reason = enrichment.full_scan_reason(device, stored, now, defer_refresh=overdue)
+    info = None
+    if reason is None:
+        if overdue or not enrichment.light_check_due(device, stored, now):
+            info = enrichment.stored_profile(device, stored)
+        else:
+            info = enrichment.light_check(device, stored)
+            if info is None:
+                reason = "services changed"
+
+    if info is None:
+        logger.debug(f"Full enrichment for {ip} ({reason})")
+
+        # Identify Device
+        info = identify_device(ip, mac, stored.get('type') if stored else None)
+        info['needs_probe'] = True
+
+    info['discovery'] = device.get('discovery')
+    # Hints from passive discovery (DHCP/mDNS)
+    if device.get('hostname'):
+        info['hostname'] = device['hostname']
+    if info.get('vendor', 'Unknown') == 'Unknown' and device.get('vendor_hint'):
+        info['vendor'] = device['vendor_hint']
+    # UDP identity data refines the type like TCP fingerprints do
+    if device.get('udp_services'):
+        info['services'] = {**(info.get('services') or {}), **device['udp_services']}
+        info['type'] = fingerprint.device_type(info['services']) or info.get('type', 'Unknown')
+    info['enrichment_seconds'] = time.monotonic() - start
+    return info
+
+def probe_stage(info):
+    """
+    Probes for metrics endpoints on devices flagged by identify_stage.
+    """
+    if info.pop('needs_probe', False):
+        start = time.monotonic()
+        info['metrics_urls'] = check_metrics(info['ip'], open_ports=info['open_ports'])
+        info['last_full_scan'] = time.time()
+        info['enrichment_seconds'] += time.monotonic() - start
+        if info['metrics_urls']:
+            logger.info(f"Found metrics at: {info['metrics_urls']} on {info['ip']}")
+    instrumentation.observe_enrichment(info['enrichment_seconds'])
     return info
 
+def process_device(device, known=None):
+    """
+    Enriches a single device with identification and metrics probing.
+    """
+    return probe_stage(identify_stage(device, known))
+
+def persist_stage(batch):
+    """
+    Stores a batch of enriched devices, along with the current RTT estimate
+    of each host, in the registry (written to the database in one
+    background transaction).
+    """
+    rtt_table = rtt.get_table()
+    for device in batch:
+        device.update(rtt_table.get(device['ip']))
+    registry.get_registry().upsert(batch)
+    return batch
+
+def run_cycle(scan_range, deadline=None):
+    """
+    Runs one discovery/enrichment cycle as a streaming pipeline:
+    discovery -> identification -> metrics probing -> persistence -> export.
+
+    Devices are exported as soon as they are stored, without waiting for
+    the rest of the subnet. Past `deadline` (monotonic time), known devices
+    are no longer probed (see identify_stage). Returns the list of enriched
+    devices.
+    """
+    enriched_devices = []
+    # Stored devices by MAC, from an immutable registry snapshot
+    known = registry.get_registry().snapshot().by_mac
+    # Port ordering learned from what is open on similar devices
+    portmodel.learn(known.values())
+
+    def export_stage(batch):
+        publish_devices(batch)
+        for device in batch:
+            events.publish_device(device)
+        enriched_devices.extend(batch)
+
+    stages = [
+        Stage("identify", partial(identify_stage, known=known, deadline=deadline), workers=ENRICH_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+        Stage("probe", probe_stage, workers=PROBE_WORKERS, queue_size=STAGE_QUEUE_SIZE),
+        BatchStage("persist", persist_stage, queue_size=STAGE_QUEUE_SIZE),
+        BatchStage("export", export_stage, queue_size=STAGE_QUEUE_SIZE),
+    ]
+    # Multicast queries go out once per cycle; unicast probes per batch of hosts
+    discovery = udpdiscovery.UdpDiscovery().start() if udpdiscovery.ENABLED else None
+    if discovery is not None:
+        stages.insert(0, BatchStage("udp", partial(udp_stage, discovery=discovery), batch_size=UDP_BATCH_SIZE,
+                                    queue_size=STAGE_QUEUE_SIZE))
+    discovered = 0
+    try:
+        with Pipeline(stages) as pipeline:
+            for device in iter_network(scan_range):
+                discovered += 1
+                pipeline.feed(device)
+    finally:
+        if discovery is not None:
+            discovery.close()
+
+    logger.info(f"Found {discovered} active devices.")
+    return enriched_devices
+
+def scan_task(scan_range, interval, scoped=False, deadline=None):
+    """
+    Scheduled scan of a group of ranges: one cycle, then the metrics
+    snapshot and the disappeared devices are updated.
+
+    With `scoped` (other groups are scanned on their own cadence), only
+    devices of these ranges are considered gone, once unseen for the
+    longer of DISAPPEAR_AFTER and two of the group's intervals.
+    """
+    logger.info(f"Starting Scan for {', '.join(scan_range)}")
+    cycle_start = time.monotonic()
+    # Discovery, enrichment, persistence and export run as one pipeline
+    enriched_devices = run_cycle(scan_range, deadline)
+
+    # Drop devices that vanished and record the cycle duration
+    networks = parse_ranges(scan_range) if scoped else None
+    update_metrics(enriched_devices, scan_duration=time.monotonic() - cycle_start, scope=networks)
+    logger.info("Metrics updated and saved to DB.")
+
+    not_seen_since = time.time() - max(database.DISAPPEAR_AFTER, 2 * interval) if scoped else None
+    gone = registry.get_registry().mark_disappeared(not_seen_since, networks)
+    if gone:
+        logger.info(f"{gone} devices disappeared.")
+
+def metrics_task(deadline=None):
+    """
+    Scheduled re-probe of the metrics endpoints of present devices, between
+    their full profiles. Only changed endpoint lists are stored and exported.
+    """
+    cutoff = time.time() - database.DISAPPEAR_AFTER
+    devices = [record.to_dict() for record in registry.get_registry().snapshot()
+               if record.open_ports and (record.last_seen or 0) >= cutoff]
+    # Bypass the positive cache, so endpoints that went away show up within one interval
+    found = check_metrics_many({d['ip']: d['open_ports'] for d in devices}, use_cache=False)
+    changed = []
+    for device in devices:
+        urls = found.get(device['ip'], [])
+        if urls != device['metrics_urls']:
+            device['metrics_urls'] = urls
+            changed.append(device)
+    registry.get_registry().set_metrics_urls({device['mac']: device['metrics_urls'] for device in changed})
+    publish_devices(changed)
+    for device in changed:
+        events.publish_device(device)
+    logger.info(f"Re-probed metrics endpoints of {len(devices)} devices, {len(changed)} changed.")
+
+def maintenance_task(deadline=None):
+    """
+    Scheduled device history retention/compaction.
+    """
+    prune_history()
+
+def parse_range_intervals(values):
+    """
+    Parses --range-interval values ("CIDR[,CIDR...]=SECONDS").
+
+    Returns:
+        dict: Mapping of range string -> interval in seconds.
+    """
+    intervals = {}
+    for value in values or []:
+        ranges, sep, seconds = value.rpartition('=')
+        if not sep:
+            raise ValueError(f"expected CIDR=SECONDS, got {value!r}")
+        interval = float(seconds)
+        if interval <= 0:
+            raise ValueError(f"interval must be positive, got {seconds}")
+        for network in parse_ranges(ranges):
+            intervals[str(network)] = interval
+    return intervals
+
 def main():
+    global ENRICH_WORKERS, PROBE_WORKERS
+
+    startup = instrumentation.StartupTimer(STARTED_AT)
+    startup.mark("imports")
     parser = argparse.ArgumentParser(description="Network Device Metrics Exporter")
-    parser.add_argument("--range", help="IP range to scan (e.g., 192.168.1.0/24)", required=False)
-    parser.add_argument("--interval", help="Scan interval in seconds", type=int, default=60)
+    parser.add_argument("--range", help="IP range(s) to scan in CIDR notation, comma-separated or repeated "
+                        "(e.g., 192.168.1.0/24,10.0.0.0/22)", action="append", required=False)
+    parser.add_argument("--interval", help="Seconds from one scan cycle's start to the next (deadline to deadline)",
+                        type=int, default=60)
+    parser.add_argument("--range-interval", help="Scan interval of specific ranges, as CIDR=SECONDS (repeatable; "
+                        "the ranges are added to --range)", action="append")
+    parser.add_argument("--jitter", help="Fraction of its interval each scheduled run is randomly delayed by",
+                        type=float, default=scheduler.DEFAULT_JITTER)
+    parser.add_argument("--light-interval", help="Seconds between light port checks of unchanged known devices "
+                        "(0 = every scan cycle)", type=int, default=enrichment.LIGHT_CHECK_INTERVAL)
+    parser.add_argument("--metrics-interval", help="Seconds between re-probes of known devices' metrics endpoints "
+                        "(0 = only with full profiles)", type=int, default=0)
+    parser.add_argument("--max-pps", help="Global budget of probe packets/connections per second across ARP, ping, "
+                        "TCP, SYN, UDP and metrics probes (0 = unlimited)", type=float, default=budget.DEFAULT_RATE)
     parser.add_argument("--port", help="Prometheus exporter port", type=int, default=8000)
     parser.add_argument("--web-port", help="Web interface port", type=int, default=5050)
+    parser.add_argument("--no-web", help="Run without the web interface (Flask is not loaded)", action="store_true")
+    parser.add_argument("--scan-concurrency", help="Maximum TCP connects in flight across all hosts",
+                        type=int, default=portscan.DEFAULT_CONCURRENCY)
+    parser.add_argument("--host-concurrency", help="Maximum TCP connects in flight per host",
+                        type=int, default=portscan.DEFAULT_HOST_CONCURRENCY)
+    parser.add_argument("--scan-mode", help="Port scan method: full TCP connects, or half-open SYN probes (needs root)",
+                        choices=identifier.SCAN_MODES, default="connect")
+    parser.add_argument("--syn-rate", help="SYN probes sent per second in SYN mode, by all scans together (0 = unlimited)",
+                        type=float, default=synscan.DEFAULT_RATE)
+    parser.add_argument("--scan-rate", help="Global connect rate limit per second (0 = unlimited)",
+                        type=float, default=portscan.DEFAULT_RATE)
+    parser.add_argument("--host-rate", help="Per-host connect rate limit per second (0 = unlimited)",
+                        type=float, default=portscan.DEFAULT_HOST_RATE)
+    parser.add_argument("--passive", help="Learn devices from ARP/DHCP/mDNS traffic; active sweeps skip devices heard recently",
+                        action="store_true")
+    parser.add_argument("--passive-max-age", help="Seconds a device heard passively is not swept actively",
+                        type=int, default=passive.MAX_AGE)
+    parser.add_argument("--iface", help="Interface for passive discovery (default: scapy's default interface)")
+    parser.add_argument("--udp-discovery", help="Identify devices over UDP (SNMP, SSDP, mDNS, NetBIOS)",
+                        action="store_true")
+    parser.add_argument("--snmp-community", help="SNMP community for UDP discovery",
+                        default=udpdiscovery.SNMP_COMMUNITY)
+    parser.add_argument("--oui-file", help="IEEE OUI registry file or directory (CSV or Wireshark manuf)",
+                        action="append")
+    parser.add_argument("--vendor-api", help="Online MAC vendor API fallback (auto = only without offline registry)",
+                        choices=identifier.VENDOR_API_MODES, default="off")
+    parser.add_argument("--stale-after", help="Seconds an unseen device stays exported as down before removal (0 = remove on next scan)",
+                        type=int, default=prometheus.STALE_AFTER)
+    parser.add_argument("--full-refresh", help="Seconds between full port/metrics profiles of unchanged devices (0 = every scan)",
+                        type=int, default=enrichment.FULL_REFRESH_INTERVAL)
+    parser.add_argument("--port-budget", help="Seconds a full profile may spend scanning likely ports beyond the first "
+                        "wave (0 = only the common ports)", type=float, default=identifier.PORT_SCAN_BUDGET)
+    parser.add_argument("--fingerprint", help="Read service banners of open ports during full profiles "
+                        "to refine device types", action="store_true")
+    parser.add_argument("--fingerprint-ttl", help="Seconds a service fingerprint is reused before its banner is read again",
+                        type=int, default=fingerprint.CACHE_TTL)
+    parser.add_argument("--sample-ports", help="Ports sampled per group in the light check of known devices",
+                        type=int, default=enrichment.SAMPLE_PORTS)
+    parser.add_argument("--enrich-workers", help="Threads identifying devices (port scans)", type=int, default=ENRICH_WORKERS)
+    parser.add_argument("--probe-workers", help="Threads probing devices for metrics endpoints", type=int, default=PROBE_WORKERS)
+    parser.add_argument("--max-full-scans", help="Full port scans from the web interface running at once",
+                        type=int, default=jobs.MAX_CONCURRENT_JOBS)
+    parser.add_argument("--disappear-after", help="Seconds a device can go unseen before it is logged as disappeared",
+                        type=int, default=database.DISAPPEAR_AFTER)
+    parser.add_argument("--history-days", help="Days of device change history to keep (0 = forever)",
+                        type=int, default=database.HISTORY_RETENTION_DAYS)
+    parser.add_argument("--profiler", help="Allow sampling profiler dumps from the web interface",
+                        action="store_true")
     parser.add_argument("--loglevel", help="Log level (DEBUG, INFO, WARNING, ERROR)", default="INFO")
     args = parser.parse_args()
 
@@ -77,57 +367,119 @@ def main():
         raise ValueError(f'Invalid log level: {args.loglevel}')
     logging.getLogger().setLevel(numeric_level)
 
-    scan_range = args.range
-    if not scan_range:
-        scan_range = get_local_network()
-        logger.info(f"No range specified. Auto-detected: {scan_range}")
-
-    # Initialize Database
+    # Warm restore: the exporter serves the stored devices right away, before
+    # anything slow (range detection, OUI registry, scapy, Flask) is loaded
+    prometheus.STALE_AFTER = args.stale_after
+    prometheus.on_first_scrape = lambda: logger.info(
+        f"First scrape served {startup.mark('first_scrape'):.3f}s after start")
     init_db()
-    
-    # Load existing devices from DB
+    startup.mark("database")
     logger.info("Loading known devices from database...")
-    known_devices = get_all_devices()
-    update_metrics(known_devices)
-    logger.info(f"Loaded {len(known_devices)} devices.")
-
-    # Start Prometheus Exporter
+    loaded = registry.load_from_db()
+    update_metrics(registry.get_registry().snapshot())
+    logger.info(f"Loaded {loaded} devices.")
+    startup.mark("restore")
     start_exporter(args.port)
-    
-    # Start Web Server
-    start_web_server_thread(args.web_port)
+    startup.mark("exporter")
 
-    while True:
-        logger.info(f"Starting Scan for {scan_range}")
+    try:
+        range_intervals = parse_range_intervals(args.range_interval)
+    except ValueError as e:
+        parser.error(f"Invalid --range-interval: {e}")
+    if args.range:
         try:
-            # 1. Scan Network (Discovery)
-            devices = scan_network(scan_range)
-            logger.info(f"Found {len(devices)} active devices.")
-
-            # 2. Enrich Devices in Parallel
-            logger.debug("Enriching device data (Parallel)...")
-            enriched_devices = []
-            
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                results = executor.map(process_device, devices)
-                
-                for info in results:
-                    if info.get('metrics_urls'):
-                        logger.info(f"Found metrics at: {info['metrics_urls']} on {info['ip']}")
-                    
-                    # 3. Persist to DB
-                    upsert_device(info)
-                    enriched_devices.append(info)
-
-            # 4. Update Exporter
-            update_metrics(enriched_devices)
-            logger.info("Metrics updated and saved to DB.")
+            scan_range = [str(network) for network in parse_ranges(args.range)]
+        except ValueError as e:
+            parser.error(f"Invalid --range: {e}")
+    elif range_intervals:
+        scan_range = []
+    else:
+        scan_range = [get_local_network()]
+        logger.info(f"No range specified. Auto-detected: {scan_range[0]}")
+    scan_range += [network for network in range_intervals if network not in scan_range]
+
+    # Ranges sharing an interval are scanned together, in one cycle
+    range_groups = {}
+    for network in scan_range:
+        range_groups.setdefault(range_intervals.get(network, args.interval), []).append(network)
+
+    budget.configure(args.max_pps)
 
+    # Configure the shared port scan engine
+    portscan.configure(
+        concurrency=args.scan_concurrency,
+        host_concurrency=args.host_concurrency,
+        rate=args.scan_rate,
+        host_rate=args.host_rate
+    )
+
+    udpdiscovery.ENABLED = args.udp_discovery
+    udpdiscovery.SNMP_COMMUNITY = args.snmp_community
+    passive.ENABLED = args.passive
+    passive.MAX_AGE = args.passive_max_age
+    if args.passive:
+        try:
+            passive.start(args.iface)
         except Exception as e:
-            logger.error(f"Error during scan: {e}", exc_info=True)
+            logger.warning(f"Passive discovery unavailable ({e}); using active sweeps only.")
+            passive.ENABLED = False
+
+    synscan.configure(rate=args.syn_rate)
+    identifier.scan_mode = args.scan_mode
+    if args.scan_mode == "syn" and not synscan.available():
+        logger.warning("SYN scans need raw socket privileges (root/CAP_NET_RAW); using TCP connects.")
+        identifier.scan_mode = "connect"
+
+    # Load the offline vendor registry
+    if args.oui_file:
+        vendor_index = oui.set_registry_paths(args.oui_file)
+    else:
+        vendor_index = oui.get_index()
+    identifier.vendor_api_mode = args.vendor_api
+    identifier.PORT_SCAN_BUDGET = args.port_budget
+    fingerprint.ENABLED = args.fingerprint
+    fingerprint.CACHE_TTL = args.fingerprint_ttl
+    logger.info(f"Loaded {len(vendor_index)} OUI assignments.")
+    if not len(vendor_index):
+        fallback = "using the online vendor API" if args.vendor_api != "off" else "vendors will be Unknown"
+        logger.warning(f"No offline OUI registry found; {fallback}. "
+                       "Run 'python -m network_scanner.core.oui --update' to install one.")
+
+    ENRICH_WORKERS = args.enrich_workers
+    PROBE_WORKERS = args.probe_workers
+    enrichment.FULL_REFRESH_INTERVAL = args.full_refresh
+    enrichment.SAMPLE_PORTS = args.sample_ports
+    enrichment.LIGHT_CHECK_INTERVAL = args.light_interval
+    database.DISAPPEAR_AFTER = args.disappear_after
+    database.HISTORY_RETENTION_DAYS = args.history_days
+    startup.mark("configuration")
 
-        logger.debug(f"Sleeping for {args.interval} seconds...")
-        time.sleep(args.interval)
+    # Start Web Server
+    if args.no_web:
+        logger.info("Web interface disabled (--no-web).")
+    else:
+        from network_scanner.web import server as web_server
+        web_server.scan_jobs.max_concurrent = max(1, args.max_full_scans)
+        web_server.PROFILER_ENABLED = args.profiler
+        web_server.start_web_server_thread(args.web_port)
+        startup.mark("web")
+    logger.info(startup.report())
+
+    # Every task runs on fixed deadlines; overrunning runs skip missed slots
+    tasks = scheduler.Scheduler()
+    scoped = len(range_groups) > 1
+    for interval, ranges in range_groups.items():
+        name = f"scan {','.join(ranges)}" if scoped else "scan"
+        tasks.add(name, partial(scan_task, ranges, interval, scoped), interval, args.jitter)
+        logger.info(f"Scanning {', '.join(ranges)} every {interval:g} seconds")
+    if args.metrics_interval:
+        tasks.add("metrics", metrics_task, args.metrics_interval, args.jitter)
+    tasks.add("history", maintenance_task, HISTORY_PRUNE_INTERVAL, args.jitter)
+    try:
+        tasks.run_forever()
+    finally:
+        # Pending background writes reach the database before exit
+        registry.get_registry().writer.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+"""
+Global packet budget.
+
+One process-wide limit on probes put on the wire per second, shared by
+every sender: ARP and ping sweeps, TCP connects, SYN probes, UDP discovery
+and metrics probes. Per-component rates (--scan-rate, --syn-rate, ...)
+still apply; the budget caps their sum, so tasks that happen to run at the
+same time cannot add up to more traffic than the network should see.
+
+Senders reserve the packets they are about to send and wait as long as
+the reservation says. Reservations are handed out in order, so a burst
+from one component delays the others instead of exceeding the rate.
+"""
+
+import threading
+import time
+
+# Probes per second across all senders (0 = unlimited)
+DEFAULT_RATE = 0
+
+
+class PacketBudget:
+    """
+    Thread-safe pacing schedule (virtual scheduling token bucket).
+
+    Args:
+        rate (float): Packets per second.
+        burst (float): Packets that may be sent at once after an idle
+            period (default: one second's worth).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._free_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, packets=1):
+        """
+        Books `packets` and returns the seconds to wait before sending them.
+        """
+        with self._lock:
+            now = time.monotonic()
+            # Idle time is not saved up; up to one burst may run ahead of the schedule
+            self._free_at = max(self._free_at, now) + packets / self.rate
+            wait = self._free_at - self.burst / self.rate - now
+        return max(0.0, wait)
+
+
+_budget = None
+
+
+def configure(rate=DEFAULT_RATE):
+    global _budget
+    _budget = PacketBudget(rate) if rate else None
+    return _budget
+
+
+def get_budget():
+    return _budget
+
+
+def reserve(packets=1):
+    """
+    Seconds the caller must wait before sending `packets` (0 without a budget).
+    For event loop code, which must not block.
+    """
+    budget = _budget
+    return budget.reserve(packets) if budget is not None else 0.0
+
+
+def acquire(packets=1):
+    """
+    Blocks until `packets` may be sent.
+    """
+    wait = reserve(packets)
+    if wait > 0:
+        time.sleep(wait)
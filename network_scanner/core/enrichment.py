@@ -0,0 +1,128 @@
+"""
+Incremental enrichment policy.
+
+Decides, per discovered device, whether it needs a full profile (port scan
+of COMMON_PORTS plus metrics probing) or only a light check. Known devices
+whose MAC/IP pair is unchanged get a small randomized sample of ports each
+cycle: some of their known open ports to confirm the profile still holds,
+and some of the remaining common ports to notice new services. The full
+profile is refreshed on a slower schedule, or as soon as the sample shows
+that something changed. Light checks can run on their own, slower cadence
+too, and a cycle running past its deadline postpones due refreshes.
+"""
+
+import random
+import logging
+import threading
+import time
+
+from network_scanner.core.identifier import COMMON_PORTS, scan_ports
+
+logger = logging.getLogger(__name__)
+
+# Seconds between full profiles of an unchanged device (0 = always full)
+FULL_REFRESH_INTERVAL = 3600
+# Ports checked per group (known open / other common ports) in a light check
+SAMPLE_PORTS = 4
+# Connect timeout for the light check (None = adaptive, from the host's RTT);
+# the sample is scanned concurrently, so this also bounds its duration
+SAMPLE_TIMEOUT = None
+# Seconds between light checks of an unchanged device (0 = every cycle);
+# in between, the stored profile is reused as is
+LIGHT_CHECK_INTERVAL = 0
+
+_light_checked = {}  # mac -> time of the last light check that confirmed the profile
+_light_checked_lock = threading.Lock()
+
+
+def full_scan_reason(device, known, now, defer_refresh=False):
+    """
+    Returns why `device` needs a full profile, or None if a light check is enough.
+
+    Args:
+        device (dict): Device as discovered this cycle ('ip', 'mac').
+        known (dict): Stored row for the same MAC, or None.
+        now (float): Current time.
+        defer_refresh (bool): Postpone periodic refreshes (the cycle is
+            over its deadline); new devices and IP changes still get one.
+    """
+    if known is None:
+        return "new device"
+    if known.get('ip') != device['ip']:
+        return f"IP changed from {known.get('ip')}"
+    if not FULL_REFRESH_INTERVAL:
+        return "incremental enrichment disabled"
+    last_full_scan = known.get('last_full_scan')
+    if not last_full_scan:
+        return "no full profile yet"
+    if now - last_full_scan >= FULL_REFRESH_INTERVAL and not defer_refresh:
+        return "full refresh due"
+    return None
+
+
+def light_check_due(device, known, now):
+    """
+    Whether a known device is due for a light check, or can keep its
+    stored profile without any probe this cycle.
+    """
+    if not LIGHT_CHECK_INTERVAL:
+        return True
+    with _light_checked_lock:
+        last_check = _light_checked.get(device['mac'], 0)
+    return now - max(last_check, known.get('last_full_scan') or 0) >= LIGHT_CHECK_INTERVAL
+
+
+def choose_sample(known_open, sample_size=None, rng=random):
+    """
+    Picks the ports for a light check.
+
+    Returns:
+        tuple: (ports expected open, other common ports to explore)
+    """
+    if sample_size is None:
+        sample_size = SAMPLE_PORTS
+    known_open = list(known_open)
+    known_set = set(known_open)
+    candidates = [port for port in COMMON_PORTS if port not in known_set]
+    verify = rng.sample(known_open, min(len(known_open), sample_size))
+    explore = rng.sample(candidates, min(len(candidates), sample_size))
+    return verify, explore
+
+
+def light_check(device, known):
+    """
+    Checks a sample of ports on a known device.
+
+    Returns:
+        dict: Device info reusing the stored profile if nothing changed,
+              or None if the profile is out of date and needs a full refresh.
+    """
+    ip = device['ip']
+    verify, explore = choose_sample(known.get('open_ports', []))
+    found = set(scan_ports(ip, verify + explore, timeout=SAMPLE_TIMEOUT))
+
+    closed = set(verify) - found
+    opened = found & set(explore)
+    if closed or opened:
+        logger.debug(f"Services changed on {ip} (closed: {sorted(closed)}, opened: {sorted(opened)})")
+        return None
+
+    with _light_checked_lock:
+        _light_checked[device['mac']] = time.time()
+    return stored_profile(device, known)
+
+
+def stored_profile(device, known):
+    """
+    Device info for this cycle taken from the stored profile.
+    """
+    return {
+        "ip": device['ip'],
+        "mac": device['mac'],
+        "vendor": known.get('vendor', 'Unknown'),
+        "open_ports": list(known.get('open_ports', [])),
+        "type": known.get('type', 'Unknown'),
+        "metrics_urls": list(known.get('metrics_urls', [])),
+        "services": dict(known.get('services') or {}),
+        "last_full_scan": known.get('last_full_scan'),
+    }
@@ -0,0 +1,408 @@
+"""
+Service fingerprinting from banners.
+
+Reuses the connections of the port scan (see the engine's `on_connect`
+hook): on every open port, a bounded banner is read, after a minimal
+protocol request where the server doesn't speak first (HTTP GET, MQTT
+CONNECT, SMB2 NEGOTIATE). The banner is parsed for the protocol, product
+and version (SSH version string, HTTP Server header and page title, MQTT
+CONNACK, SMB dialect) and matched against a signature index: an
+Aho-Corasick automaton built once from every signature pattern, so a
+banner is scanned in a single pass whatever the number of signatures.
+Signatures can name a device type, which is more specific than the one
+derived from open ports ("Printer" rather than "Web Server").
+
+Fingerprints are cached per (mac, port) for CACHE_TTL seconds, so repeated
+full profiles of a device don't re-read banners. Expired entries are swept
+as new ones are added, and the cache holds at most CACHE_SIZE entries, so
+devices that left the network do not stay in memory.
+"""
+
+import asyncio
+import logging
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+from network_scanner.core import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Fingerprint open ports during full profiles (--fingerprint)
+ENABLED = False
+# Bytes read from a banner at most
+MAX_BANNER = 2048
+# Seconds a banner grab may take, and the wait for servers that speak first
+GRAB_TIMEOUT = 1.0
+PASSIVE_WAIT = 0.3
+# Seconds a fingerprint is reused without reading the banner again
+CACHE_TTL = 3600
+# Fingerprints cached at most (oldest dropped first)
+CACHE_SIZE = 65536
+
+HTTP_PORTS = {80, 3000, 5000, 5001, 8000, 8008, 8080, 8081, 8088, 8090, 8123, 8181, 8880, 8888, 9000, 9090, 9100}
+MQTT_PORTS = {1883}
+SMB_PORTS = {445}
+
+HTTP_REQUEST = ("GET / HTTP/1.0\r\nHost: {host}\r\nUser-Agent: network-scanner\r\n"
+                "Accept: */*\r\nConnection: close\r\n\r\n")
+# MQTT 3.1.1 CONNECT, clean session, client id "ns"
+MQTT_CONNECT = b"\x10\x0e\x00\x04MQTT\x04\x02\x00\x3c\x00\x02ns"
+MQTT_DISCONNECT = b"\xe0\x00"
+MQTT_RETURN_CODES = {0: "accepted", 1: "bad protocol", 2: "client id rejected", 3: "unavailable",
+                     4: "bad credentials", 5: "not authorized"}
+SMB2_DIALECTS = {0x0202: "2.0.2", 0x0210: "2.1", 0x0300: "3.0", 0x0302: "3.0.2", 0x0311: "3.1.1"}
+
+
+def _smb2_negotiate():
+    dialects = (0x0202, 0x0210, 0x0300, 0x0302)
+    header = struct.pack("<4sHHIHHIIQIIQ16s", b"\xfeSMB", 64, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, b"")
+    body = struct.pack("<HHHHI16sQ", 36, len(dialects), 1, 0, 0, b"", 0)
+    body += b"".join(struct.pack("<H", dialect) for dialect in dialects)
+    message = header + body
+    # NetBIOS session service framing
+    return struct.pack(">I", len(message)) + message
+
+
+SMB_NEGOTIATE = _smb2_negotiate()
+
+# Signatures: (lowercase pattern, product, device type or None). Earlier
+# entries win when a banner matches signatures of several device types.
+SIGNATURES = [
+    ("routeros", "MikroTik RouterOS", "Router"),
+    ("mikrotik", "MikroTik RouterOS", "Router"),
+    ("openwrt", "OpenWrt", "Router"),
+    ("cgi-bin/luci", "OpenWrt LuCI", "Router"),
+    ("dd-wrt", "DD-WRT", "Router"),
+    ("fritz!box", "AVM FRITZ!Box", "Router"),
+    ("unifi", "Ubiquiti UniFi", "Network Controller"),
+    ("hp http server", "HP Embedded Web Server", "Printer"),
+    ("hp-chaisoe", "HP Embedded Web Server", "Printer"),
+    ("jetdirect", "HP JetDirect", "Printer"),
+    ("epson_linux", "Epson printer", "Printer"),
+    ("epson http", "Epson printer", "Printer"),
+    ("debut/", "Brother printer", "Printer"),
+    ("cups/", "CUPS", "Print Server"),
+    ("synology", "Synology DSM", "NAS"),
+    ("diskstation", "Synology DSM", "NAS"),
+    ("qnap", "QNAP QTS", "NAS"),
+    ("truenas", "TrueNAS", "NAS"),
+    ("freenas", "FreeNAS", "NAS"),
+    ("hikvision", "Hikvision", "Camera"),
+    ("dnvrs-webs", "Hikvision", "Camera"),
+    ("dahua", "Dahua", "Camera"),
+    ("proxmox", "Proxmox VE", "Hypervisor"),
+    ("vmware esxi", "VMware ESXi", "Hypervisor"),
+    ("home assistant", "Home Assistant", "Home Automation"),
+    ("pi-hole", "Pi-hole", "DNS Server"),
+    ("plex media server", "Plex Media Server", "Media Server"),
+    ("grafana", "Grafana", "Monitoring"),
+    ("prometheus", "Prometheus", "Monitoring"),
+    ("node exporter", "Prometheus Node Exporter", "Node Exporter"),
+    ("microsoft-iis", "Microsoft IIS", "Windows Server"),
+    ("microsoft ftp", "Microsoft FTP", "Windows Server"),
+    ("postfix", "Postfix", "Mail Server"),
+    ("exim", "Exim", "Mail Server"),
+    ("dovecot", "Dovecot", "Mail Server"),
+    ("mysql_native_password", "MySQL", "Database Server"),
+    # UDP identity data (SNMP sysDescr, SSDP device types, mDNS services)
+    ("laserjet", "HP LaserJet", "Printer"),
+    ("officejet", "HP OfficeJet", "Printer"),
+    ("urn:schemas-upnp-org:device:printer", "UPnP Printer", "Printer"),
+    ("_ipp._tcp", "IPP", "Printer"),
+    ("_pdl-datastream._tcp", "JetDirect", "Printer"),
+    ("ip camera", "IP Camera", "Camera"),
+    ("networkvideotransmitter", "ONVIF Camera", "Camera"),
+    ("internetgatewaydevice", "UPnP Internet Gateway", "Router"),
+    ("cisco ios", "Cisco IOS", "Router"),
+    ("procurve", "HP ProCurve", "Switch"),
+    ("jetstream", "TP-Link JetStream", "Switch"),
+    ("dial-multiscreen", "DIAL", "Smart TV"),
+    ("roku", "Roku", "Media Player"),
+    ("_googlecast._tcp", "Google Cast", "Media Player"),
+    ("_airplay._tcp", "AirPlay", "Media Player"),
+    ("mediarenderer", "UPnP Media Renderer", "Media Player"),
+    ("sonos", "Sonos", "Speaker"),
+    ("_hap._tcp", "HomeKit", "Smart Home"),
+    ("_esphomelib._tcp", "ESPHome", "Smart Home"),
+    ("mariadb", "MariaDB", "Database Server"),
+    ("openssh", "OpenSSH", None),
+    ("dropbear", "Dropbear SSH", None),
+    ("raspbian", "Raspberry Pi OS", None),
+    ("ubuntu", "Ubuntu", None),
+    ("debian", "Debian", None),
+    ("nginx", "nginx", None),
+    ("apache", "Apache httpd", None),
+    ("lighttpd", "lighttpd", None),
+    ("jetty", "Jetty", None),
+    ("werkzeug", "Werkzeug", None),
+    ("vsftpd", "vsftpd", None),
+    ("proftpd", "ProFTPD", None),
+    ("pure-ftpd", "Pure-FTPd", None),
+    ("filezilla", "FileZilla Server", None),
+    ("rfb 003.", "VNC", None),
+]
+
+
+class SignatureIndex:
+    """
+    Aho-Corasick automaton over signature patterns.
+
+    `match(text)` returns the indexes of every pattern occurring in `text`,
+    in one pass over the text.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                nxt = self.goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = nxt
+            self.output[state] += (index,)
+
+        # Breadth-first: failure links point to the longest proper suffix in the trie
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                self.output[nxt] += self.output[self.fail[nxt]]
+
+    def match(self, text):
+        found = set()
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+_index = SignatureIndex([pattern for pattern, _, _ in SIGNATURES])
+# Device type priority: position of its first signature
+_type_rank = {}
+for _rank, (_, _, _type) in enumerate(SIGNATURES):
+    if _type:
+        _type_rank.setdefault(_type, _rank)
+
+_TITLE_RE = re.compile(rb"<title[^>]*>([^<]{0,200})", re.IGNORECASE)
+
+
+def _first_line(data):
+    line = data.split(b"\n", 1)[0].strip()
+    return "".join(c for c in line.decode("latin-1") if c.isprintable())[:120]
+
+
+def match(text):
+    """
+    Matches text against the signature index.
+
+    Returns:
+        tuple: (list of products, device type of the highest priority match or None)
+    """
+    products = []
+    device_type = None
+    for index in sorted(_index.match(text.lower())):
+        _, product, sig_type = SIGNATURES[index]
+        if product not in products:
+            products.append(product)
+        if sig_type and device_type is None:
+            device_type = sig_type
+    return products, device_type
+
+
+def parse_banner(port, data):
+    """
+    Extracts the protocol and a short summary from a raw banner.
+
+    Returns:
+        dict: {"protocol", "banner", "products", "type"}; products and type
+            come from the signature index.
+    """
+    protocol = None
+    summary = _first_line(data)
+    text = data.decode("latin-1").lower()
+
+    if data.startswith(b"SSH-"):
+        protocol = "ssh"
+    elif data.startswith(b"HTTP/"):
+        protocol = "http"
+        head = data.split(b"\r\n\r\n", 1)[0]
+        parts = []
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"server":
+                parts.append(_first_line(value))
+        title = _TITLE_RE.search(data)
+        if title:
+            parts.append(_first_line(title.group(1)))
+        summary = " - ".join(part for part in parts if part) or summary
+    elif port in MQTT_PORTS and len(data) >= 4 and data[0] == 0x20:
+        protocol = "mqtt"
+        summary = f"MQTT CONNACK: {MQTT_RETURN_CODES.get(data[3], data[3])}"
+    elif data[4:8] == b"\xfeSMB" and len(data) >= 74:
+        protocol = "smb"
+        dialect = struct.unpack_from("<H", data, 72)[0]
+        summary = f"SMB {SMB2_DIALECTS.get(dialect, hex(dialect))}"
+    elif data[4:8] == b"\xffSMB":
+        protocol = "smb"
+        summary = "SMB 1"
+    elif data.startswith(b"RFB "):
+        protocol = "vnc"
+    elif data[:3].isdigit() and data[3:4] in (b" ", b"-"):
+        # FTP/SMTP style greeting
+        protocol = "ftp" if port == 21 else "smtp" if port in (25, 587) else None
+    elif data.startswith(b"* OK"):
+        protocol = "imap"
+    elif data.startswith(b"+OK"):
+        protocol = "pop3"
+
+    products, device_type = match(text)
+    return {"protocol": protocol, "banner": summary, "products": products, "type": device_type}
+
+
+def _request(ip, port):
+    if port in HTTP_PORTS:
+        return HTTP_REQUEST.format(host=ip).encode()
+    if port in MQTT_PORTS:
+        return MQTT_CONNECT
+    if port in SMB_PORTS:
+        return SMB_NEGOTIATE
+    return None
+
+
+def _complete(port, data):
+    """
+    Whether enough of the banner has been read to stop early.
+    """
+    if port in MQTT_PORTS:
+        return len(data) >= 4
+    if port in SMB_PORTS:
+        return len(data) >= 4 and len(data) >= 4 + struct.unpack_from(">I", data)[0]
+    if port in HTTP_PORTS:
+        return b"</title" in data.lower()
+    return b"\n" in data
+
+
+async def read_banner(ip, port, sock):
+    """
+    Reads at most MAX_BANNER bytes from a connected non-blocking socket,
+    after sending the port's protocol request if any.
+
+    Returns:
+        bytes: The banner, possibly empty.
+    """
+    loop = asyncio.get_event_loop()
+    request = _request(ip, port)
+    deadline = loop.time() + (GRAB_TIMEOUT if request else PASSIVE_WAIT)
+    data = b""
+    try:
+        if request:
+            await asyncio.wait_for(loop.sock_sendall(sock, request), GRAB_TIMEOUT)
+        while len(data) < MAX_BANNER and not _complete(port, data):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            chunk = await asyncio.wait_for(loop.sock_recv(sock, MAX_BANNER - len(data)), remaining)
+            if not chunk:
+                break
+            data += chunk
+        if port in MQTT_PORTS and data[:1] == b"\x20":
+            await asyncio.wait_for(loop.sock_sendall(sock, MQTT_DISCONNECT), PASSIVE_WAIT)
+    except asyncio.TimeoutError:
+        if request and not data:
+            instrumentation.count_timeouts("banner")
+    except OSError:
+        pass
+    return data
+
+
+_cache = OrderedDict()  # (mac, port) -> (fingerprint, expires), oldest first
+_cache_lock = threading.Lock()
+
+
+def cached(mac, port, now=None):
+    now = time.time() if now is None else now
+    with _cache_lock:
+        entry = _cache.get((mac, port))
+        if entry and entry[1] > now:
+            return entry[0]
+        if entry:
+            del _cache[(mac, port)]
+    return None
+
+
+def store(mac, port, fingerprint, now=None):
+    """
+    Caches a fingerprint, dropping expired entries and the oldest ones
+    beyond CACHE_SIZE.
+    """
+    now = time.time() if now is None else now
+    with _cache_lock:
+        _cache.pop((mac, port), None)
+        _cache[(mac, port)] = (fingerprint, now + CACHE_TTL)
+        # Entries are in insertion order, which is expiry order for a fixed TTL
+        while _cache:
+            _, (_, expires) = next(iter(_cache.items()))
+            if expires > now and len(_cache) <= CACHE_SIZE:
+                break
+            _cache.popitem(last=False)
+
+
+class Grabber:
+    """
+    Port scan hook fingerprinting the open ports of one device.
+
+    Pass it as the engine's `on_connect`; then `services(open_ports)`
+    returns the fingerprints, including cached ones of ports whose banner
+    wasn't read again.
+    """
+
+    def __init__(self, mac):
+        self.mac = mac
+
+    async def __call__(self, ip, port, sock):
+        if cached(self.mac, port) is not None:
+            return
+        data = await read_banner(ip, port, sock)
+        store(self.mac, port, parse_banner(port, data))
+
+    def services(self, open_ports):
+        """
+        Returns:
+            dict: {port (str): fingerprint} for ports that told something.
+        """
+        now = time.time()
+        result = {}
+        for port in open_ports:
+            fingerprint = cached(self.mac, port, now)
+            if fingerprint and (fingerprint["protocol"] or fingerprint["banner"] or fingerprint["products"]):
+                result[str(port)] = fingerprint
+        return result
+
+
+def device_type(services):
+    """
+    Most specific device type named by any fingerprint, or None.
+    """
+    types = [fingerprint.get("type") for fingerprint in (services or {}).values()]
+    types = [t for t in types if t]
+    return min(types, key=lambda t: _type_rank.get(t, len(SIGNATURES))) if types else None
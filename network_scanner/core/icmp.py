@@ -0,0 +1,210 @@
+"""
+In-process ICMP echo sweeper.
+
+Sends echo requests to every target from a single socket and matches the
+replies by source address, identifier and sequence number, instead of
+forking a ping process per address. An unprivileged datagram ICMP socket
+is used where the OS allows it (Linux with net.ipv4.ping_group_range,
+macOS), otherwise a raw socket (requires root/CAP_NET_RAW).
+"""
+
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import time
+import logging
+
+from network_scanner.core import budget
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+# Echo requests sent per second
+PING_RATE = 2000
+PING_TIMEOUT = 1.0
+PING_RETRIES = 1
+
+PAYLOAD = b"network-scanner"
+
+ARP_PROC_FILE = "/proc/net/arp"
+
+
+def checksum(data):
+    """
+    Internet checksum (RFC 1071).
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(ident, seq, payload=PAYLOAD):
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+
+def parse_echo_reply(data):
+    """
+    Returns (ident, seq) of an echo reply, or None for any other packet.
+    Handles packets with or without the IP header.
+    """
+    if len(data) >= 20 and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return None
+    icmp_type, _code, _csum, ident, seq = struct.unpack("!BBHHH", data[:8])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+def open_icmp_socket():
+    """
+    Opens an ICMP socket, preferring the unprivileged datagram kind.
+
+    Returns:
+        tuple: (socket, is_raw)
+
+    Raises:
+        OSError: If neither socket type is permitted.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError as e:
+        logger.debug(f"Unprivileged ICMP socket unavailable: {e}")
+    return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+
+def ping_sweep(ips, timeout=None, retries=None, rate=None):
+    """
+    Pings every address from one socket.
+
+    Args:
+        ips (iterable): Target IPv4 addresses.
+        timeout (float): Seconds to wait for replies after the last request of a round.
+        retries (int): Extra rounds for addresses that didn't answer.
+        rate (int): Requests per second.
+
+    Returns:
+        dict: Mapping of responding ip -> round-trip time in seconds.
+
+    Raises:
+        OSError: If no ICMP socket can be opened (insufficient privileges).
+    """
+    timeout = PING_TIMEOUT if timeout is None else timeout
+    retries = PING_RETRIES if retries is None else retries
+    rate = rate or PING_RATE
+
+    sock, is_raw = open_icmp_socket()
+    sock.setblocking(False)
+    # Datagram sockets get their identifier rewritten by the kernel
+    ident = os.getpid() & 0xFFFF
+    pending = {ip: index & 0xFFFF for index, ip in enumerate(ips)}
+    sent_at = {}
+    rtts = {}
+
+    def drain(deadline):
+        while pending:
+            while True:
+                try:
+                    data, (src, _) = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as e:
+                    logger.debug(f"ICMP receive failed: {e}")
+                    break
+                reply = parse_echo_reply(data)
+                if reply is None or src not in pending:
+                    continue
+                reply_ident, seq = reply
+                if seq != pending[src] or (is_raw and reply_ident != ident):
+                    continue
+                rtts[src] = time.monotonic() - sent_at[src]
+                del pending[src]
+
+            wait = deadline - time.monotonic()
+            if wait <= 0 or not pending:
+                return
+            readable, _, _ = select.select([sock], [], [], wait)
+            if not readable:
+                return
+
+    try:
+        interval = 1.0 / rate
+        for _ in range(retries + 1):
+            targets = list(pending)
+            if not targets:
+                break
+            next_send = time.monotonic()
+            for ip in targets:
+                if ip not in pending:
+                    continue
+                packet = build_echo_request(ident, pending[ip])
+                budget.acquire()
+                try:
+                    sent_at[ip] = time.monotonic()
+                    sock.sendto(packet, (ip, 0))
+                except (BlockingIOError, InterruptedError):
+                    drain(time.monotonic() + interval)
+                except OSError as e:
+                    logger.debug(f"ICMP send to {ip} failed: {e}")
+                next_send += interval
+                # Read replies while pacing requests so the receive buffer doesn't overflow
+                drain(next_send)
+            drain(time.monotonic() + timeout)
+    finally:
+        sock.close()
+
+    return rtts
+
+
+def read_arp_table():
+    """
+    Reads the system neighbour table once.
+
+    Returns:
+        dict: Mapping of ip -> mac (lowercase, colon-separated).
+    """
+    table = {}
+    if os.path.exists(ARP_PROC_FILE):
+        try:
+            with open(ARP_PROC_FILE, "r") as fh:
+                next(fh, None)  # Header
+                for line in fh:
+                    fields = line.split()
+                    if len(fields) < 4:
+                        continue
+                    ip, flags, mac = fields[0], fields[2], fields[3].lower()
+                    # 0x0 = incomplete entry
+                    if flags != "0x0" and mac != "00:00:00:00:00:00":
+                        table[ip] = mac
+            return table
+        except OSError as e:
+            logger.debug(f"Could not read {ARP_PROC_FILE}: {e}")
+
+    # Other platforms: one "arp -a" for the whole table
+    try:
+        output = subprocess.check_output(["arp", "-a"], timeout=5).decode("utf-8", errors="ignore")
+    except Exception as e:
+        logger.debug(f"ARP table lookup failed: {e}")
+        return table
+
+    ip_regex = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3})")
+    mac_regex = re.compile(r"([0-9a-fA-F]{1,2}(?:[:-][0-9a-fA-F]{1,2}){5})")
+    for line in output.splitlines():
+        ip_match = ip_regex.search(line)
+        mac_match = mac_regex.search(line)
+        if ip_match and mac_match:
+            # macOS drops leading zeros ("0:1a:2b:...")
+            octets = re.split(r"[:-]", mac_match.group(1))
+            table[ip_match.group(1)] = ":".join(o.zfill(2) for o in octets).lower()
+    return table
@@ -1,37 +1,80 @@
-import socket
-import requests
 import logging
 import time
 
-from database import get_cached_vendor, save_cached_vendor
+from network_scanner.core import fingerprint, instrumentation, oui, portmodel, synscan
+from network_scanner.core.portmodel import COMMON_PORTS, CLASSIFY_PORTS, classify
+from network_scanner.core.portscan import get_engine
+from network_scanner.storage.database import get_cached_vendor, save_cached_vendor
 
 logger = logging.getLogger(__name__)
 
+# Online vendor API fallback (opt-in): "auto" uses it only when no offline
+# registry is loaded, "on" for every MAC the registry does not know
+VENDOR_API_MODES = ("off", "auto", "on")
+vendor_api_mode = "off"
+# Plain-text vendor lookup; {mac} is replaced by the address
+VENDOR_API_URL = "https://api.macvendors.com/{mac}"
+
+# Port scan method: full TCP connects, or half-open SYN probes (raw sockets, root only)
+SCAN_MODES = ("connect", "syn")
+scan_mode = "connect"
+
+def _vendor_api_enabled():
+    if vendor_api_mode == "on":
+        return True
+    if vendor_api_mode == "off":
+        return False
+    return len(oui.get_index()) == 0
+
+@instrumentation.traced("vendor_lookup")
 def get_vendor(mac_address):
     """
     Attempts to get the vendor name from the MAC address.
-    Uses a simple online API or returns Unknown.
+    Resolves from the offline IEEE registry first, then the vendor cache,
+    and only falls back to the online API if enabled.
     """
     if not mac_address or mac_address.lower() == "unknown" or mac_address.startswith("unknown_"):
         return "Unknown"
-        
+
+    mac_int = oui.mac_to_int(mac_address)
+    if mac_int is None:
+        return "Unknown"
+
+    # Offline registry (longest-prefix match, no I/O)
+    vendor = oui.lookup_vendor(mac_int)
+    if vendor:
+        instrumentation.record_vendor_lookup("registry")
+        return vendor
+
+    # Randomized/locally administered MACs are not in any registry
+    if oui.is_locally_administered(mac_int):
+        return "Unknown"
+
     # Check Cache First
     cached_vendor = get_cached_vendor(mac_address)
     if cached_vendor:
         logger.debug(f"Vendor cache hit for {mac_address}: {cached_vendor}")
+        instrumentation.record_vendor_lookup("cache")
         return cached_vendor
-        
+
+    if not _vendor_api_enabled():
+        instrumentation.record_vendor_lookup("miss")
+        return "Unknown"
+
+    import requests
+
     # Simple retry mechanism for rate limits
     for attempt in range(3):
         try:
             # Using api.macvendors.com (Simple text response)
             # Note: They have rate limits, so we should be careful.
-            url = f"https://api.macvendors.com/{mac_address}"
+            url = VENDOR_API_URL.format(mac=mac_address)
             response = requests.get(url, timeout=3)
             if response.status_code == 200:
                 vendor = response.text.strip()
                 # Save to Cache
                 save_cached_vendor(mac_address, vendor)
+                instrumentation.record_vendor_lookup("api")
                 return vendor
             elif response.status_code == 429:
                 # Rate limited
@@ -40,99 +83,148 @@ def get_vendor(mac_address):
             else:
                 logger.debug(f"Vendor API returned {response.status_code} for {mac_address}")
                 break
+        except requests.Timeout:
+            instrumentation.count_timeouts("vendor_api")
         except Exception as e:
             logger.debug(f"Vendor API failed: {e}")
             pass
-            
+
+    instrumentation.record_vendor_lookup("miss")
     return "Unknown"
 
-# Common ports to scan (most frequently used services)
-COMMON_PORTS = [
-    21,    # FTP
-    22,    # SSH
-    23,    # Telnet
-    25,    # SMTP
-    53,    # DNS
-    80,    # HTTP
-    110,   # POP3
-    143,   # IMAP
-    443,   # HTTPS
-    445,   # SMB
-    3306,  # MySQL
-    3389,  # RDP
-    5432,  # PostgreSQL
-    5900,  # VNC
-    8080,  # HTTP Alt
-    8443,  # HTTPS Alt
-    9100,  # Prometheus Node Exporter
-    # IoT and Smart Home
-    1883,  # MQTT
-    8883,  # MQTT over SSL
-    # Common web services
-    3000,  # Node.js/React dev
-    5000,  # Flask default
-    5001,  # Synology DSM
-    8000,  # Python HTTP
-    8008,  # Google Home
-    8081,  # Common alt HTTP
-    8090,  # Common alt HTTP
-    8888,  # Jupyter
-    9000,  # Portainer
-    9090,  # Prometheus
-]
-
-def scan_ports(ip, ports=None, timeout=0.3):
+# Seconds a host's port scan may spend going beyond the most likely ports
+# (0 = scan exactly COMMON_PORTS)
+PORT_SCAN_BUDGET = 2.0
+# Most likely ports scanned in the first wave, along with CLASSIFY_PORTS
+FIRST_WAVE = 32
+# Ports per following wave of the wide candidate list
+WAVE_SIZE = 100
+# Scanning stops once a wave is expected to find fewer open ports than this
+MIN_WAVE_YIELD = 0.1
+# Beyond the first wave, only ports the history rates at least this many times
+# their prior are scanned (the others are no more likely open than chance)
+MIN_WAVE_LIFT = 1.5
+# Wide ports explored per full profile after the first wave, least probed
+# across all devices first, so the model learns about the whole list over time
+EXPLORE_PORTS = 50
+
+@instrumentation.traced("port_scan")
+def scan_ports(ip, ports=None, timeout=None, progress=None, on_open=None, cancel=None, on_connect=None,
+               mode=None):
     """
     Scans ports on the target IP.
     If ports is None, scans common ports.
+
+    Connects are issued concurrently through the shared asyncio engine
+    (see network_scanner.core.portscan), which enforces the global and
+    per-host concurrency caps and rate limits. Without an explicit
+    `timeout`, the connect timeout and retries adapt to the host's
+    measured round-trip time (see network_scanner.core.rtt). `on_connect`
+    is awaited on the engine loop with every open port's connected socket.
+
+    With `mode` (default: scan_mode) "syn" and raw sockets available, ports
+    are probed with half-open SYNs instead (network_scanner.core.synscan);
+    only the open ones are then connected to if `on_connect` needs a socket.
     """
     if ports is None:
         ports = COMMON_PORTS
-        
-    open_ports = []
-    for port in ports:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(timeout)
-            result = sock.connect_ex((ip, port))
-            if result == 0:
-                open_ports.append(port)
-            sock.close()
-        except Exception as e:
-            logger.debug(f"Error scanning {ip}:{port} - {e}")
-            pass
+
+    try:
+        if (mode or scan_mode) == "syn" and synscan.supports(ip):
+            open_ports = synscan.get_scanner().scan(ip, ports, timeout=timeout, progress=progress,
+                                                    on_open=on_open, cancel=cancel)
+            if on_connect is not None and open_ports:
+                get_engine().scan(ip, open_ports, timeout=timeout, on_connect=on_connect)
+            return open_ports
+        return get_engine().scan(ip, ports, timeout=timeout, progress=progress,
+                                 on_open=on_open, cancel=cancel, on_connect=on_connect)
+    except Exception as e:
+        logger.warning(f"Port scan of {ip} failed: {e}", exc_info=True)
+        return []
+
+def scan_likely_ports(ip, vendor=None, device_type=None, budget=None, on_connect=None, probed=None):
+    """
+    Scans a host's most likely ports first, then more of the wide candidate
+    list (portmodel.WIDE_PORTS) while it is worth it.
+
+    The first wave has every port the device type depends on plus the
+    FIRST_WAVE most likely ports for the vendor (and previous type), so the
+    classification is settled after it. For vendors without enough history
+    it also covers all of COMMON_PORTS. Then, within the time budget,
+    EXPLORE_PORTS of the wide ports probed on the fewest devices are
+    scanned, and further waves run, most likely ports first, until the
+    budget is spent or a wave's expected number of open ports drops below
+    MIN_WAVE_YIELD. Those waves only cover ports the history rates at least
+    MIN_WAVE_LIFT times their prior. `on_connect` is passed on to every
+    scan_ports call; every port scanned is added to the `probed` set.
+
+    Returns:
+        list: Sorted list of open ports.
+    """
+    if probed is None:
+        probed = set()
+    budget = PORT_SCAN_BUDGET if budget is None else budget
+    if not budget:
+        probed.update(COMMON_PORTS)
+        return scan_ports(ip, on_connect=on_connect)
+
+    start = time.monotonic()
+    model = portmodel.get_model()
+    ranked = model.rank(vendor, device_type)
+    first = set(CLASSIFY_PORTS) | {port for port, _ in ranked[:FIRST_WAVE]}
+    if not model.confident(vendor):
+        first.update(COMMON_PORTS)
+    open_ports = set(scan_ports(ip, sorted(first), on_connect=on_connect))
+    probed.update(first)
+    waves = 1
+
+    remaining = [(port, p) for port, p in ranked
+                 if port not in first and p >= MIN_WAVE_LIFT * portmodel.prior(port)]
+    explore = model.least_probed(EXPLORE_PORTS, exclude=first | {port for port, _ in remaining})
+    if explore and time.monotonic() - start < budget:
+        open_ports.update(scan_ports(ip, sorted(explore), on_connect=on_connect))
+        probed.update(explore)
+        waves += 1
+
+    while remaining and time.monotonic() - start < budget:
+        wave, remaining = remaining[:WAVE_SIZE], remaining[WAVE_SIZE:]
+        if sum(p for _, p in wave) < MIN_WAVE_YIELD:
+            break
+        ports = [port for port, _ in wave]
+        open_ports.update(scan_ports(ip, ports, on_connect=on_connect))
+        probed.update(ports)
+        waves += 1
+
+    logger.debug(f"Scanned {ip} in {waves} wave(s), {time.monotonic() - start:.2f}s: {len(open_ports)} open")
     return sorted(open_ports)
 
-def identify_device(ip, mac):
+@instrumentation.traced("identify")
+def identify_device(ip, mac, device_type=None):
     """
     Identifies device details based on IP and MAC.
+
+    `device_type` is the previously known type, if any; it refines which
+    ports are scanned first. With fingerprinting enabled, open ports'
+    banners are read over the scan's connections and a device type named
+    by a service signature takes precedence over the port-based one.
     """
     vendor = get_vendor(mac)
-    
-    # Scan common ports to discover services
+    grabber = fingerprint.Grabber(mac) if fingerprint.ENABLED else None
+
+    # Scan likely ports to discover services
     logger.debug(f"Scanning ports for {ip}...")
-    open_ports = scan_ports(ip)
-    
-    device_info = {
+    probed = set()
+    open_ports = scan_likely_ports(ip, vendor, device_type, on_connect=grabber, probed=probed)
+
+    info = {
         "ip": ip,
         "mac": mac,
         "vendor": vendor,
         "open_ports": open_ports,
-        "type": "Unknown"
+        "type": classify(open_ports),
+        "probed_ports": portmodel.pack_ports(probed)
     }
-    
-    # Simple heuristics based on discovered ports
-    if 9100 in open_ports:
-        device_info["type"] = "Node Exporter"
-    elif 3389 in open_ports:
-        device_info["type"] = "Windows PC"
-    elif 22 in open_ports and 80 not in open_ports:
-        device_info["type"] = "Linux Server"
-    elif 445 in open_ports:
-        device_info["type"] = "Windows/Samba"
-    elif 80 in open_ports or 443 in open_ports:
-        device_info["type"] = "Web Server"
-    elif 1883 in open_ports or 8883 in open_ports:
-        device_info["type"] = "MQTT Broker"
-        
-    return device_info
+    if grabber is not None:
+        info["services"] = grabber.services(open_ports)
+        info["type"] = fingerprint.device_type(info["services"]) or info["type"]
+    return info
@@ -0,0 +1,232 @@
+"""
+Self-instrumentation of the scanner.
+
+Timing hooks around the scan stages feed Prometheus histograms and
+counters in the default registry, so they are served by the exporter
+alongside the device metrics. Also provides a sampling profiler that
+dumps the stacks of every thread in collapsed ("folded") format, which
+flame graph tools read directly.
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+STAGE_SECONDS = Histogram(
+    'network_scanner_stage_duration_seconds',
+    'Duration of scan stages (discovery, identify, vendor_lookup, port_scan, metrics_probe, metrics_update)',
+    ['stage'], buckets=STAGE_BUCKETS)
+HOST_ENRICHMENT_SECONDS = Histogram(
+    'network_scanner_host_enrichment_seconds',
+    'Time spent identifying and probing one host',
+    buckets=STAGE_BUCKETS)
+DB_WRITE_SECONDS = Histogram(
+    'network_scanner_db_write_seconds',
+    'Duration of database write transactions',
+    ['operation'], buckets=DB_BUCKETS)
+TIMEOUTS = Counter(
+    'network_scanner_timeouts',
+    'Operations that timed out (connect = port scan connects)',
+    ['kind'])
+VENDOR_LOOKUPS = Counter(
+    'network_scanner_vendor_lookups',
+    'Vendor lookups by where the answer came from (registry, cache, api, miss)',
+    ['source'])
+VENDOR_HIT_RATIO = Gauge(
+    'network_scanner_vendor_cache_hit_ratio',
+    'Share of vendor lookups answered without the online API (offline registry or cache)')
+SCHEDULE_LAG_SECONDS = Histogram(
+    'network_scanner_schedule_lag_seconds',
+    'Delay between a scheduled task\'s deadline (plus jitter) and the start of its run',
+    ['task'], buckets=STAGE_BUCKETS)
+SKIPPED_RUNS = Counter(
+    'network_scanner_skipped_runs',
+    'Scheduled task runs skipped because the previous run overran its interval',
+    ['task'])
+STARTUP_SECONDS = Gauge(
+    'network_scanner_startup_seconds',
+    'Seconds from process start to the end of each startup phase (imports, restore, exporter, ..., first_scrape)',
+    ['phase'])
+QUEUE_DEPTH = Gauge(
+    'network_scanner_queue_depth',
+    'Items waiting in internal work queues (pipeline stages, scan jobs)',
+    ['queue'])
+
+_vendor_counts = {'registry': 0, 'cache': 0, 'api': 0, 'miss': 0}
+_vendor_lock = threading.Lock()
+
+
+def _vendor_hit_ratio():
+    with _vendor_lock:
+        total = sum(_vendor_counts.values())
+        hits = _vendor_counts['registry'] + _vendor_counts['cache']
+    return hits / total if total else 0
+
+
+VENDOR_HIT_RATIO.set_function(_vendor_hit_ratio)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Times a block into the stage duration histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def traced(stage):
+    """
+    Decorator timing every call of a function as `stage`.
+    """
+    def decorator(func):
+        histogram = STAGE_SECONDS.labels(stage)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def db_write_timer(operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_WRITE_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+
+def observe_enrichment(seconds):
+    HOST_ENRICHMENT_SECONDS.observe(seconds)
+
+
+def count_timeouts(kind, amount=1):
+    TIMEOUTS.labels(kind).inc(amount)
+
+
+def observe_schedule_lag(task, seconds):
+    SCHEDULE_LAG_SECONDS.labels(task).observe(seconds)
+
+
+def count_skipped_runs(task, amount=1):
+    SKIPPED_RUNS.labels(task).inc(amount)
+
+
+def record_vendor_lookup(source):
+    """
+    Counts a vendor lookup answered by `source` (registry, cache, api or miss).
+    """
+    VENDOR_LOOKUPS.labels(source).inc()
+    with _vendor_lock:
+        _vendor_counts[source] += 1
+
+
+def track_queue(name, size_func):
+    """
+    Exports the current length of a queue, read at scrape time.
+    """
+    QUEUE_DEPTH.labels(name).set_function(size_func)
+
+
+def untrack_queue(name):
+    try:
+        QUEUE_DEPTH.remove(name)
+    except KeyError:
+        pass
+
+
+# Dependencies that are only imported by the features needing them
+DEFERRED_MODULES = ("scapy.all", "flask", "requests")
+
+
+class StartupTimer:
+    """
+    Records when each startup phase ended, relative to process start, for
+    the startup report and the startup seconds gauge.
+    """
+
+    def __init__(self, start):
+        self.start = start  # time.monotonic() at process start
+        self.phases = []  # (phase, seconds since start)
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        elapsed = time.monotonic() - self.start
+        with self._lock:
+            self.phases.append((phase, elapsed))
+        STARTUP_SECONDS.labels(phase).set(elapsed)
+        return elapsed
+
+    def report(self):
+        """
+        One line per phase with its own duration and the time since start,
+        plus the heavy dependencies not loaded so far.
+        """
+        lines = ["Startup timing:"]
+        previous = 0.0
+        with self._lock:
+            phases = list(self.phases)
+        for phase, elapsed in phases:
+            lines.append(f"  {phase:<14} {elapsed - previous:8.3f}s   (at {elapsed:.3f}s)")
+            previous = elapsed
+        deferred = [name for name in DEFERRED_MODULES if name not in sys.modules]
+        lines.append(f"  not loaded yet: {', '.join(deferred) or 'none'}")
+        return "\n".join(lines)
+
+
+# Profiles running at once (one; sampling is process-wide)
+_profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds=10, interval=0.005):
+    """
+    Samples the stacks of all threads for `seconds` seconds.
+
+    Returns:
+        str: One line per distinct stack, "thread;outer;...;inner count",
+            most frequent first.
+
+    Raises:
+        RuntimeError: If another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        stacks = StackCounter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = [f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                          for entry in traceback.extract_stack(frame)]
+                stacks[";".join([names.get(ident, str(ident))] + frames)] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
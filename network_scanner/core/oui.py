@@ -0,0 +1,302 @@
+"""
+Offline MAC vendor registry.
+
+Loads the IEEE MA-L (OUI, /24), MA-M (/28) and MA-S (/36) assignment
+registries from local files into a compact in-memory index and resolves
+vendors by longest-prefix match, without any network access.
+
+Supported file formats:
+    - IEEE CSV exports (oui.csv, mam.csv, oui36.csv)
+    - Wireshark "manuf" files (MA-L/MA-M/MA-S in one file, "/28" and "/36" suffixes)
+
+The registry files are looked up in the package data directory, which can be
+populated on a machine with internet access with:
+
+    python -m network_scanner.core.oui --update
+
+If it holds no registry files, the Wireshark manuf database bundled with
+scapy (an install requirement) is used, so vendors resolve offline out of
+the box.
+"""
+
+import csv
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+IEEE_REGISTRIES = {
+    "oui.csv": "https://standards-oui.ieee.org/oui/oui.csv",
+    "mam.csv": "https://standards-oui.ieee.org/oui28/mam.csv",
+    "oui36.csv": "https://standards-oui.ieee.org/oui36/oui36.csv",
+}
+
+# Prefix lengths (in bits) from most to least specific
+PREFIX_BITS = (36, 28, 24)
+
+
+def mac_to_int(mac):
+    """
+    Converts a MAC address string (any common separator) to a 48-bit integer.
+    Returns None if the string is not a valid MAC address.
+    """
+    if not mac:
+        return None
+    digits = "".join(c for c in mac if c not in ":-. ")
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+def is_locally_administered(mac_int):
+    """
+    Returns True for locally administered (e.g. randomized) MAC addresses,
+    which are never present in the IEEE registries.
+    """
+    return bool((mac_int >> 40) & 0x02)
+
+
+class OUIIndex:
+    """
+    Longest-prefix-match index of MAC vendor assignments.
+
+    For each prefix length, prefixes are kept in a sorted array of integers
+    with a parallel array of indexes into a shared, de-duplicated list of
+    vendor names, so lookups are a handful of binary searches.
+    """
+
+    def __init__(self):
+        self._vendors = []
+        self._tables = {bits: (array("Q"), array("I")) for bits in PREFIX_BITS}
+
+    def __len__(self):
+        return sum(len(prefixes) for prefixes, _ in self._tables.values())
+
+    @classmethod
+    def build(cls, entries):
+        """
+        Builds an index from an iterable of (prefix_int, bits, vendor) tuples.
+        """
+        index = cls()
+        vendor_ids = {}
+        staged = {bits: {} for bits in PREFIX_BITS}
+        for prefix, bits, vendor in entries:
+            if bits not in staged:
+                continue
+            vendor_id = vendor_ids.get(vendor)
+            if vendor_id is None:
+                vendor_id = vendor_ids[vendor] = len(index._vendors)
+                index._vendors.append(vendor)
+            staged[bits][prefix] = vendor_id
+
+        for bits, mapping in staged.items():
+            prefixes, ids = index._tables[bits]
+            for prefix in sorted(mapping):
+                prefixes.append(prefix)
+                ids.append(mapping[prefix])
+        return index
+
+    def lookup(self, mac):
+        """
+        Returns the vendor for a MAC address (string or 48-bit int), or None.
+        """
+        mac_int = mac if isinstance(mac, int) else mac_to_int(mac)
+        if mac_int is None:
+            return None
+        for bits in PREFIX_BITS:
+            prefixes, ids = self._tables[bits]
+            if not prefixes:
+                continue
+            key = mac_int >> (48 - bits)
+            pos = bisect_left(prefixes, key)
+            if pos < len(prefixes) and prefixes[pos] == key:
+                return self._vendors[ids[pos]]
+        return None
+
+
+def _parse_ieee_csv(path):
+    """
+    Parses an IEEE registry CSV (Registry,Assignment,Organization Name,...).
+    """
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as fh:
+        reader = csv.reader(fh)
+        next(reader, None)  # Header
+        for row in reader:
+            if len(row) < 3:
+                continue
+            assignment = row[1].strip()
+            vendor = row[2].strip()
+            if not assignment or not vendor:
+                continue
+            try:
+                prefix = int(assignment, 16)
+            except ValueError:
+                continue
+            yield prefix, len(assignment) * 4, vendor
+
+
+def _parse_manuf_lines(lines):
+    """
+    Parses Wireshark manuf lines ("00:00:0C<TAB>Cisco<TAB>Cisco Systems, Inc").
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) < 2:
+            continue
+        address, _, bits = fields[0].strip().partition("/")
+        digits = "".join(c for c in address if c not in ":-.")
+        try:
+            bits = int(bits) if bits else len(digits) * 4
+            value = int(digits, 16)
+        except ValueError:
+            continue
+        # A prefix longer than the digits written ("00:1B:C5/36") is malformed
+        if not 0 < bits <= len(digits) * 4:
+            continue
+        vendor = (fields[2] if len(fields) > 2 else fields[1]).strip()
+        # Drop the host part of full-length entries ("00:1B:C5:00:00:00/36")
+        yield value >> (len(digits) * 4 - bits), bits, vendor
+
+
+def _parse_manuf(path):
+    """
+    Parses a Wireshark manuf file.
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as fh:
+        yield from _parse_manuf_lines(fh)
+
+
+def _bundled_manuf():
+    """
+    Lines of the Wireshark manuf database shipped with scapy, or None.
+    """
+    try:
+        from scapy.libs.manuf import DATA
+    except ImportError as e:
+        logger.debug(f"No bundled manuf database: {e}")
+        return None
+    return DATA.splitlines()
+
+
+def _registry_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path)
+                      if name.endswith(".csv") or name.startswith("manuf"))
+    if os.path.isfile(path):
+        return [path]
+    return []
+
+
+def load_index(paths=None):
+    """
+    Loads every registry file found in `paths` (files or directories) into an index.
+    Defaults to the package data directory, or to scapy's bundled manuf
+    database if that holds no registry files.
+    """
+    bundled = None
+    if paths is None:
+        paths = [DATA_DIR]
+        if not _registry_files(DATA_DIR):
+            bundled = _bundled_manuf()
+    elif isinstance(paths, str):
+        paths = [paths]
+
+    start = time.monotonic()
+    files = [f for p in paths for f in _registry_files(p)]
+
+    def entries():
+        for path in files:
+            parser = _parse_ieee_csv if path.endswith(".csv") else _parse_manuf
+            try:
+                for entry in parser(path):
+                    yield entry
+            except OSError as e:
+                logger.warning(f"Could not read OUI registry {path}: {e}")
+        if bundled is not None:
+            yield from _parse_manuf_lines(bundled)
+
+    index = OUIIndex.build(entries())
+    source = "scapy's manuf database" if bundled is not None else f"{len(files)} file(s)"
+    logger.debug(f"Loaded {len(index)} OUI assignments from {source} "
+                 f"in {(time.monotonic() - start) * 1000:.1f}ms")
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def set_registry_paths(paths):
+    """
+    Loads the registry from the given files/directories and makes it the active index.
+    """
+    global _index
+    index = load_index(paths)
+    with _index_lock:
+        _index = index
+    return index
+
+
+def get_index():
+    """
+    Returns the active OUI index, loading the bundled registry on first use.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = load_index()
+        return _index
+
+
+def lookup_vendor(mac):
+    """
+    Resolves a vendor from the offline registry. Returns None if unknown.
+    """
+    return get_index().lookup(mac)
+
+
+def update_registry(dest=DATA_DIR):
+    """
+    Downloads the IEEE registries into `dest`. Requires internet access.
+    """
+    import requests
+
+    os.makedirs(dest, exist_ok=True)
+    for name, url in IEEE_REGISTRIES.items():
+        logger.info(f"Downloading {url}")
+        response = requests.get(url, timeout=60)
+        response.raise_for_status()
+        tmp_path = os.path.join(dest, name + ".tmp")
+        with open(tmp_path, "wb") as fh:
+            fh.write(response.content)
+        os.replace(tmp_path, os.path.join(dest, name))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline OUI vendor registry")
+    parser.add_argument("--update", action="store_true", help="Download the IEEE registries")
+    parser.add_argument("--dest", default=DATA_DIR, help="Registry directory")
+    parser.add_argument("mac", nargs="*", help="MAC addresses to look up")
+    args = parser.parse_args()
+
+    if args.update:
+        update_registry(args.dest)
+    index = load_index(args.dest)
+    print(f"{len(index)} assignments loaded")
+    for mac in args.mac:
+        print(f"{mac}: {index.lookup(mac) or 'Unknown'}")
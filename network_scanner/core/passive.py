@@ -0,0 +1,274 @@
+"""
+Passive device discovery.
+
+Sniffs ARP, DHCP and mDNS traffic (BPF filter, so the kernel drops
+everything else) and keeps a live table of the devices seen, keyed by
+MAC: their current IP, and the hostnames and vendor hints that DHCP
+requests (host name, vendor class) and mDNS announcements (A records,
+advertised services) reveal. Active sweeps then skip addresses the
+passive view has seen recently.
+
+scapy is only imported once passive discovery is used. The same packet
+handler runs on live captures and on replayed pcap files:
+
+    python -m network_scanner.core.passive capture.pcap
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Listen passively and skip recently seen addresses in sweeps (--passive)
+ENABLED = False
+# Seconds a passively seen device counts as present
+MAX_AGE = 300
+BPF_FILTER = "arp or (udp and (port 67 or port 68 or port 5353))"
+
+# DHCP vendor class prefixes (option 60) -> vendor hint
+DHCP_VENDOR_HINTS = {
+    "msft": "Microsoft",
+    "android-dhcp": "Android",
+    "dhcpcd": "Linux",
+    "udhcp": "Embedded Linux",
+    "ubnt": "Ubiquiti",
+    "cisco": "Cisco",
+    "aruba": "Aruba",
+    "polycom": "Polycom",
+    "hp ": "HP",
+}
+# mDNS service types -> vendor hint
+MDNS_SERVICE_HINTS = {
+    "_googlecast._tcp": "Google Cast",
+    "_airplay._tcp": "Apple AirPlay",
+    "_raop._tcp": "Apple AirPlay",
+    "_companion-link._tcp": "Apple",
+    "_hap._tcp": "HomeKit",
+    "_sonos._tcp": "Sonos",
+    "_spotify-connect._tcp": "Spotify Connect",
+    "_ipp._tcp": "Printer",
+    "_ipps._tcp": "Printer",
+    "_printer._tcp": "Printer",
+    "_pdl-datastream._tcp": "Printer",
+    "_smb._tcp": "File Server",
+    "_adisk._tcp": "Apple Time Machine",
+    "_esphomelib._tcp": "ESPHome",
+    "_home-assistant._tcp": "Home Assistant",
+}
+
+
+def _vendor_class_hint(vendor_class):
+    value = vendor_class.lower()
+    for prefix, hint in DHCP_VENDOR_HINTS.items():
+        if value.startswith(prefix):
+            return hint
+    return vendor_class
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return str(value).strip().rstrip(".\x00")
+
+
+def _usable_ip(ip):
+    return ip and ip not in ("0.0.0.0", "255.255.255.255")
+
+
+def dns_records(dns):
+    """
+    Answer and additional records of a DNS message, whichever way this
+    scapy version represents sections (list or chained layers).
+    """
+    import scapy.all as scapy
+
+    records = []
+    for section in (dns.an, dns.ar):
+        for record in section if isinstance(section, list) else [section]:
+            while record is not None and hasattr(record, "rrname"):
+                records.append(record)
+                record = record.payload if not isinstance(record.payload, scapy.NoPayload) else None
+    return records
+
+
+class PassiveTable:
+    """
+    Thread-safe table of passively observed devices, keyed by MAC.
+    """
+
+    def __init__(self):
+        self._devices = {}  # mac -> {"mac", "ip", "hostname", "vendor_hint", "source", "last_seen"}
+        self._by_ip = {}  # ip -> mac
+        self._lock = threading.Lock()
+
+    def observe(self, mac, ip=None, source=None, hostname=None, vendor_hint=None, when=None):
+        if not mac or mac == "00:00:00:00:00:00" or mac == "ff:ff:ff:ff:ff:ff":
+            return
+        mac = mac.lower()
+        when = time.time() if when is None else when
+        with self._lock:
+            entry = self._devices.get(mac)
+            if entry is None:
+                entry = self._devices[mac] = {"mac": mac, "ip": None, "hostname": None, "vendor_hint": None,
+                                              "source": source, "last_seen": when}
+            if _usable_ip(ip) and entry["ip"] != ip:
+                if entry["ip"] and self._by_ip.get(entry["ip"]) == mac:
+                    del self._by_ip[entry["ip"]]
+                entry["ip"] = ip
+                self._by_ip[ip] = mac
+            if hostname:
+                entry["hostname"] = hostname
+            if vendor_hint:
+                entry["vendor_hint"] = vendor_hint
+            if source:
+                entry["source"] = source
+            entry["last_seen"] = max(entry["last_seen"], when)
+
+    def handle(self, packet):
+        """
+        Updates the table from one captured packet (ARP, DHCP or mDNS).
+        """
+        import scapy.all as scapy
+
+        try:
+            when = float(packet.time)
+            if packet.haslayer(scapy.ARP):
+                arp = packet[scapy.ARP]
+                self.observe(arp.hwsrc, arp.psrc, "arp", when=when)
+            elif packet.haslayer(scapy.DHCP):
+                self._handle_dhcp(packet, when)
+            elif packet.haslayer(scapy.DNS) and packet.haslayer(scapy.IP):
+                self._handle_mdns(packet, when)
+        except Exception as e:
+            logger.debug(f"Could not parse packet: {e}")
+
+    def _handle_dhcp(self, packet, when):
+        import scapy.all as scapy
+
+        bootp = packet[scapy.BOOTP]
+        mac = ":".join(f"{b:02x}" for b in bytes(bootp.chaddr)[:6])
+        options = {}
+        for option in packet[scapy.DHCP].options:
+            if isinstance(option, tuple) and len(option) >= 2:
+                options[option[0]] = option[1]
+        # Leased address (ACK), else the client's current or requested one
+        ip = None
+        for candidate in (bootp.yiaddr if options.get("message-type") == 5 else None, bootp.ciaddr,
+                          options.get("requested_addr")):
+            if _usable_ip(candidate):
+                ip = candidate
+                break
+        hostname = _text(options["hostname"]) if "hostname" in options else None
+        hint = _vendor_class_hint(_text(options["vendor_class_id"])) if "vendor_class_id" in options else None
+        self.observe(mac, ip, "dhcp", hostname, hint, when)
+
+    def _handle_mdns(self, packet, when):
+        import scapy.all as scapy
+
+        if not packet.haslayer(scapy.Ether) or packet[scapy.UDP].sport != 5353:
+            return
+        src_ip = packet[scapy.IP].src
+        mac = packet[scapy.Ether].src
+        hostname = None
+        hint = None
+        for record in dns_records(packet[scapy.DNS]):
+            name = _text(record.rrname)
+            if record.type == 1 and _text(record.rdata) == src_ip and name.endswith(".local"):
+                hostname = name[:-len(".local")]
+            elif record.type == 12:
+                for service, service_hint in MDNS_SERVICE_HINTS.items():
+                    if name.startswith(service) or _text(record.rdata).endswith(f"{service}.local"):
+                        hint = hint or service_hint
+        self.observe(mac, src_ip, "mdns", hostname, hint, when)
+
+    def recent(self, max_age=None, now=None):
+        """
+        Returns copies of the devices with an IP seen within `max_age` seconds.
+        """
+        max_age = MAX_AGE if max_age is None else max_age
+        now = time.time() if now is None else now
+        with self._lock:
+            return [dict(entry) for entry in self._devices.values()
+                    if entry["ip"] and now - entry["last_seen"] <= max_age]
+
+    def lookup_ip(self, ip):
+        """
+        Returns a copy of the device currently holding `ip`, or None.
+        """
+        with self._lock:
+            mac = self._by_ip.get(ip)
+            return dict(self._devices[mac]) if mac else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._devices)
+
+
+class PassiveListener:
+    """
+    Background sniffer feeding a PassiveTable. Needs capture privileges.
+    """
+
+    def __init__(self, table, iface=None):
+        self.table = table
+        self.iface = iface
+        self._sniffer = None
+
+    def start(self):
+        import scapy.all as scapy
+
+        self._sniffer = scapy.AsyncSniffer(iface=self.iface, filter=BPF_FILTER, prn=self.table.handle, store=False)
+        self._sniffer.start()
+        logger.info(f"Passive discovery listening ({BPF_FILTER})")
+        return self
+
+    def stop(self):
+        if self._sniffer is not None and self._sniffer.running:
+            self._sniffer.stop()
+        self._sniffer = None
+
+
+def replay(path, table=None):
+    """
+    Feeds the packets of a pcap/pcapng file to a table (a new one by default).
+    """
+    import scapy.all as scapy
+
+    table = table if table is not None else PassiveTable()
+    with scapy.PcapReader(path) as reader:
+        for packet in reader:
+            table.handle(packet)
+    return table
+
+
+_table = PassiveTable()
+_listener = None
+
+
+def get_table():
+    return _table
+
+
+def start(iface=None):
+    """
+    Starts the shared listener (once).
+    """
+    global _listener
+    if _listener is None:
+        _listener = PassiveListener(_table, iface).start()
+    return _listener
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Passive device discovery from pcap files")
+    parser.add_argument("pcap", nargs="+", help="Capture files to replay")
+    args = parser.parse_args()
+
+    for path in args.pcap:
+        replay(path, _table)
+    print(json.dumps(sorted(_table.recent(max_age=float("inf")), key=lambda d: d["mac"]), indent=2))
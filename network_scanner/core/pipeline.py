@@ -0,0 +1,145 @@
+"""
+Streaming scan pipeline.
+
+Stages are pools of worker threads connected by bounded queues. Each item
+moves to the next stage as soon as it is processed, so one slow host only
+delays itself, and a full queue blocks the upstream stage (backpressure)
+instead of buffering without limit.
+"""
+
+import queue
+import threading
+import time
+import logging
+
+from network_scanner.core import instrumentation
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """
+    Runs `func` on every item with `workers` threads.
+
+    Whatever `func` returns (unless None) is passed to the next stage.
+    Exceptions are logged and the item is dropped.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=100):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.downstream = None
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def put(self, item):
+        # Blocks while the queue is full
+        self.inbox.put(item)
+
+    def emit(self, result):
+        if result is not None and self.downstream is not None:
+            self.downstream.put(result)
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                return
+            try:
+                self.emit(self.func(item))
+            except Exception as e:
+                logger.error(f"Pipeline stage '{self.name}' failed: {e}", exc_info=True)
+
+    def close(self):
+        """
+        Waits until every queued item is processed and stops the workers.
+        """
+        for _ in self._threads:
+            self.inbox.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+
+class BatchStage(Stage):
+    """
+    Single-worker stage that calls `func` with lists of up to `batch_size`
+    items, or with whatever arrived within `max_wait` seconds. Each item of
+    the returned list is passed to the next stage.
+    """
+
+    def __init__(self, name, func, batch_size=50, max_wait=0.5, queue_size=500):
+        super().__init__(name, func, workers=1, queue_size=queue_size)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            for result in self.func(batch) or ():
+                self.emit(result)
+        except Exception as e:
+            logger.error(f"Pipeline stage '{self.name}' failed: {e}", exc_info=True)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(batch)
+                batch, deadline = [], None
+                continue
+            if item is _STOP:
+                self._flush(batch)
+                return
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.max_wait
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch, deadline = [], None
+
+
+class Pipeline:
+    """
+    Chains stages in order. Use as a context manager: items fed inside the
+    block are fully processed by every stage when the block exits.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.downstream = downstream
+
+    def __enter__(self):
+        for stage in self.stages:
+            stage.start()
+            instrumentation.track_queue(f"pipeline_{stage.name}", stage.inbox.qsize)
+        return self
+
+    def feed(self, item):
+        self.stages[0].put(item)
+
+    def close(self):
+        # Stages are drained in order, so everything an upstream stage emits
+        # is queued downstream before that stage is closed
+        for stage in self.stages:
+            stage.close()
+            instrumentation.untrack_queue(f"pipeline_{stage.name}")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
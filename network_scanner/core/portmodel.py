@@ -0,0 +1,278 @@
+"""
+Port knowledge: candidate port lists, device type rules and a model of
+which ports are likely open, learned from stored devices.
+
+The model estimates, per port, the probability that it is open on a
+device of a given vendor (and previous type), from the open ports stored
+for similar devices over the devices whose profile actually scanned that
+port (stored as probed_ports), so rates are not diluted by devices that
+were never asked. Estimates are smoothed towards the vendor-wide and then
+the network-wide rates, so small groups fall back gracefully. Port scans
+use it to probe the most likely ports first, to decide when scanning more
+of the wide candidate list is no longer worth it, and to pick the least
+probed ports to explore.
+"""
+
+import random
+import threading
+from collections import Counter
+
+# Common ports to scan (most frequently used services)
+COMMON_PORTS = [
+    21,    # FTP
+    22,    # SSH
+    23,    # Telnet
+    25,    # SMTP
+    53,    # DNS
+    80,    # HTTP
+    110,   # POP3
+    143,   # IMAP
+    443,   # HTTPS
+    445,   # SMB
+    3306,  # MySQL
+    3389,  # RDP
+    5432,  # PostgreSQL
+    5900,  # VNC
+    8080,  # HTTP Alt
+    8443,  # HTTPS Alt
+    9100,  # Prometheus Node Exporter
+    # IoT and Smart Home
+    1883,  # MQTT
+    8883,  # MQTT over SSL
+    # Common web services
+    3000,  # Node.js/React dev
+    5000,  # Flask default
+    5001,  # Synology DSM
+    8000,  # Python HTTP
+    8008,  # Google Home
+    8081,  # Common alt HTTP
+    8090,  # Common alt HTTP
+    8888,  # Jupyter
+    9000,  # Portainer
+    9090,  # Prometheus
+]
+
+# Well-known service ports above 1024 that aren't in COMMON_PORTS
+SERVICE_PORTS = [
+    1400,   # Sonos
+    1433,   # MSSQL
+    1521,   # Oracle
+    1723,   # PPTP
+    1900,   # UPnP (some TCP stacks)
+    2000,   # Cisco SCCP / MikroTik bandwidth test
+    2049,   # NFS
+    2375, 2376,  # Docker
+    2379,   # etcd
+    3128,   # Squid
+    3689,   # DAAP / iTunes
+    4443,   # HTTPS alt
+    5060,   # SIP
+    5222,   # XMPP
+    5353,   # mDNS (TCP)
+    5357,   # WSD
+    5555,   # ADB
+    5672,   # AMQP
+    5984,   # CouchDB
+    6000,   # X11
+    6379,   # Redis
+    6443,   # Kubernetes API
+    7000,   # AirPlay
+    7001,   # WebLogic
+    7100,   # AirPlay alt
+    8009,   # AJP / Chromecast
+    8088,   # HTTP alt
+    8089,   # Splunk
+    8123,   # Home Assistant
+    8181,   # HTTP alt
+    8200,   # Vault
+    8291,   # MikroTik Winbox
+    8333,   # Bitcoin
+    8554,   # RTSP alt
+    8880,   # HTTP alt
+    9001,   # Tor / Supervisor
+    9092,   # Kafka
+    9200, 9300,  # Elasticsearch
+    9443,   # HTTPS alt
+    9999,   # Misc admin
+    10000,  # Webmin
+    10250,  # Kubelet
+    11211,  # Memcached
+    15672,  # RabbitMQ management
+    27017,  # MongoDB
+    32400,  # Plex
+    34567,  # DVR
+    37777,  # Dahua DVR
+    49152, 49153,  # UPnP
+    62078,  # iOS sync
+]
+
+# Wide candidate list (top-1000 style): common and service ports first,
+# then the remaining well-known ports
+WIDE_PORT_COUNT = 1000
+WIDE_PORTS = list(dict.fromkeys(COMMON_PORTS + SERVICE_PORTS + list(range(1, 1025))))[:WIDE_PORT_COUNT]
+
+# Device type rules, first match wins: (type, ports that must be open, ports that must be closed)
+TYPE_RULES = [
+    ("Node Exporter", {9100}, set()),
+    ("Windows PC", {3389}, set()),
+    ("Linux Server", {22}, {80}),
+    ("Windows/Samba", {445}, set()),
+    ("Web Server", {80}, set()),
+    ("Web Server", {443}, set()),
+    ("MQTT Broker", {1883}, set()),
+    ("MQTT Broker", {8883}, set()),
+]
+# Ports whose state decides the device type
+CLASSIFY_PORTS = sorted({port for _, required, excluded in TYPE_RULES for port in required | excluded})
+
+# Prior open rates with no history at all
+PRIOR_COMMON = 0.05
+PRIOR_OTHER = 0.002
+# Weight (in devices) of the broader estimate when smoothing a group's rates
+SMOOTHING = 5
+# Devices of a vendor needed before its history may replace the full common-port scan
+MIN_HISTORY = 5
+
+_COMMON_SET = frozenset(COMMON_PORTS)
+_WIDE_SET = frozenset(WIDE_PORTS)
+
+
+def pack_ports(ports):
+    """
+    Compact text form of a set of ports, as stored with devices ("1-1024,8080").
+    """
+    ranges = []
+    for port in sorted(set(ports)):
+        if ranges and ranges[-1][1] == port - 1:
+            ranges[-1][1] = port
+        else:
+            ranges.append([port, port])
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def unpack_ports(text):
+    """
+    Ports of a pack_ports() string (empty for None or malformed input).
+    """
+    ports = set()
+    for part in (text or "").split(","):
+        start, _, end = part.partition("-")
+        try:
+            ports.update(range(int(start), int(end or start) + 1))
+        except ValueError:
+            continue
+    return ports
+
+
+def prior(port):
+    """
+    Open rate assumed for a port without any history.
+    """
+    return PRIOR_COMMON if port in _COMMON_SET else PRIOR_OTHER
+
+
+def classify(open_ports):
+    """
+    Device type from its open ports.
+    """
+    open_set = set(open_ports)
+    for device_type, required, excluded in TYPE_RULES:
+        if required <= open_set and not excluded & open_set:
+            return device_type
+    return "Unknown"
+
+
+class PortModel:
+    """
+    Per-port open probabilities, overall and per vendor / (vendor, type).
+    """
+
+    def __init__(self, devices=()):
+        self.total = 0
+        self.counts = Counter()
+        self.probed = Counter()
+        self.vendor_totals = Counter()
+        self.vendor_counts = {}
+        self.vendor_probed = {}
+        self.group_counts = {}
+        self.group_probed = {}
+        for device in devices:
+            self.add(device)
+
+    def add(self, device):
+        ports = set(device.get('open_ports') or ())
+        # Profiles stored before probed ports were recorded scanned COMMON_PORTS
+        probed = unpack_ports(device.get('probed_ports')) or set(COMMON_PORTS)
+        probed = {port for port in probed if port in _WIDE_SET} | ports
+        vendor = device.get('vendor') or 'Unknown'
+        group = (vendor, device.get('type') or 'Unknown')
+        self.total += 1
+        self.counts.update(ports)
+        self.probed.update(probed)
+        self.vendor_totals[vendor] += 1
+        self.vendor_counts.setdefault(vendor, Counter()).update(ports)
+        self.vendor_probed.setdefault(vendor, Counter()).update(probed)
+        self.group_counts.setdefault(group, Counter()).update(ports)
+        self.group_probed.setdefault(group, Counter()).update(probed)
+
+    def confident(self, vendor):
+        return vendor not in (None, 'Unknown') and self.vendor_totals[vendor] >= MIN_HISTORY
+
+    def probabilities(self, vendor=None, device_type=None, ports=None):
+        """
+        Returns {port: estimated probability that it is open} for `ports`
+        (default WIDE_PORTS).
+        """
+        if ports is None:
+            ports = WIDE_PORTS
+        vendor_counts = self.vendor_counts.get(vendor, Counter())
+        vendor_probed = self.vendor_probed.get(vendor, Counter())
+        group = (vendor, device_type)
+        group_counts = self.group_counts.get(group, Counter()) if device_type else Counter()
+        group_probed = self.group_probed.get(group, Counter()) if device_type else Counter()
+
+        result = {}
+        for port in ports:
+            p = (self.counts[port] + SMOOTHING * prior(port)) / (self.probed[port] + SMOOTHING)
+            p = (vendor_counts[port] + SMOOTHING * p) / (vendor_probed[port] + SMOOTHING)
+            p = (group_counts[port] + SMOOTHING * p) / (group_probed[port] + SMOOTHING)
+            result[port] = p
+        return result
+
+    def rank(self, vendor=None, device_type=None, ports=None):
+        """
+        Returns [(port, probability)] most likely first. Ties keep the
+        candidate list order.
+        """
+        probabilities = self.probabilities(vendor, device_type, ports)
+        return sorted(probabilities.items(), key=lambda item: -item[1])
+
+    def least_probed(self, count, exclude=(), rng=random):
+        """
+        Returns up to `count` wide ports probed on the fewest devices
+        (ties in random order, so hosts explore different ports).
+        """
+        exclude = set(exclude)
+        candidates = [port for port in WIDE_PORTS if port not in exclude]
+        keys = {port: (self.probed[port], rng.random()) for port in candidates}
+        return sorted(candidates, key=keys.__getitem__)[:count]
+
+
+_model = PortModel()
+_model_lock = threading.Lock()
+
+
+def learn(devices):
+    """
+    Rebuilds the shared model from stored devices.
+    """
+    global _model
+    model = PortModel(devices)
+    with _model_lock:
+        _model = model
+    return model
+
+
+def get_model():
+    with _model_lock:
+        return _model
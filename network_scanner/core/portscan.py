@@ -0,0 +1,324 @@
+"""
+Asynchronous TCP connect engine.
+
+A single asyncio event loop runs in a background thread and multiplexes every
+non-blocking connect issued by the application, so thousands of probes can be
+in flight at once without one thread or blocking socket per port. Callers from
+any thread (enrichment workers, the web server) submit scans to the shared loop,
+which lets the global concurrency cap and rate limits apply process-wide.
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+from network_scanner.core import budget, instrumentation, rtt
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of connects in flight across all hosts
+DEFAULT_CONCURRENCY = 2000
+# Maximum number of connects in flight against a single host
+DEFAULT_HOST_CONCURRENCY = 512
+# Connect attempts per second (0 = unlimited)
+DEFAULT_RATE = 0
+DEFAULT_HOST_RATE = 0
+
+# File descriptors kept free for the database, HTTP servers, etc.
+FD_RESERVE = 128
+
+
+def _fd_limit(requested):
+    """
+    Clamps the requested concurrency to the process file descriptor limit.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return requested
+
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < requested + FD_RESERVE:
+            # Try to raise the soft limit before giving up on concurrency
+            target = requested + FD_RESERVE
+            if hard != resource.RLIM_INFINITY:
+                target = min(target, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        if soft != resource.RLIM_INFINITY:
+            return max(1, min(requested, soft - FD_RESERVE))
+    except (ValueError, OSError) as e:
+        logger.debug(f"Could not adjust file descriptor limit: {e}")
+    return requested
+
+
+class TokenBucket:
+    """
+    Simple token bucket used to rate limit connect attempts.
+    Only used from the engine's event loop, so no locking is required.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PortScanEngine:
+    """
+    Shared non-blocking connect engine.
+
+    Args:
+        concurrency (int): Global cap of connects in flight.
+        host_concurrency (int): Cap of connects in flight per target host.
+        rate (float): Global connects per second (0 = unlimited).
+        host_rate (float): Connects per second per target host (0 = unlimited).
+        rtt_table (RttTable): Per-host RTT estimates used for adaptive timeouts
+            and updated from every answered connect (default: the shared table).
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, host_concurrency=DEFAULT_HOST_CONCURRENCY,
+                 rate=DEFAULT_RATE, host_rate=DEFAULT_HOST_RATE, rtt_table=None):
+        self.concurrency = _fd_limit(concurrency)
+        self.host_concurrency = max(1, min(host_concurrency, self.concurrency))
+        self.rate = rate
+        self.host_rate = host_rate
+        self.rtt = rtt_table or rtt.get_table()
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # Created lazily inside the event loop
+        self._global_sem = None
+        self._global_bucket = None
+        self._hosts = {}  # ip -> [refcount, semaphore, bucket]
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="portscan-engine", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            logger.debug(f"Port scan engine started (concurrency={self.concurrency}, "
+                         f"per-host={self.host_concurrency}, rate={self.rate}, host_rate={self.host_rate})")
+            return loop
+
+    def _acquire_host(self, ip):
+        entry = self._hosts.get(ip)
+        if entry is None:
+            bucket = TokenBucket(self.host_rate) if self.host_rate else None
+            entry = [0, asyncio.Semaphore(self.host_concurrency), bucket]
+            self._hosts[ip] = entry
+        entry[0] += 1
+        return entry
+
+    def _release_host(self, ip):
+        entry = self._hosts.get(ip)
+        if entry is not None:
+            entry[0] -= 1
+            if entry[0] <= 0:
+                del self._hosts[ip]
+
+    async def _connect(self, ip, port, timeout, samples=None, on_connect=None):
+        """
+        Attempts a single non-blocking TCP connect. If the host answered
+        (SYN-ACK or RST), the round-trip time is appended to `samples`.
+        On success, `on_connect(ip, port, sock)` is awaited before the socket
+        is closed, so the connection can be reused (e.g. to read a banner).
+
+        Returns:
+            True if the port is open, False if refused, None if the connect timed out.
+        """
+        loop = asyncio.get_event_loop()
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError as e:
+            logger.debug(f"Could not create socket for {ip}:{port} - {e}")
+            return False
+        sock.setblocking(False)
+        start = loop.time()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+            if samples is not None:
+                samples.append(loop.time() - start)
+            if on_connect is not None:
+                try:
+                    await on_connect(ip, port, sock)
+                except Exception as e:
+                    logger.debug(f"Connect hook failed for {ip}:{port} - {e}")
+            return True
+        except asyncio.TimeoutError:
+            return None
+        except ConnectionRefusedError:
+            if samples is not None:
+                samples.append(loop.time() - start)
+            return False
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+    async def _probe(self, ip, port, timeout, host, samples=None, on_connect=None):
+        _, host_sem, host_bucket = host
+        async with host_sem:
+            if host_bucket is not None:
+                await host_bucket.acquire()
+            async with self._global_sem:
+                if self._global_bucket is not None:
+                    await self._global_bucket.acquire()
+                wait = budget.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                return await self._connect(ip, port, timeout, samples, on_connect)
+
+    async def scan_async(self, ip, ports, timeout=None, progress=None, on_open=None, cancel=None,
+                         progress_every=1000, retries=None, on_connect=None):
+        """
+        Scans the given ports on one host from within the engine loop.
+
+        With `timeout` None, the connect timeout and the number of retries
+        of timed-out ports come from the host's RTT estimate. Every retry
+        doubles the timeout. Answered connects update the estimate.
+        """
+        if self._global_sem is None:
+            self._global_sem = asyncio.Semaphore(self.concurrency)
+            self._global_bucket = TokenBucket(self.rate) if self.rate else None
+
+        ports = list(ports)
+        total = len(ports)
+        open_ports = []
+        if not total:
+            return open_ports
+
+        if timeout is None:
+            timeout = self.rtt.timeout(ip)
+            if retries is None:
+                retries = self.rtt.retries(ip)
+        retries = retries or 0
+
+        host = self._acquire_host(ip)
+        scanned = [0]
+        samples = []
+
+        async def worker(port_iter, timeout, timed_out, first_pass):
+            for port in port_iter:
+                if cancel is not None and cancel.is_set():
+                    return
+                result = await self._probe(ip, port, timeout, host, samples, on_connect)
+                if result:
+                    open_ports.append(port)
+                    if on_open is not None:
+                        on_open(port)
+                elif result is None:
+                    timed_out.append(port)
+                if first_pass:
+                    scanned[0] += 1
+                    if progress is not None and scanned[0] % progress_every == 0:
+                        progress(scanned[0], total, port)
+
+        timed_out = []
+        try:
+            pending = ports
+            for attempt in range(retries + 1):
+                if attempt:
+                    timeout = min(rtt.MAX_TIMEOUT, timeout * 2)
+                port_iter = iter(pending)
+                timed_out = []
+                workers = min(self.host_concurrency, len(pending))
+                await asyncio.gather(*(worker(port_iter, timeout, timed_out, attempt == 0)
+                                       for _ in range(workers)))
+                pending = timed_out
+                if not pending or (cancel is not None and cancel.is_set()):
+                    break
+        finally:
+            self._release_host(ip)
+            self.rtt.update_many(ip, samples)
+            if timed_out:
+                instrumentation.count_timeouts("connect", len(timed_out))
+
+        if progress is not None and scanned[0] % progress_every:
+            progress(scanned[0], total, ports[-1])
+        return sorted(open_ports)
+
+    def scan(self, ip, ports, timeout=None, progress=None, on_open=None, cancel=None, progress_every=1000,
+             retries=None, on_connect=None):
+        """
+        Scans ports on a single host, blocking the calling thread until done.
+
+        Args:
+            ip (str): Target IP address.
+            ports (iterable): Ports to check.
+            timeout (float): Connect timeout per port in seconds
+                (None = adaptive, from the host's RTT estimate).
+            progress (callable): Optional callback (scanned, total, last_port),
+                invoked every `progress_every` ports from the engine thread.
+            on_open (callable): Optional callback (port) invoked for every open port.
+            cancel (threading.Event): Optional event that stops the scan when set.
+            retries (int): Extra attempts for timed-out ports (None = adaptive
+                with an adaptive timeout, 0 otherwise).
+            on_connect (coroutine function): Optional hook (ip, port, sock)
+                awaited on the engine loop for every successful connect, before
+                the socket is closed. It holds the connect's concurrency slot.
+
+        Returns:
+            list: Sorted list of open ports.
+        """
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self.scan_async(ip, ports, timeout, progress, on_open, cancel, progress_every, retries, on_connect),
+            loop)
+        return future.result()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def configure(concurrency=DEFAULT_CONCURRENCY, host_concurrency=DEFAULT_HOST_CONCURRENCY,
+              rate=DEFAULT_RATE, host_rate=DEFAULT_HOST_RATE):
+    """
+    Replaces the shared engine with one using the given limits.
+    Should be called once at startup, before any scan runs.
+    """
+    global _engine
+    with _engine_lock:
+        _engine = PortScanEngine(concurrency, host_concurrency, rate, host_rate)
+    return _engine
+
+
+def get_engine():
+    """
+    Returns the process-wide port scan engine, creating it with defaults if needed.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PortScanEngine()
+        return _engine
+
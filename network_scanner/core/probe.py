@@ -1,26 +1,171 @@
-import requests
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from network_scanner.core import budget, instrumentation
 
 logger = logging.getLogger(__name__)
 
-def check_metrics(ip, ports=[9100, 8080, 80, 3000, 9090]):
+# Ports checked for a /metrics endpoint
+METRICS_PORTS = (9100, 8080, 80, 3000, 9090)
+
+PROBE_TIMEOUT = 1
+# Only the start of the body is read to detect the exposition format
+PROBE_READ_BYTES = 4096
+# Rest of the body read and discarded, so the connection goes back to the
+# pool; larger bodies are cut off and their connection is closed instead
+PROBE_DRAIN_BYTES = 256 * 1024
+PROBE_WORKERS = 32
+# Seconds a positive result is reused without probing again
+CACHE_TTL = 600
+
+_session = None
+_session_lock = threading.Lock()
+_executor = None
+_cache = {}  # (ip, port) -> (url, expires)
+_cache_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the shared HTTP session, whose connection pool is reused across probes.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=PROBE_WORKERS, pool_maxsize=PROBE_WORKERS, max_retries=0)
+            session.mount("http://", adapter)
+            session.headers["Accept"] = "application/openmetrics-text;q=0.9, text/plain;q=0.8, */*;q=0.1"
+            _session = session
+        return _session
+
+def _get_executor():
+    global _executor
+    with _session_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="metrics-probe")
+        return _executor
+
+def looks_like_metrics(content_type, head):
+    """
+    Basic check to see if a response looks like Prometheus/OpenMetrics exposition.
+    """
+    if "openmetrics-text" in content_type:
+        return True
+    return b"# HELP" in head or b"# TYPE" in head
+
+def _drain(response):
+    """
+    Reads the rest of a streamed response if it is small enough, so urllib3
+    returns the connection to the pool instead of closing it.
+    """
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > PROBE_READ_BYTES + PROBE_DRAIN_BYTES:
+        return
+    drained = 0
+    while drained < PROBE_DRAIN_BYTES:
+        chunk = response.raw.read(16384, decode_content=True)
+        if not chunk:
+            return
+        drained += len(chunk)
+
+def probe_port(ip, port):
+    """
+    Checks a single port for a /metrics endpoint. Detection uses at most
+    PROBE_READ_BYTES of the body; up to PROBE_DRAIN_BYTES more are read and
+    discarded so the pooled connection can be reused by the next probe.
+
+    Returns:
+        str: The metrics URL, or None.
+    """
+    import requests
+
+    url = f"http://{ip}:{port}/metrics"
+    budget.acquire()
+    try:
+        with get_session().get(url, timeout=PROBE_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                return None
+            head = response.raw.read(PROBE_READ_BYTES, decode_content=True) or b""
+            found = looks_like_metrics(response.headers.get("Content-Type", ""), head)
+            _drain(response)
+            if found:
+                return url
+    except requests.Timeout:
+        instrumentation.count_timeouts("metrics_probe")
+    except requests.RequestException:
+        pass
+    except Exception as e:
+        logger.debug(f"Metrics probe failed for {url}: {e}")
+    return None
+
+def _cached(ip, port, now):
+    with _cache_lock:
+        entry = _cache.get((ip, port))
+        if entry and entry[1] > now:
+            return entry[0]
+        if entry:
+            del _cache[(ip, port)]
+    return None
+
+@instrumentation.traced("metrics_probe")
+def check_metrics(ip, ports=METRICS_PORTS, open_ports=None, use_cache=True):
     """
     Checks if any of the common ports expose a /metrics endpoint.
-    
+
+    Ports are probed concurrently over the shared connection pool. When
+    `open_ports` (from a port scan) is given, ports not in it are skipped.
+    Positive results are cached for CACHE_TTL seconds; with `use_cache`
+    False every port is probed again and the cache is refreshed with the
+    results (endpoints that went away are dropped from it).
+
     Returns:
         list: List of URLs that returned 200 OK for /metrics.
     """
-    available_metrics = []
-    
+    if open_ports is not None:
+        open_set = set(open_ports)
+        ports = [port for port in ports if port in open_set]
+
+    now = time.time()
+    found = {}
+    to_probe = []
     for port in ports:
-        url = f"http://{ip}:{port}/metrics"
-        try:
-            response = requests.get(url, timeout=1)
-            if response.status_code == 200:
-                # Basic check to see if it looks like Prometheus metrics
-                if "# HELP" in response.text or "# TYPE" in response.text:
-                    available_metrics.append(url)
-        except requests.RequestException:
-            continue
-            
-    return available_metrics
+        url = _cached(ip, port, now) if use_cache else None
+        if url:
+            found[port] = url
+        else:
+            to_probe.append(port)
+
+    if to_probe:
+        results = _get_executor().map(lambda port: probe_port(ip, port), to_probe)
+        expires = time.time() + CACHE_TTL
+        for port, url in zip(to_probe, results):
+            if url:
+                found[port] = url
+                with _cache_lock:
+                    _cache[(ip, port)] = (url, expires)
+            elif not use_cache:
+                with _cache_lock:
+                    _cache.pop((ip, port), None)
+
+    return [found[port] for port in ports if port in found]
+
+def check_metrics_many(hosts, ports=METRICS_PORTS, use_cache=True):
+    """
+    Probes several hosts at once.
+
+    Args:
+        hosts (dict): Mapping of ip -> open ports from a scan (or None to probe all `ports`).
+        use_cache (bool): Reuse cached positive results (see check_metrics).
+
+    Returns:
+        dict: Mapping of ip -> list of metrics URLs.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(len(hosts), PROBE_WORKERS))) as executor:
+        futures = {ip: executor.submit(check_metrics, ip, ports, open_ports, use_cache)
+                   for ip, open_ports in hosts.items()}
+        return {ip: future.result() for ip, future in futures.items()}
@@ -0,0 +1,123 @@
+"""
+Per-host round-trip time estimation for adaptive connect timeouts.
+
+Follows the TCP retransmission timer (RFC 6298): a smoothed RTT (SRTT)
+and RTT variation (RTTVAR) per host, updated from every connect that got
+an answer (SYN-ACK or RST), and seeded from the ARP/ping reply time of
+discovery. The connect timeout is SRTT + 4 * RTTVAR, so close, stable
+hosts don't make filtered ports cost a fixed 0.3s, and slow or jittery
+ones (busy Wi-Fi) get enough time, plus retries, to avoid false negatives.
+"""
+
+import threading
+
+# Timeout for hosts without any estimate yet
+DEFAULT_TIMEOUT = 0.3
+# Bounds of adaptive timeouts
+MIN_TIMEOUT = 0.1
+MAX_TIMEOUT = 3.0
+
+# RFC 6298 gains
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+# Timed-out ports are retried (with a doubled timeout) on jittery hosts:
+# one retry once RTTVAR exceeds JITTER_RATIO * SRTT, two once it exceeds SRTT
+JITTER_RATIO = 0.5
+MAX_RETRIES = 2
+
+
+class HostRtt:
+    __slots__ = ("srtt", "rttvar")
+
+    def __init__(self, srtt, rttvar):
+        self.srtt = srtt
+        self.rttvar = rttvar
+
+    def update(self, sample):
+        self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - sample)
+        self.srtt = (1 - ALPHA) * self.srtt + ALPHA * sample
+
+    def timeout(self):
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, self.srtt + K * self.rttvar))
+
+    def retries(self):
+        if self.rttvar > self.srtt:
+            return MAX_RETRIES
+        if self.rttvar > JITTER_RATIO * self.srtt:
+            return 1
+        return 0
+
+
+class RttTable:
+    """
+    Thread-safe RTT estimates keyed by IP address.
+    """
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def seed(self, ip, rtt=None, srtt=None, rttvar=None):
+        """
+        Initializes the estimate of a host that has none yet, from either a
+        stored (srtt, rttvar) pair or a single RTT measurement.
+        """
+        if srtt is None and rtt is None:
+            return
+        with self._lock:
+            if ip in self._hosts:
+                return
+            if srtt is not None:
+                self._hosts[ip] = HostRtt(srtt, rttvar if rttvar is not None else srtt / 2)
+            else:
+                self._hosts[ip] = HostRtt(rtt, rtt / 2)
+
+    def update(self, ip, sample):
+        with self._lock:
+            host = self._hosts.get(ip)
+            if host is None:
+                self._hosts[ip] = HostRtt(sample, sample / 2)
+            else:
+                host.update(sample)
+
+    def update_many(self, ip, samples):
+        if not samples:
+            return
+        with self._lock:
+            host = self._hosts.get(ip)
+            if host is None:
+                host = self._hosts[ip] = HostRtt(samples[0], samples[0] / 2)
+                samples = samples[1:]
+            for sample in samples:
+                host.update(sample)
+
+    def timeout(self, ip, default=DEFAULT_TIMEOUT):
+        with self._lock:
+            host = self._hosts.get(ip)
+            return host.timeout() if host else default
+
+    def retries(self, ip):
+        with self._lock:
+            host = self._hosts.get(ip)
+            return host.retries() if host else 0
+
+    def get(self, ip):
+        """
+        Returns {"srtt", "rttvar"} for a host, or an empty dict.
+        """
+        with self._lock:
+            host = self._hosts.get(ip)
+            return {"srtt": host.srtt, "rttvar": host.rttvar} if host else {}
+
+    def forget(self, ip):
+        with self._lock:
+            self._hosts.pop(ip, None)
+
+
+_table = RttTable()
+
+
+def get_table():
+    return _table
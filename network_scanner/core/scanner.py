@@ -1,107 +1,288 @@
-import scapy.all as scapy
 import socket
+import ipaddress
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from network_scanner.core import budget, icmp, instrumentation, passive
 
 logger = logging.getLogger(__name__)
 
+# Large networks are split into shards of this prefix length and swept concurrently
+SHARD_PREFIX = 24
+MAX_SHARD_WORKERS = 8
+# Timeout of the first ARP pass over a shard
+ARP_TIMEOUT = 1.0
+# Bounds of the adaptive timeout used for retransmissions
+ARP_MIN_TIMEOUT = 0.2
+# Retransmission rounds for unanswered addresses in shards with live hosts
+ARP_RETRIES = 1
+
+def parse_ranges(ip_range):
+    """
+    Parses one or more CIDR ranges into a list of networks.
+
+    Args:
+        ip_range (str, network or list): "192.168.1.0/24", "10.0.0.0/22,10.1.0.0/22",
+            an ipaddress network, or a list of those. Host bits are ignored ("192.168.1.1/24").
+
+    Returns:
+        list: Collapsed list of ipaddress.IPv4Network objects.
+    """
+    if isinstance(ip_range, (str, ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        ip_range = [ip_range]
+    networks = []
+    for item in ip_range:
+        if not isinstance(item, str):
+            networks.append(item)
+            continue
+        for part in item.split(","):
+            part = part.strip()
+            if part:
+                networks.append(ipaddress.ip_network(part, strict=False))
+    return list(ipaddress.collapse_addresses(n for n in networks if n.version == 4))
+
+def get_interface_network(local_ip):
+    """
+    Returns the directly connected network of a local address, using the
+    routing table, or None if it can't be determined.
+    """
+    import scapy.all as scapy
+
+    best = None
+    try:
+        for net, mask, gateway, _iface, addr, _metric in scapy.conf.route.routes:
+            if addr != local_ip or gateway != "0.0.0.0" or mask in (0, 0xFFFFFFFF):
+                continue
+            prefixlen = bin(mask).count("1")
+            if best is None or prefixlen > best.prefixlen:
+                best = ipaddress.ip_network(f"{scapy.ltoa(net)}/{prefixlen}", strict=False)
+    except Exception as e:
+        logger.debug(f"Could not read routing table: {e}")
+    return best
+
+def shard_networks(networks, prefix=None):
+    """
+    Splits networks larger than `prefix` into subnets of that size.
+    """
+    if prefix is None:
+        prefix = SHARD_PREFIX
+    shards = []
+    for network in networks:
+        if network.prefixlen < prefix:
+            shards.extend(network.subnets(new_prefix=prefix))
+        else:
+            shards.append(network)
+    return shards
+
+def _arp_sweep(targets, timeout):
+    """
+    Sends one ARP request per target and returns (answers, rtts), both
+    keyed by IP. `targets` is a CIDR string or a list of IP strings.
+    """
+    # Imported on first use: loading scapy takes seconds on small machines
+    import scapy.all as scapy
+
+    budget.acquire(len(targets) if isinstance(targets, list) else ipaddress.ip_network(targets).num_addresses)
+    arp_request = scapy.ARP(pdst=targets)
+    broadcast = scapy.Ether(dst="ff:ff:ff:ff:ff:ff")
+    arp_request_broadcast = broadcast/arp_request
+
+    # srp returns two lists: answered and unanswered packets
+    answered_list = scapy.srp(arp_request_broadcast, timeout=timeout, verbose=False)[0]
+    answers = {}
+    rtts = {}
+    for sent, received in answered_list:
+        answers[received.psrc] = received.hwsrc
+        if getattr(sent, 'sent_time', None):
+            rtts[received.psrc] = received.time - sent.sent_time
+    return answers, rtts
+
+def _sweep_shard(shard, skip=()):
+    """
+    ARP-sweeps one shard, except the addresses in `skip`. Unanswered
+    addresses are retransmitted with an adaptive timeout, but only if the
+    shard has live hosts at all, so empty address space costs a single pass.
+
+    Returns:
+        tuple: (ip -> mac, ip -> ARP round-trip time)
+    """
+    targets = str(shard)
+    if skip:
+        targets = [str(ip) for ip in shard.hosts() if str(ip) not in skip]
+        if not targets:
+            return {}, {}
+    answers, rtts = _arp_sweep(targets, ARP_TIMEOUT)
+    if not answers:
+        return answers, rtts
+
+    for _ in range(ARP_RETRIES):
+        missing = [str(ip) for ip in shard.hosts() if str(ip) not in answers and str(ip) not in skip]
+        if not missing:
+            break
+        # A few times the slowest reply seen, within [ARP_MIN_TIMEOUT, ARP_TIMEOUT]
+        timeout = ARP_TIMEOUT
+        if rtts:
+            timeout = min(ARP_TIMEOUT, max(ARP_MIN_TIMEOUT, 3 * max(rtts.values())))
+        retry_answers, retry_rtts = _arp_sweep(missing, timeout)
+        if not retry_answers:
+            break
+        answers.update(retry_answers)
+        rtts.update(retry_rtts)
+    return answers, rtts
+
 def scan_network(ip_range):
     """
     Scans the network for active devices using ARP requests.
+
+    Every range is swept in shards of /SHARD_PREFIX concurrently. Ranges
+    where ARP finds nothing (e.g. not directly attached) fall back to a
+    ping scan.
     
     Args:
-        ip_range (str): The IP range to scan (e.g., "192.168.1.0/24").
+        ip_range (str or list): The IP range(s) to scan (e.g., "192.168.1.0/24",
+            "10.0.0.0/22,10.4.0.0/16").
         
     Returns:
-        list: A list of dictionaries containing 'ip' and 'mac' of discovered devices.
+        list: A list of dictionaries containing 'ip', 'mac', 'discovery' (method) and 'rtt'
+            (reply time in seconds, or None) of discovered devices.
+    """
+    return list(iter_network(ip_range))
+
+def _passive_devices(network, table):
+    """
+    Devices of `network` the passive listener saw recently, as discovery yields them.
+    """
+    devices = []
+    for entry in table.recent():
+        try:
+            if ipaddress.IPv4Address(entry["ip"]) not in network:
+                continue
+        except ValueError:
+            continue
+        devices.append({"ip": entry["ip"], "mac": entry["mac"], "discovery": "passive", "rtt": None,
+                        "hostname": entry["hostname"], "vendor_hint": entry["vendor_hint"]})
+    return devices
+
+def _annotate(device, table):
+    # Hostname and vendor hint learned passively for an actively found device
+    entry = table.lookup_ip(device["ip"])
+    if entry and entry["mac"] == str(device["mac"]).lower():
+        device["hostname"] = entry["hostname"]
+        device["vendor_hint"] = entry["vendor_hint"]
+    return device
+
+def iter_network(ip_range):
+    """
+    Same as scan_network, but yields devices as soon as their shard completes,
+    so enrichment can start before the whole range has been swept.
+
+    With passive discovery enabled, devices the listener saw within
+    passive.MAX_AGE are yielded first and left out of the active sweep.
     """
     logger.debug(f"Scanning network: {ip_range}")
-    arp_request = scapy.ARP(pdst=ip_range)
-    broadcast = scapy.Ether(dst="ff:ff:ff:ff:ff:ff")
-    arp_request_broadcast = broadcast/arp_request
-    
-    # srp returns two lists: answered and unanswered packets
+    start = time.monotonic()
+    seen = set()
+    table = passive.get_table() if passive.ENABLED else None
+
+    for network in parse_ranges(ip_range):
+        heard = 0
+        if table is not None:
+            for device in _passive_devices(network, table):
+                if device['ip'] not in seen:
+                    seen.add(device['ip'])
+                    heard += 1
+                    yield device
+        skip = frozenset(seen)
+        shards = shard_networks([network])
+        found = 0
+        arp_failed = False
+        with ThreadPoolExecutor(max_workers=min(MAX_SHARD_WORKERS, len(shards))) as executor:
+            futures = [executor.submit(_sweep_shard, shard, skip) for shard in shards]
+            for future in as_completed(futures):
+                try:
+                    answers, rtts = future.result()
+                except Exception as e:
+                    if not arp_failed:
+                        logger.warning(f"ARP scan of {network} failed: {e}. Falling back to Ping scan.")
+                    arp_failed = True
+                    continue
+                for ip, mac in answers.items():
+                    if ip not in seen:
+                        seen.add(ip)
+                        found += 1
+                        device = {"ip": ip, "mac": mac, "discovery": "arp", "rtt": rtts.get(ip)}
+                        yield _annotate(device, table) if table is not None else device
+
+        # Devices heard passively show the network is directly attached
+        if not arp_failed and not found and not heard:
+            logger.info(f"ARP scan found no devices in {network}. Trying Ping scan...")
+        if arp_failed or (not found and not heard):
+            for device in scan_network_ping(network, skip):
+                if device['ip'] not in seen:
+                    seen.add(device['ip'])
+                    yield device
+            continue
+        logger.debug(f"ARP scan of {network} ({len(shards)} shards) found {found} devices, {heard} heard passively")
+
+    elapsed = time.monotonic() - start
+    instrumentation.observe_stage("discovery", elapsed)
+    logger.debug(f"Discovery finished in {elapsed:.2f}s")
+
+def scan_network_ping(ip_range, skip=()):
+    """
+    Scans the network with ICMP echo requests, except the addresses in `skip`.
+    Accepts the same range formats as scan_network.
+
+    Uses the in-process sweeper (one ICMP socket for all probes) and resolves
+    MACs from a single read of the ARP table. Falls back to the system ping
+    command when no ICMP socket is permitted.
+    """
+    ips = [str(ip) for network in parse_ranges(ip_range) for ip in network.hosts() if str(ip) not in skip]
+
     try:
-        answered_list = scapy.srp(arp_request_broadcast, timeout=2, verbose=False)[0]
-    except Exception as e:
-        logger.warning(f"ARP scan failed: {e}. Falling back to Ping scan.")
-        return scan_network_ping(ip_range)
-    
+        rtts = icmp.ping_sweep(ips)
+    except OSError as e:
+        logger.info(f"ICMP socket unavailable ({e}). Falling back to system ping.")
+        rtts = {ip: None for ip in _ping_sweep_subprocess(ips)}
+
+    arp_table = icmp.read_arp_table()
     clients_list = []
-    for element in answered_list:
-        client_dict = {"ip": element[1].psrc, "mac": element[1].hwsrc}
-        clients_list.append(client_dict)
-    
-    if not clients_list:
-        logger.info("ARP scan found no devices. Trying Ping scan...")
-        return scan_network_ping(ip_range)
-        
+    for ip in ips:
+        if ip in rtts:
+            mac = arp_table.get(ip, "Unknown")
+            clients_list.append({"ip": ip, "mac": mac, "discovery": "ping", "rtt": rtts[ip]})
     return clients_list
 
-def scan_network_ping(ip_range):
+def _ping_sweep_subprocess(ips):
     """
-    Scans the network using system ping command (slow but reliable).
-    Assumes /24 subnet.
+    Pings addresses with the system ping command (slow but reliable).
+    Returns the list of addresses that answered.
     """
     import subprocess
     import platform
     
-    network_prefix = ".".join(ip_range.split(".")[:3])
-    clients_list = []
-    
-    # Scan 1-254
-    # To speed up, we could use threads, but keeping it simple for now.
-    # We'll just scan a few IPs around the local one or just the gateway for demo if needed.
-    # But for a real tool, we should thread this.
-    
     logger.info("Starting Ping scan (this may take a while)...")
     
     # Let's use a ThreadPoolExecutor for speed
-    from concurrent.futures import ThreadPoolExecutor
-    
     def ping_host(ip):
         param = '-n' if platform.system().lower()=='windows' else '-c'
         command = ['ping', param, '1', '-w', '500', ip] # 500ms timeout
         return subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
 
     with ThreadPoolExecutor(max_workers=50) as executor:
-        # Generate IPs
-        ips = [f"{network_prefix}.{i}" for i in range(1, 255)]
         results = executor.map(ping_host, ips)
-        
-        for ip, is_up in zip(ips, results):
-            if is_up:
-                mac = get_mac_from_arp(ip)
-                clients_list.append({"ip": ip, "mac": mac})
-                
-    return clients_list
+        return [ip for ip, is_up in zip(ips, results) if is_up]
 
 def get_mac_from_arp(ip):
     """
     Retrieves MAC address from system ARP table.
     """
-    import subprocess
-    import re
-    
-    try:
-        # Run arp -a <ip>
-        # Note: On some Windows systems, arp -a <ip> might return exit code 1 if not found.
-        output = subprocess.check_output(['arp', '-a', ip], timeout=2).decode('utf-8', errors='ignore')
-        
-        # Regex to find MAC address (Windows/Linux style)
-        mac_regex = r"([0-9a-fA-F]{2}[:-][0-9a-fA-F]{2}[:-][0-9a-fA-F]{2}[:-][0-9a-fA-F]{2}[:-][0-9a-fA-F]{2}[:-][0-9a-fA-F]{2})"
-        match = re.search(mac_regex, output)
-        
-        if match:
-            mac = match.group(0).replace('-', ':').lower()
-            logger.debug(f"Resolved MAC for {ip}: {mac}")
-            return mac
-        else:
-            logger.debug(f"No MAC found in ARP output for {ip}: {output.strip()}")
-            
-    except Exception as e:
-        logger.debug(f"ARP lookup failed for {ip}: {e}")
-        pass
-        
+    mac = icmp.read_arp_table().get(ip)
+    if mac:
+        logger.debug(f"Resolved MAC for {ip}: {mac}")
+        return mac
+    logger.debug(f"No MAC found in ARP table for {ip}")
     return "Unknown"
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+"""
+Deadline-based scheduling of the periodic scan tasks.
+
+Each task (the discovery/enrichment cycle of a group of ranges, metrics
+re-probing, history maintenance) runs on a fixed grid of deadlines,
+start + k * interval, rather than sleeping a fixed time after each run, so
+its period does not stretch as runs get longer. Every run is delayed by a
+random jitter of up to a fraction of its interval, so tasks sharing an
+interval, and scanners sharing a network, do not fire in lockstep.
+
+Tasks run one at a time on the scheduler's thread. A run that overruns is
+not followed by a burst of catch-up runs: the deadlines it missed are
+skipped and counted. Each run is also handed the deadline it should finish
+by, so it can cut optional work short once that has passed.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from network_scanner.core import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Fraction of its interval a run may be randomly delayed by
+DEFAULT_JITTER = 0.1
+
+
+class Task:
+    """
+    A periodic task and its position on its deadline grid.
+
+    Args:
+        name (str): Name used in logs and metrics.
+        func (callable): Called as func(deadline=...) with the monotonic
+            time by which the run should be done.
+        interval (float): Seconds between deadlines.
+        jitter (float): Fraction of the interval runs are delayed by at most.
+        start (float): Monotonic time of the first deadline (default: now).
+    """
+
+    def __init__(self, name, func, interval, jitter=DEFAULT_JITTER, start=None):
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.jitter = jitter
+        self.origin = time.monotonic() if start is None else start
+        self.slot = 0
+        self.due = self.origin
+        self.runs = 0
+        self.skipped = 0
+
+    @property
+    def deadline(self):
+        """
+        Deadline of the next slot, by which the current run should be done.
+        """
+        return self.origin + (self.slot + 1) * self.interval
+
+    def advance(self, now):
+        """
+        Moves to the first slot not yet passed at `now` and draws its jitter.
+
+        Returns:
+            int: Slots skipped because the last run overran them.
+        """
+        self.slot += 1
+        skipped = 0
+        while self.origin + self.slot * self.interval < now:
+            self.slot += 1
+            skipped += 1
+        self.due = self.origin + self.slot * self.interval + random.uniform(0, self.jitter * self.interval)
+        self.skipped += skipped
+        return skipped
+
+
+class Scheduler:
+    """
+    Runs tasks at their deadlines, earliest first.
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self._stop = threading.Event()
+
+    def add(self, name, func, interval, jitter=DEFAULT_JITTER, start=None):
+        task = Task(name, func, interval, jitter, start)
+        self.tasks.append(task)
+        return task
+
+    def _run(self, task):
+        instrumentation.observe_schedule_lag(task.name, max(0.0, time.monotonic() - task.due))
+        try:
+            task.func(deadline=task.deadline)
+        except Exception as e:
+            logger.error(f"Error in scheduled task {task.name}: {e}", exc_info=True)
+        task.runs += 1
+        skipped = task.advance(time.monotonic())
+        if skipped:
+            instrumentation.count_skipped_runs(task.name, skipped)
+            logger.warning(f"{task.name} fell {skipped} interval(s) of {task.interval:g}s behind; "
+                           f"skipped the missed runs")
+
+    def run_pending(self):
+        """
+        Runs every task that is due, once, in deadline order.
+
+        Returns:
+            int: Number of tasks run.
+        """
+        now = time.monotonic()
+        due = sorted((task for task in self.tasks if task.due <= now), key=lambda task: task.due)
+        for task in due:
+            if self._stop.is_set():
+                break
+            self._run(task)
+        return len(due)
+
+    def next_due(self):
+        return min(task.due for task in self.tasks) if self.tasks else None
+
+    def run_forever(self):
+        """
+        Runs tasks until stop() is called.
+        """
+        while not self._stop.is_set():
+            self.run_pending()
+            next_due = self.next_due()
+            if next_due is None:
+                break
+            wait = next_due - time.monotonic()
+            if wait > 0:
+                logger.debug(f"Next task in {wait:.1f} seconds")
+                self._stop.wait(wait)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,360 @@
+"""
+Stateless SYN (half-open) port scanner for privileged deployments.
+
+Instead of a full handshake per port, crafted SYNs are sent in batches
+from one raw socket, shared by every scan running in the process (so the
+enrichment workers' concurrent host scans go out interleaved, under one
+rate limit), and replies are matched
+without per-probe state: the sequence number of every SYN is a keyed hash
+of (host, port, source port), so a SYN-ACK or RST acknowledging that
+number + 1 can only answer our probe. Open ports (SYN-ACK) are reset
+right away, so targets keep no half-open connections, and no file
+descriptor, TIME_WAIT or connection table entry is used per probe on
+either side.
+
+Requires a raw socket (root or CAP_NET_RAW on Linux) and IPv4. Results
+have the same shape as the connect engine's (sorted open ports), and
+timeouts/retries adapt to each host's RTT estimate the same way.
+"""
+
+import hashlib
+import ipaddress
+import itertools
+import logging
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+from network_scanner.core import budget, instrumentation, rtt
+
+logger = logging.getLogger(__name__)
+
+# SYNs sent per second by the whole process, across all scans (0 = unlimited)
+DEFAULT_RATE = 20000
+# SYNs paced (and allowed to go out back to back) at a time
+BATCH_SIZE = 256
+# Seconds waited for late replies after the last SYN of a round
+# (at least, the slowest host's adaptive timeout)
+DRAIN_MIN = 0.2
+RECV_BUFFER = 4 * 1024 * 1024
+# Packets read per wakeup of the reader thread
+RECV_BATCH = 4 * BATCH_SIZE
+
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+# MSS option, so probes look like ordinary SYNs
+SYN_OPTIONS = b"\x02\x04\x05\xb4"
+
+_available = None
+_available_lock = threading.Lock()
+
+
+def available():
+    """
+    Whether raw TCP sockets can be opened (root / CAP_NET_RAW).
+    """
+    global _available
+    with _available_lock:
+        if _available is None:
+            try:
+                socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP).close()
+                _available = True
+            except (OSError, AttributeError) as e:
+                logger.debug(f"Raw sockets unavailable: {e}")
+                _available = False
+        return _available
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _source_address(ip):
+    """
+    Local address the kernel routes to `ip` from (needed for TCP checksums).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((ip, 9))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+def tcp_segment(src, dst, sport, dport, seq, ack, flags, options=b""):
+    """
+    Builds a TCP header (no payload) with a valid checksum.
+    """
+    offset = (5 + len(options) // 4) << 4
+    header = struct.pack("!HHIIBBHHH", sport, dport, seq, ack, offset, flags, 1024, 0, 0) + options
+    pseudo = socket.inet_aton(src) + socket.inet_aton(dst) + struct.pack("!BBH", 0, socket.IPPROTO_TCP, len(header))
+    checksum = _checksum(pseudo + header)
+    return header[:16] + struct.pack("!H", checksum) + header[18:]
+
+
+class SynScan:
+    """
+    One SYN scan over a set of hosts, with its own source port, sending and
+    receiving through a SynScanner's shared raw socket.
+    """
+
+    def __init__(self, scanner, targets):
+        self.scanner = scanner
+        self.targets = {ip: list(ports) for ip, ports in targets.items()}
+        self.rtt = scanner.rtt or rtt.get_table()
+        self.sport = None  # Assigned by the scanner, unique among running scans
+        self._key = os.urandom(16)
+        self._sources = {ip: _source_address(ip) for ip in self.targets}
+        self._sent_at = {}  # (ip, port) -> time of the last SYN
+        self._cond = threading.Condition()
+        self._on_open = None
+        self.open = {ip: [] for ip in self.targets}
+        self.answered = set()
+        self.samples = {ip: [] for ip in self.targets}
+
+    def cookie(self, ip, port):
+        digest = hashlib.blake2s(f"{ip}:{port}:{self.sport}".encode(), key=self._key, digest_size=4).digest()
+        return int.from_bytes(digest, "big")
+
+    def _send(self, ip, port, flags, seq, ack=0, options=b""):
+        self.scanner.send(tcp_segment(self._sources[ip], ip, self.sport, port, seq, ack, flags, options), ip, port)
+
+    def _wait(self, wait, cancel):
+        """
+        Waits up to `wait` seconds for the probes sent so far to be answered.
+        """
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while len(self.answered) < len(self._sent_at):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (cancel is not None and cancel.is_set()):
+                    return
+                self._cond.wait(min(remaining, 0.1))
+
+    def handle(self, ip, sport, ack, flags):
+        """
+        Matches a reply from `ip`:`sport` to our probe (called by the scanner's reader).
+        """
+        key = (ip, sport)
+        with self._cond:
+            sent = self._sent_at.get(key)
+            if sent is None or key in self.answered or ack != (self.cookie(ip, sport) + 1) & 0xFFFFFFFF:
+                return
+            self.samples[ip].append(time.monotonic() - sent)
+            self.answered.add(key)
+            is_open = flags & (TCP_SYN | TCP_ACK) == TCP_SYN | TCP_ACK
+            if is_open:
+                self.open[ip].append(sport)
+            self._cond.notify_all()
+        if is_open:
+            # Tear the half-open connection down on the target
+            self._send(ip, sport, TCP_RST, ack)
+            if self._on_open is not None:
+                self._on_open(ip, sport)
+
+    def run(self, timeout=None, retries=None, progress=None, on_open=None, cancel=None, progress_every=1000):
+        """
+        Sends every probe (interleaving hosts) and collects the replies.
+
+        Returns:
+            dict: ip -> sorted list of open ports.
+        """
+        if timeout is None:
+            timeout = max([self.rtt.timeout(ip) for ip in self.targets] or [rtt.DEFAULT_TIMEOUT])
+            if retries is None:
+                retries = max([self.rtt.retries(ip) for ip in self.targets] or [0])
+        retries = retries or 0
+        total = sum(len(ports) for ports in self.targets.values())
+        self._on_open = on_open
+
+        self.scanner.register(self)
+        try:
+            pending = self._interleave(self.targets)
+            scanned = 0
+            last_port = None
+            for attempt in range(retries + 1):
+                if attempt:
+                    timeout = min(rtt.MAX_TIMEOUT, timeout * 2)
+                for index, (ip, port) in enumerate(pending):
+                    if cancel is not None and cancel.is_set():
+                        return self._results()
+                    if index % BATCH_SIZE == 0:
+                        self.scanner.pace(min(BATCH_SIZE, len(pending) - index))
+                    with self._cond:
+                        self._sent_at[(ip, port)] = time.monotonic()
+                    self._send(ip, port, TCP_SYN, self.cookie(ip, port), options=SYN_OPTIONS)
+                    if not attempt:
+                        scanned += 1
+                        last_port = port
+                        if progress is not None and scanned % progress_every == 0:
+                            progress(scanned, total, port)
+                self._wait(max(DRAIN_MIN, timeout), cancel)
+                with self._cond:
+                    pending = [key for key in pending if key not in self.answered]
+                if not pending:
+                    break
+            if pending:
+                instrumentation.count_timeouts("syn", len(pending))
+            if progress is not None and scanned % progress_every:
+                progress(scanned, total, last_port)
+        finally:
+            self.scanner.unregister(self)
+            with self._cond:
+                samples = {ip: list(values) for ip, values in self.samples.items()}
+            for ip, values in samples.items():
+                self.rtt.update_many(ip, values)
+        return self._results()
+
+    @staticmethod
+    def _interleave(targets):
+        # Round-robin over hosts, so no single host gets a burst
+        queues = [[(ip, port) for port in ports] for ip, ports in targets.items()]
+        return [key for group in itertools.zip_longest(*queues) for key in group if key is not None]
+
+    def _results(self):
+        with self._cond:
+            return {ip: sorted(ports) for ip, ports in self.open.items()}
+
+
+class SynScanner:
+    """
+    Process-wide SYN scanner with the connect engine's interface (scan).
+
+    Every scan running at a time, whatever the thread, shares one raw
+    socket and one reader thread, which routes replies to the scan by its
+    source port, and one pacing schedule, so `rate` caps the SYNs the
+    whole process sends per second. The socket is open while any scan
+    runs: a raw TCP socket gets a copy of every inbound TCP segment of the
+    host, so it is not kept reading while idle.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, rtt_table=None):
+        self.rate = rate
+        self.rtt = rtt_table
+        self._pacer = budget.PacketBudget(rate, burst=BATCH_SIZE) if rate else None
+        self._scans = {}  # source port -> running SynScan
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def pace(self, packets):
+        """
+        Blocks until `packets` SYNs may be sent (process-wide and global budgets).
+        """
+        if self._pacer is not None:
+            wait = self._pacer.reserve(packets)
+            if wait > 0:
+                time.sleep(wait)
+        budget.acquire(packets)
+
+    def send(self, segment, ip, port):
+        try:
+            self._sock.sendto(segment, (ip, 0))
+        except (OSError, AttributeError) as e:
+            logger.debug(f"Could not send to {ip}:{port} - {e}")
+
+    def register(self, scan):
+        with self._lock:
+            if self._sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+                sock.setblocking(False)
+                self._sock = sock
+                self._reader = threading.Thread(target=self._read, args=(sock,), name="syn-reader", daemon=True)
+                self._reader.start()
+            sport = random.randint(40000, 60999)
+            while sport in self._scans:
+                sport = random.randint(40000, 60999)
+            scan.sport = sport
+            self._scans[sport] = scan
+
+    def unregister(self, scan):
+        with self._lock:
+            self._scans.pop(scan.sport, None)
+            if self._scans:
+                return
+            sock, reader = self._sock, self._reader
+            self._sock = self._reader = None
+        # The reader stops once it sees the socket is no longer the current one
+        reader.join()
+        sock.close()
+
+    def _read(self, sock):
+        while self._sock is sock:
+            readable, _, _ = select.select([sock], [], [], 0.1)
+            if not readable:
+                continue
+            for _ in range(RECV_BATCH):
+                try:
+                    packet = sock.recv(65535)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    return
+                self._dispatch(packet)
+
+    def _dispatch(self, packet):
+        if len(packet) < 20:
+            return
+        ihl = (packet[0] & 0x0F) * 4
+        if packet[9] != socket.IPPROTO_TCP or len(packet) < ihl + 20:
+            return
+        sport, dport, _, ack, _, flags = struct.unpack_from("!HHIIBB", packet, ihl)
+        scan = self._scans.get(dport)
+        if scan is None:
+            return
+        ip = socket.inet_ntoa(packet[12:16])
+        if ip in scan.targets:
+            try:
+                scan.handle(ip, sport, ack, flags)
+            except Exception as e:
+                logger.debug(f"SYN reply from {ip}:{sport} not handled - {e}")
+
+    def scan(self, ip, ports, timeout=None, progress=None, on_open=None, cancel=None, progress_every=1000,
+             retries=None):
+        """
+        Scans ports on a single IPv4 host. Same arguments and result as
+        PortScanEngine.scan (without the connect hook).
+        """
+        callback = (lambda _ip, port: on_open(port)) if on_open is not None else None
+        scan = SynScan(self, {ip: ports})
+        return scan.run(timeout, retries, progress, callback, cancel, progress_every)[ip]
+
+
+def supports(ip):
+    """
+    Whether `ip` can be SYN-scanned (IPv4, raw sockets available).
+    """
+    try:
+        return ipaddress.ip_address(ip).version == 4 and available()
+    except ValueError:
+        return False
+
+
+_scanner = None
+_scanner_lock = threading.Lock()
+
+
+def configure(rate=DEFAULT_RATE):
+    global _scanner
+    with _scanner_lock:
+        _scanner = SynScanner(rate)
+    return _scanner
+
+
+def get_scanner():
+    global _scanner
+    with _scanner_lock:
+        if _scanner is None:
+            _scanner = SynScanner()
+        return _scanner
@@ -0,0 +1,353 @@
+"""
+Batched UDP service discovery.
+
+Many devices only identify themselves over UDP: printers and switches
+over SNMP, TVs and media players over SSDP (UPnP), Apple/Google/smart home
+devices over mDNS, Windows and Samba hosts over NetBIOS. One UDP socket
+serves every probe of a scan cycle:
+- SSDP M-SEARCH and an mDNS service enumeration query are multicast once,
+  and every device on the segment answers at once (the mDNS query is sent
+  from an ephemeral port, so responders answer by unicast, RFC 6762 6.7);
+- SNMP GET (sysDescr, sysObjectID, sysName) and NetBIOS node status
+  requests are sent to each discovered host, a batch at a time.
+
+A reader thread demultiplexes the replies by source port (and content, for
+SSDP replies sent from ephemeral ports) and parses them into per-host
+identity records, in the same shape as TCP service fingerprints, keyed
+"<port>/udp".
+"""
+
+import logging
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+from network_scanner.core import budget, fingerprint, passive
+
+logger = logging.getLogger(__name__)
+
+# Probe discovered hosts over UDP (--udp-discovery)
+ENABLED = False
+# Seconds a batch waits for replies after its requests are sent
+ROUND_TIMEOUT = 0.5
+# Seconds SSDP devices may delay their answer to the M-SEARCH (its MX header);
+# batches don't return before that, plus ROUND_TIMEOUT, since it was multicast
+SSDP_MX = 1
+SNMP_COMMUNITY = "public"
+
+SNMP_PORT = 161
+NETBIOS_PORT = 137
+SSDP_PORT = 1900
+MDNS_PORT = 5353
+SSDP_GROUP = "239.255.255.250"
+MDNS_GROUP = "224.0.0.251"
+
+SSDP_SEARCH = ("M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\nMAN: \"ssdp:discover\"\r\n"
+               f"MX: {SSDP_MX}\r\nST: ssdp:all\r\n\r\n").encode()
+# sysDescr.0, sysObjectID.0, sysName.0
+SNMP_OIDS = ("1.3.6.1.2.1.1.1.0", "1.3.6.1.2.1.1.2.0", "1.3.6.1.2.1.1.5.0")
+SYS_DESCR, SYS_OBJECT_ID, SYS_NAME = SNMP_OIDS
+
+
+# --- SNMP (BER) -------------------------------------------------------------
+
+def _ber(tag, value):
+    length = len(value)
+    if length < 0x80:
+        return bytes([tag, length]) + value
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(encoded)]) + encoded + value
+
+
+def _ber_int(value):
+    return _ber(0x02, value.to_bytes(max(1, (value.bit_length() + 8) // 8), "big", signed=True))
+
+
+def _ber_oid(oid):
+    parts = [int(part) for part in oid.split(".")]
+    body = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7F))
+            part >>= 7
+        body.extend(reversed(chunk))
+    return _ber(0x06, bytes(body))
+
+
+def snmp_get(request_id, community=None, oids=SNMP_OIDS):
+    """
+    SNMPv2c GetRequest for `oids`.
+    """
+    varbinds = b"".join(_ber(0x30, _ber_oid(oid) + b"\x05\x00") for oid in oids)
+    pdu = _ber(0xA0, _ber_int(request_id) + _ber_int(0) + _ber_int(0) + _ber(0x30, varbinds))
+    community = (community or SNMP_COMMUNITY).encode()
+    return _ber(0x30, _ber_int(1) + _ber(0x04, community) + pdu)
+
+
+def _ber_read(data, offset):
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    return tag, data[offset:offset + length], offset + length
+
+
+def _ber_items(data):
+    offset = 0
+    while offset < len(data):
+        tag, value, offset = _ber_read(data, offset)
+        yield tag, value
+
+
+def _decode_oid(value):
+    parts = [value[0] // 40, value[0] % 40]
+    number = 0
+    for byte in value[1:]:
+        number = (number << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(number)
+            number = 0
+    return ".".join(str(part) for part in parts)
+
+
+def parse_snmp(data):
+    """
+    Returns {oid: value} of a GetResponse (strings and OIDs only).
+    """
+    _, message, _ = _ber_read(data, 0)
+    items = list(_ber_items(message))
+    pdu_tag, pdu = items[2]
+    if pdu_tag != 0xA2:
+        return {}
+    fields = list(_ber_items(pdu))
+    values = {}
+    for _, varbind in _ber_items(fields[3][1]):
+        (_, oid), (tag, value) = list(_ber_items(varbind))[:2]
+        if tag == 0x04:
+            values[_decode_oid(oid)] = value.decode("utf-8", "replace").strip()
+        elif tag == 0x06:
+            values[_decode_oid(oid)] = _decode_oid(value)
+    return values
+
+
+# --- NetBIOS ----------------------------------------------------------------
+
+def netbios_status_request(transaction_id):
+    """
+    NetBIOS node status (NBSTAT) query for the wildcard name.
+    """
+    name = b"*" + b"\x00" * 15
+    encoded = bytes(b for byte in name for b in (0x41 + (byte >> 4), 0x41 + (byte & 0x0F)))
+    header = struct.pack("!HHHHHH", transaction_id, 0, 1, 0, 0, 0)
+    return header + b"\x20" + encoded + b"\x00" + struct.pack("!HH", 0x21, 1)
+
+
+def parse_netbios(data):
+    """
+    Returns {"name", "group", "mac"} from a node status response.
+    """
+    offset = 12 + 34 + 10  # header, answer name, type/class/ttl/rdlength
+    count = data[offset]
+    offset += 1
+    name = group = None
+    for _ in range(count):
+        entry = data[offset:offset + 18]
+        offset += 18
+        label = entry[:15].decode("latin-1").strip()
+        suffix, flags = entry[15], struct.unpack("!H", entry[16:18])[0]
+        if suffix == 0x00 and flags & 0x8000:
+            group = group or label
+        elif suffix == 0x00:
+            name = name or label
+    mac = ":".join(f"{b:02x}" for b in data[offset:offset + 6]) if len(data) >= offset + 6 else None
+    return {"name": name, "group": group, "mac": mac}
+
+
+# --- SSDP / mDNS ------------------------------------------------------------
+
+def parse_ssdp(data):
+    """
+    Returns the headers of an SSDP response, lowercase names.
+    """
+    lines = data.decode("latin-1").split("\r\n")
+    if not lines[0].startswith("HTTP/"):
+        return {}
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def mdns_query(query_id):
+    """
+    DNS-SD service enumeration query, asking for unicast responses.
+    """
+    name = b"".join(bytes([len(label)]) + label for label in b"_services._dns-sd._udp.local".split(b".")) + b"\x00"
+    return struct.pack("!HHHHHH", query_id, 0, 1, 0, 0, 0) + name + struct.pack("!HH", 12, 0x8001)
+
+
+def _label(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return str(value).strip().rstrip(".")
+
+
+def parse_mdns(data, src_ip):
+    """
+    Returns {"hostname", "services"} of an mDNS response.
+    """
+    import scapy.all as scapy
+
+    hostname = None
+    services = set()
+    for record in passive.dns_records(scapy.DNS(data)):
+        name = _label(record.rrname)
+        rdata = _label(record.rdata) if record.type in (1, 12) else ""
+        if record.type == 1 and rdata == src_ip and name.endswith(".local"):
+            hostname = name[:-len(".local")]
+        elif record.type == 12:
+            # Service type enumeration lists types; instance PTRs name them
+            for value in (name, rdata):
+                parts = value.split(".")
+                for i in range(len(parts) - 1):
+                    if parts[i].startswith("_") and parts[i + 1] in ("_tcp", "_udp"):
+                        services.add(f"{parts[i]}.{parts[i + 1]}")
+    services.discard("_dns-sd._udp")
+    return {"hostname": hostname, "services": sorted(services)}
+
+
+def _identity(protocol, banner, text):
+    products, device_type = fingerprint.match(text)
+    return {"protocol": protocol, "banner": banner[:120], "products": products, "type": device_type}
+
+
+class UdpDiscovery:
+    """
+    One cycle of UDP discovery over a shared socket. Use as a context
+    manager; `start()` sends the multicast queries, `probe(ips)` the
+    unicast ones for a batch of hosts and waits for its replies.
+    """
+
+    def __init__(self, community=None, timeout=None):
+        self.community = community or SNMP_COMMUNITY
+        self.timeout = ROUND_TIMEOUT if timeout is None else timeout
+        self._sock = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._results = {}  # ip -> {"161/udp": identity, ..., "hostname": str}
+        self._ssdp = {}  # ip -> {"server", "types", "location"}
+        self._request_id = random.randint(1, 0x7FFFFFFF)
+        self._multicast_until = 0.0  # monotonic time multicast replies are waited for until
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self._sock.bind(("", 0))
+        self._thread = threading.Thread(target=self._read, name="udp-discovery", daemon=True)
+        self._thread.start()
+        for payload, address in ((SSDP_SEARCH, (SSDP_GROUP, SSDP_PORT)),
+                                 (mdns_query(self._request_id & 0xFFFF), (MDNS_GROUP, MDNS_PORT))):
+            self._send(payload, address)
+        self._multicast_until = time.monotonic() + SSDP_MX + self.timeout
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _send(self, payload, address):
+        budget.acquire()
+        try:
+            self._sock.sendto(payload, address)
+        except OSError as e:
+            logger.debug(f"UDP discovery could not send to {address[0]}:{address[1]} - {e}")
+
+    def probe(self, ips):
+        """
+        Sends SNMP and NetBIOS requests to every host of a batch, waits for
+        replies (and for the multicast replies, if still due) and returns
+        {ip: identity records} for the batch.
+        """
+        snmp = snmp_get(self._request_id, self.community)
+        netbios = netbios_status_request(self._request_id & 0xFFFF)
+        for ip in ips:
+            self._send(snmp, (ip, SNMP_PORT))
+            self._send(netbios, (ip, NETBIOS_PORT))
+        time.sleep(max(self.timeout, self._multicast_until - time.monotonic()))
+        return {ip: self.results(ip) for ip in ips}
+
+    def results(self, ip):
+        with self._lock:
+            return dict(self._results.get(ip, {}))
+
+    def _read(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._sock], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data, (ip, port) = self._sock.recvfrom(65535)
+            except OSError:
+                continue
+            try:
+                self._dispatch(ip, port, data)
+            except Exception as e:
+                logger.debug(f"Unparsable UDP reply from {ip}:{port} - {e}")
+
+    def _store(self, ip, key, identity, hostname=None):
+        with self._lock:
+            entry = self._results.setdefault(ip, {})
+            entry[key] = identity
+            if hostname and not entry.get("hostname"):
+                entry["hostname"] = hostname
+
+    def _dispatch(self, ip, port, data):
+        if port == SNMP_PORT:
+            values = parse_snmp(data)
+            if values:
+                descr = values.get(SYS_DESCR, "")
+                banner = " - ".join(v for v in (values.get(SYS_NAME), descr) if v)
+                identity = _identity("snmp", banner, f"{descr} {values.get(SYS_OBJECT_ID, '')}")
+                self._store(ip, f"{SNMP_PORT}/udp", identity, values.get(SYS_NAME))
+        elif port == NETBIOS_PORT:
+            info = parse_netbios(data)
+            banner = "\\".join(v for v in (info["group"], info["name"]) if v)
+            self._store(ip, f"{NETBIOS_PORT}/udp", _identity("netbios", banner, banner), info["name"])
+        elif port == MDNS_PORT:
+            info = parse_mdns(data, ip)
+            if info["services"] or info["hostname"]:
+                identity = _identity("mdns", ", ".join(info["services"]), " ".join(info["services"]))
+                self._store(ip, f"{MDNS_PORT}/udp", identity, info["hostname"])
+        elif data.startswith(b"HTTP/"):
+            # SSDP replies come from 1900 or an ephemeral port; one per device type
+            headers = parse_ssdp(data)
+            with self._lock:
+                ssdp = self._ssdp.setdefault(ip, {"server": None, "types": set()})
+                ssdp["server"] = ssdp["server"] or headers.get("server")
+                if headers.get("st"):
+                    ssdp["types"].add(headers["st"])
+                server, types = ssdp["server"], sorted(ssdp["types"])
+            identity = _identity("ssdp", server or ", ".join(types), " ".join([server or ""] + types))
+            self._store(ip, f"{SSDP_PORT}/udp", identity)
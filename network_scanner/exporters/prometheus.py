@@ -1,12 +1,136 @@
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from prometheus_client.samples import Sample
+from collections import namedtuple
+import ipaddress
 import time
 import logging
+import threading
+
+from network_scanner.core import instrumentation
 
 logger = logging.getLogger(__name__)
 
-# Define metrics
-DEVICE_UP = Gauge('network_device_up', 'Network device status', ['ip', 'mac', 'vendor'])
-METRICS_AVAILABLE = Gauge('network_device_metrics_available', 'Device exposes Prometheus metrics', ['ip', 'url'])
+# Called once, when the first scrape is served (startup timing)
+on_first_scrape = None
+
+# Seconds a device that was not seen in the latest cycle keeps being exported
+# (as down) before its series are removed. 0 removes it on the next cycle.
+STALE_AFTER = 0
+
+# Immutable per-device record held by a snapshot
+DeviceSample = namedtuple('DeviceSample', [
+    'ip', 'mac', 'vendor', 'up', 'metrics_urls', 'open_ports',
+    'enrichment_seconds', 'discovery', 'last_seen'
+])
+
+class Snapshot:
+    """
+    Immutable view of one scan cycle.
+
+    Each device's samples are rendered once, when the device is added or
+    changes, and carried over by later snapshots; the metric families are
+    assembled from them on the first scrape and reused by every scrape until
+    the snapshot is replaced. Exporting a batch of devices therefore costs
+    the size of the batch, not of the whole device map.
+
+    Args:
+        devices (dict): mac -> DeviceSample.
+        base (Snapshot): Previous snapshot whose rendered samples are reused.
+        changed (iterable): MACs added, changed or removed since `base`
+            (required with `base`).
+    """
+
+    def __init__(self, devices, scan_duration=None, timestamp=None, base=None, changed=None):
+        self.devices = devices  # mac -> DeviceSample
+        self.scan_duration = scan_duration
+        self.timestamp = timestamp
+        if base is None:
+            self._rendered = {mac: _render_device(device) for mac, device in devices.items()}
+        else:
+            self._rendered = dict(base._rendered)
+            for mac in changed:
+                device = devices.get(mac)
+                if device is None:
+                    self._rendered.pop(mac, None)
+                else:
+                    self._rendered[mac] = _render_device(device)
+        self._families = None
+
+    @property
+    def families(self):
+        # Concurrent first scrapes may both assemble; the results are identical
+        if self._families is None:
+            self._families = tuple(self._assemble())
+        return self._families
+
+    def _assemble(self):
+        up = GaugeMetricFamily('network_device_up', 'Network device status',
+                               labels=['ip', 'mac', 'vendor'])
+        available = GaugeMetricFamily('network_device_metrics_available', 'Device exposes Prometheus metrics',
+                                      labels=['ip', 'url'])
+        open_ports = GaugeMetricFamily('network_device_open_ports', 'Number of open TCP ports found on the device',
+                                       labels=['ip', 'mac'])
+        enrichment = GaugeMetricFamily('network_device_enrichment_seconds',
+                                       'Time spent identifying and probing the device in its last scan',
+                                       labels=['ip', 'mac'])
+        discovery = GaugeMetricFamily('network_device_discovery_method', 'Method that discovered the device',
+                                      labels=['ip', 'mac', 'method'])
+
+        families = [up, available, open_ports, enrichment, discovery]
+        for rendered in self._rendered.values():
+            for family, samples in zip(families, rendered):
+                family.samples.extend(samples)
+
+        if self.scan_duration is not None:
+            duration = GaugeMetricFamily('network_scan_duration_seconds', 'Duration of the last scan cycle')
+            duration.add_metric([], self.scan_duration)
+            families.append(duration)
+        return families
+
+def _render_device(device):
+    """
+    Samples of one device, per device family (in Snapshot._assemble order).
+    """
+    up = [Sample('network_device_up', {'ip': device.ip, 'mac': device.mac, 'vendor': device.vendor},
+                 1 if device.up else 0)]
+    available = [Sample('network_device_metrics_available', {'ip': device.ip, 'url': url}, 1)
+                 for url in device.metrics_urls]
+    open_ports = [Sample('network_device_open_ports', {'ip': device.ip, 'mac': device.mac},
+                         len(device.open_ports))]
+    enrichment = []
+    if device.enrichment_seconds is not None:
+        enrichment.append(Sample('network_device_enrichment_seconds', {'ip': device.ip, 'mac': device.mac},
+                                 device.enrichment_seconds))
+    discovery = [Sample('network_device_discovery_method',
+                        {'ip': device.ip, 'mac': device.mac, 'method': device.discovery}, 1)]
+    return up, available, open_ports, enrichment, discovery
+
+class DeviceCollector:
+    """
+    Prometheus collector serving the current device snapshot.
+    The snapshot reference is swapped atomically, so a scrape never sees
+    a half-updated cycle.
+    """
+
+    def __init__(self):
+        self.snapshot = Snapshot({})
+        self.scraped = False
+
+    def describe(self):
+        return list(Snapshot({}, scan_duration=0).families)
+
+    def collect(self):
+        if not self.scraped:
+            self.scraped = True
+            if on_first_scrape is not None:
+                on_first_scrape()
+        return iter(self.snapshot.families)
+
+COLLECTOR = DeviceCollector()
+REGISTRY.register(COLLECTOR)
+
+_update_lock = threading.Lock()
 
 def start_exporter(port=8000):
     """
@@ -15,26 +139,86 @@ def start_exporter(port=8000):
     start_http_server(port)
     logger.info(f"Prometheus exporter started on port {port}")
 
-def update_metrics(devices):
+def _sample(device, last_seen):
+    return DeviceSample(
+        ip=device['ip'],
+        mac=device['mac'],
+        vendor=device.get('vendor', 'Unknown'),
+        up=True,
+        metrics_urls=tuple(device.get('metrics_urls', [])),
+        open_ports=tuple(device.get('open_ports', [])),
+        enrichment_seconds=device.get('enrichment_seconds'),
+        discovery=device.get('discovery') or 'unknown',
+        last_seen=last_seen
+    )
+
+def publish_devices(devices):
+    """
+    Adds or updates devices in the current snapshot without touching the
+    others. Used to export devices as soon as they are enriched; the
+    end-of-cycle update_metrics call then removes devices that vanished.
+    """
+    if not devices:
+        return
+    now = time.time()
+    with _update_lock:
+        previous = COLLECTOR.snapshot
+        current = dict(previous.devices)
+        for device in devices:
+            current[device['mac']] = _sample(device, device.get('last_seen') or now)
+        COLLECTOR.snapshot = Snapshot(current, previous.scan_duration, now,
+                                      base=previous, changed=[device['mac'] for device in devices])
+
+def _in_scope(ip, networks):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+@instrumentation.traced("metrics_update")
+def update_metrics(devices, stale_after=None, scan_duration=None, scope=None):
     """
     Updates the Prometheus metrics based on the scan results.
+
+    Builds a new snapshot from the previous one: devices in this cycle are
+    exported as up with their current labels, devices missing from it are
+    reported as down until their last_seen is older than `stale_after`
+    seconds, then dropped. With `scope` (the networks the cycle scanned),
+    devices outside it are carried over as they are. The new snapshot
+    replaces the old one in a single assignment.
     """
-    # Clear old metrics if needed, or just overwrite. 
-    # For a simple scanner, we might want to clear missing ones, but for now let's just set.
-    # A better approach for a persistent exporter is to track state, but we'll keep it simple.
-    
-    for device in devices:
-        ip = device['ip']
-        mac = device['mac']
-        vendor = device.get('vendor', 'Unknown')
-        
-        # Set device as up
-        DEVICE_UP.labels(ip=ip, mac=mac, vendor=vendor).set(1)
-        
-        # Check if metrics are available
-        metrics_urls = device.get('metrics_urls', [])
-        for url in metrics_urls:
-            METRICS_AVAILABLE.labels(ip=ip, url=url).set(1)
-            
-    # Note: Devices that disappear won't be automatically removed in this simple version
-    # unless we implement a cleanup mechanism.
+    if stale_after is None:
+        stale_after = STALE_AFTER
+    now = time.time()
+
+    with _update_lock:
+        previous = COLLECTOR.snapshot
+        current = {}
+        for device in devices:
+            last_seen = device.get('last_seen') or now
+            if stale_after and now - last_seen > stale_after:
+                continue
+            current[device['mac']] = _sample(device, last_seen)
+
+        # Devices not seen in this cycle
+        removed = 0
+        for mac, sample in previous.devices.items():
+            if mac in current:
+                continue
+            if scope is not None and not _in_scope(sample.ip, scope):
+                current[mac] = sample
+                continue
+            if stale_after and now - sample.last_seen <= stale_after:
+                current[mac] = sample._replace(up=False)
+            else:
+                removed += 1
+
+        if scan_duration is None:
+            scan_duration = previous.scan_duration
+        changed = [mac for mac, sample in current.items() if previous.devices.get(mac) is not sample]
+        changed.extend(previous.devices.keys() - current.keys())
+        COLLECTOR.snapshot = Snapshot(current, scan_duration, now, base=previous, changed=changed)
+
+    added = len(current.keys() - previous.devices.keys())
+    logger.debug(f"Metrics snapshot: {len(current)} devices, {added} added, {removed} removed")
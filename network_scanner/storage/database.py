@@ -2,103 +2,694 @@ import sqlite3
 import json
 import time
 import logging
+import threading
+import queue
+import base64
+import ipaddress
+from contextlib import contextmanager
+
+from network_scanner.core import instrumentation
 
 logger = logging.getLogger(__name__)
 
 DB_FILE = "network_devices.db"
 
+# Seconds a device can go unseen before a 'disappeared' event is recorded
+DISAPPEAR_AFTER = 600
+# Days of device history kept by prune_history (0 = forever)
+HISTORY_RETENTION_DAYS = 30
+# History older than this many days has short-lived port flaps compacted away
+HISTORY_COMPACT_AFTER_DAYS = 7
+# A port open/close (or close/open) pair within this many seconds counts as a flap
+FLAP_WINDOW = 300
+
+# Maximum number of pooled read connections
+READ_POOL_SIZE = 8
+
+# Pragmas applied to every connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # Readers don't block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",    # Safe with WAL, avoids an fsync per commit
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",      # 8 MB page cache
+    "PRAGMA foreign_keys=ON",
+)
+
+class ConnectionPool:
+    """
+    Thread-safe SQLite connection manager.
+
+    Keeps one long-lived writer connection, serialized by a lock, and a
+    bounded pool of reader connections. Connections are reused across calls,
+    so sqlite3's per-connection statement cache keeps queries prepared.
+    """
+
+    def __init__(self, db_file, size=READ_POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._readers = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._writer = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=5, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Yields a pooled connection for read-only queries.
+        """
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self, operation="other"):
+        """
+        Yields the writer connection inside a transaction.
+        Commits on success and rolls back on error.
+
+        The transaction's latency, including the wait for the writer lock,
+        is recorded under `operation`.
+        """
+        with instrumentation.db_write_timer(operation), self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """
+        Closes every connection held by the pool.
+        """
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the connection pool for DB_FILE, creating it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_file != DB_FILE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_FILE)
+        return _pool
+
+def close_db():
+    """
+    Closes all pooled connections.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
 def init_db():
     """
     Initializes the SQLite database and creates the devices table if it doesn't exist.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create devices table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            mac TEXT PRIMARY KEY,
-            ip TEXT,
-            vendor TEXT,
-            type TEXT,
-            open_ports TEXT,
-            metrics_urls TEXT,
-            last_seen REAL
-        )
-    ''')
-    
-    # Create vendors table for caching
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vendors (
-            oui TEXT PRIMARY KEY,
-            vendor TEXT
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with get_pool().writer('init_db') as conn:
+        cursor = conn.cursor()
 
-def upsert_device(device):
+        # Create devices table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS devices (
+                mac TEXT PRIMARY KEY,
+                ip TEXT,
+                vendor TEXT,
+                type TEXT,
+                open_ports TEXT,
+                metrics_urls TEXT,
+                last_seen REAL,
+                last_full_scan REAL,
+                ip_int INTEGER,
+                present INTEGER NOT NULL DEFAULT 1,
+                srtt REAL,
+                rttvar REAL,
+                services TEXT,
+                hostname TEXT,
+                probed_ports TEXT
+            )
+        ''')
+
+        # Migrate databases created before these columns existed
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(devices)')}
+        if 'last_full_scan' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN last_full_scan REAL')
+        if 'ip_int' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN ip_int INTEGER')
+        if 'present' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN present INTEGER NOT NULL DEFAULT 1')
+        # Round-trip time estimate (seconds) for adaptive port scan timeouts
+        if 'srtt' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN srtt REAL')
+            cursor.execute('ALTER TABLE devices ADD COLUMN rttvar REAL')
+        # Service fingerprints (JSON, port -> banner summary)
+        if 'services' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN services TEXT')
+        # Hostname learned from DHCP/mDNS traffic
+        if 'hostname' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN hostname TEXT')
+        # Ports the last full profile scanned, packed ("1-1024,8080"; see portmodel.pack_ports)
+        if 'probed_ports' not in columns:
+            cursor.execute('ALTER TABLE devices ADD COLUMN probed_ports TEXT')
+
+        # Normalized open ports, so devices can be filtered by port with an index
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device_ports (
+                mac TEXT NOT NULL,
+                port INTEGER NOT NULL,
+                PRIMARY KEY (mac, port)
+            ) WITHOUT ROWID
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_ip_int ON devices (ip_int, mac)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_last_seen ON devices (last_seen, mac)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_vendor ON devices (vendor COLLATE NOCASE, mac)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_type ON devices (type COLLATE NOCASE, mac)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_device_ports_port ON device_ports (port, mac)')
+
+        # Backfill rows written before ip_int/device_ports existed
+        stale = cursor.execute('SELECT mac, ip, open_ports FROM devices WHERE ip_int IS NULL').fetchall()
+        for mac, ip, open_ports in stale:
+            cursor.execute('UPDATE devices SET ip_int = ? WHERE mac = ?', (ip_to_int(ip), mac))
+            try:
+                ports = json.loads(open_ports or '[]')
+            except ValueError:
+                ports = []
+            cursor.executemany('INSERT OR IGNORE INTO device_ports (mac, port) VALUES (?, ?)',
+                               [(mac, port) for port in ports])
+
+        # Append-only change log. MACs and IPs are stored as integers, `kind`
+        # is one of the EVENT_* codes and `value` the port or new IP.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device_events (
+                id INTEGER PRIMARY KEY,
+                mac INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                kind INTEGER NOT NULL,
+                value INTEGER,
+                old_value INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_device_events_mac_ts ON device_events (mac, ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_device_events_ts ON device_events (ts)')
+
+        # Create vendors table for caching
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vendors (
+                oui TEXT PRIMARY KEY,
+                vendor TEXT
+            )
+        ''')
+
+# Sort key for addresses that aren't IPv4, so they order after every IPv4 address
+NON_IPV4_SORT_KEY = 1 << 32
+
+def ip_to_int(ip):
     """
-    Inserts or updates a device in the database.
+    Converts an IPv4 address to its integer value, used as a sortable column.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except (ipaddress.AddressValueError, ValueError, TypeError):
+        return NON_IPV4_SORT_KEY
+
+UPSERT_DEVICE_SQL = '''
+    INSERT INTO devices (mac, ip, vendor, type, open_ports, metrics_urls, last_seen, last_full_scan, ip_int,
+                         srtt, rttvar, services, hostname, probed_ports, present)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT(mac) DO UPDATE SET
+        ip=excluded.ip,
+        ip_int=excluded.ip_int,
+        present=1,
+        vendor=excluded.vendor,
+        type=excluded.type,
+        open_ports=excluded.open_ports,
+        metrics_urls=excluded.metrics_urls,
+        last_seen=excluded.last_seen,
+        last_full_scan=COALESCE(excluded.last_full_scan, devices.last_full_scan),
+        srtt=COALESCE(excluded.srtt, devices.srtt),
+        rttvar=COALESCE(excluded.rttvar, devices.rttvar),
+        services=COALESCE(excluded.services, devices.services),
+        hostname=COALESCE(excluded.hostname, devices.hostname),
+        probed_ports=COALESCE(excluded.probed_ports, devices.probed_ports)
+'''
+
+def _device_row(device, now):
     # Convert lists to JSON strings for storage
-    metrics_urls_json = json.dumps(device.get('metrics_urls', []))
-    open_ports_json = json.dumps(device.get('open_ports', []))
-    
-    cursor.execute('''
-        INSERT INTO devices (mac, ip, vendor, type, open_ports, metrics_urls, last_seen)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(mac) DO UPDATE SET
-            ip=excluded.ip,
-            vendor=excluded.vendor,
-            type=excluded.type,
-            open_ports=excluded.open_ports,
-            metrics_urls=excluded.metrics_urls,
-            last_seen=excluded.last_seen
-    ''', (
+    return (
         device['mac'],
         device['ip'],
         device.get('vendor', 'Unknown'),
         device.get('type', 'Unknown'),
-        open_ports_json,
-        metrics_urls_json,
-        time.time()
-    ))
-    
-    conn.commit()
-    conn.close()
-
-def get_all_devices():
-    """
-    Retrieves all devices from the database.
-    """
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM devices')
-    rows = cursor.fetchall()
-    
-    devices = []
-    for row in rows:
-        device = dict(row)
-        # Parse JSON strings back to lists
-        try:
-            device['metrics_urls'] = json.loads(device['metrics_urls'])
-        except:
-            device['metrics_urls'] = []
+        json.dumps(device.get('open_ports', [])),
+        json.dumps(device.get('metrics_urls', [])),
+        now,
+        device.get('last_full_scan'),
+        ip_to_int(device['ip']),
+        device.get('srtt'),
+        device.get('rttvar'),
+        # None (not fingerprinted) keeps the stored fingerprints
+        json.dumps(device['services']) if device.get('services') is not None else None,
+        device.get('hostname'),
+        # None (light check) keeps the ports of the last full profile
+        device.get('probed_ports')
+    )
+
+def upsert_device(device):
+    """
+    Inserts or updates a device in the database.
+    """
+    upsert_devices([device])
+
+def upsert_devices(devices, now=None):
+    """
+    Inserts or updates a batch of devices in a single transaction, and logs
+    what changed since the stored state to the device history. `now` is the
+    time they were seen (default: now).
+    """
+    if not devices:
+        return
+    now = time.time() if now is None else now
+    rows = [_device_row(device, now) for device in devices]
+    macs = [(device['mac'],) for device in devices]
+    ports = [(device['mac'], port) for device in devices for port in set(device.get('open_ports', []))]
+    with get_pool().writer('upsert_devices') as conn:
+        history = _diff_devices(conn, devices, int(now))
+        conn.executemany(INSERT_EVENT_SQL, history)
+        conn.executemany(UPSERT_DEVICE_SQL, rows)
+        conn.executemany('DELETE FROM device_ports WHERE mac = ?', macs)
+        conn.executemany('INSERT INTO device_ports (mac, port) VALUES (?, ?)', ports)
+
+def update_metrics_urls(urls):
+    """
+    Stores re-probed metrics endpoints without touching the rest of the
+    device rows (last_seen in particular).
+
+    Args:
+        urls (dict): Mapping of mac -> list of metrics URLs.
+    """
+    if not urls:
+        return
+    with get_pool().writer('update_metrics_urls') as conn:
+        conn.executemany('UPDATE devices SET metrics_urls = ? WHERE mac = ?',
+                         [(json.dumps(found), mac) for mac, found in urls.items()])
+
+def _parse_device(row, with_present=False):
+    device = dict(row)
+    device.pop('ip_int', None)
+    if not with_present:
+        device.pop('present', None)
+    # Parse JSON strings back to lists
+    try:
+        device['metrics_urls'] = json.loads(device['metrics_urls'])
+    except:
+        device['metrics_urls'] = []
+    try:
+        device['open_ports'] = json.loads(device.get('open_ports', '[]'))
+    except:
+        device['open_ports'] = []
+    try:
+        device['services'] = json.loads(device.get('services') or '{}')
+    except ValueError:
+        device['services'] = {}
+    return device
+
+def get_all_devices(with_present=False):
+    """
+    Retrieves all devices from the database. With `with_present`, each
+    device keeps its 'present' flag (0 once it was marked disappeared).
+    """
+    with get_pool().reader() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('SELECT * FROM devices')
+        rows = cursor.fetchall()
+
+    return [_parse_device(row, with_present) for row in rows]
+
+# Columns /api/devices can sort by -> SQL expression matching an index
+SORT_COLUMNS = {
+    'ip': 'ip_int',
+    'last_seen': 'last_seen',
+    'vendor': 'vendor COLLATE NOCASE',
+    'type': 'type COLLATE NOCASE',
+    'mac': 'mac',
+}
+
+def encode_cursor(value, mac):
+    return base64.urlsafe_b64encode(json.dumps([value, mac]).encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Decodes a pagination cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        value, mac = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return value, mac
+
+def query_devices(device_type=None, vendor=None, port=None, seen_since=None,
+                  sort='ip', order='asc', limit=100, cursor=None, with_total=False):
+    """
+    Returns one page of devices, filtered and sorted in SQL.
+
+    Pagination is keyset-based: `cursor` is the opaque `next_cursor` of the
+    previous page, so every page costs the same regardless of its offset.
+
+    Args:
+        device_type (str): Exact device type (case-insensitive).
+        vendor (str): Exact vendor name (case-insensitive).
+        port (int): Only devices with this port open.
+        seen_since (float): Only devices seen at or after this Unix time.
+        sort (str): One of SORT_COLUMNS.
+        order (str): 'asc' or 'desc'.
+
+    Returns:
+        tuple: (devices, next_cursor or None, total or None)
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Invalid sort column: {sort}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Invalid sort order: {order}")
+    expr = SORT_COLUMNS[sort]
+    raw_column = expr.split()[0]
+
+    where = []
+    params = []
+    if device_type:
+        where.append('type = ? COLLATE NOCASE')
+        params.append(device_type)
+    if vendor:
+        where.append('vendor = ? COLLATE NOCASE')
+        params.append(vendor)
+    if port is not None:
+        where.append('mac IN (SELECT mac FROM device_ports WHERE port = ?)')
+        params.append(port)
+    if seen_since is not None:
+        where.append('last_seen >= ?')
+        params.append(seen_since)
+
+    filter_sql = (' WHERE ' + ' AND '.join(where)) if where else ''
+    filter_params = list(params)
+
+    if cursor:
+        value, mac = decode_cursor(cursor)
+        op = '>' if order == 'asc' else '<'
+        where.append(f"({expr} {op} ? OR ({expr} = ? AND mac {op} ?))")
+        params.extend([value, value, mac])
+
+    sql = 'SELECT * FROM devices'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    direction = order.upper()
+    sql += f' ORDER BY {expr} {direction}, mac {direction} LIMIT ?'
+    params.append(limit + 1)
+
+    with get_pool().reader() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        rows = c.execute(sql, params).fetchall()
+        total = None
+        if with_total:
+            total = conn.execute('SELECT COUNT(*) FROM devices' + filter_sql, filter_params).fetchone()[0]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[raw_column], last['mac'])
+
+    return [_parse_device(row) for row in rows], next_cursor, total
+
+# Device history event kinds (stored as small integers)
+EVENT_APPEARED = 1
+EVENT_DISAPPEARED = 2
+EVENT_IP_CHANGED = 3
+EVENT_PORT_OPENED = 4
+EVENT_PORT_CLOSED = 5
+
+EVENT_NAMES = {
+    EVENT_APPEARED: 'appeared',
+    EVENT_DISAPPEARED: 'disappeared',
+    EVENT_IP_CHANGED: 'ip_changed',
+    EVENT_PORT_OPENED: 'port_opened',
+    EVENT_PORT_CLOSED: 'port_closed',
+}
+EVENT_KINDS = {name: kind for kind, name in EVENT_NAMES.items()}
+
+INSERT_EVENT_SQL = 'INSERT INTO device_events (mac, ts, kind, value, old_value) VALUES (?, ?, ?, ?, ?)'
+
+# Keeps IN (...) lists below SQLite's bound parameter limit
+_CHUNK = 500
+
+def mac_to_int(mac):
+    """
+    Encodes a MAC address as a 48-bit integer. Returns None if it isn't one.
+    """
+    digits = mac.replace(':', '').replace('-', '').replace('.', '')
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+def int_to_mac(value):
+    digits = f"{value:012x}"
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+def int_to_ip(value):
+    if value is None or value >= NON_IPV4_SORT_KEY:
+        return None
+    return str(ipaddress.IPv4Address(value))
+
+def _diff_devices(conn, devices, ts):
+    """
+    Compares incoming devices to their stored state and returns the history
+    rows (see INSERT_EVENT_SQL) for what changed.
+    """
+    known = {}
+    known_ports = {}
+    macs = [device['mac'] for device in devices]
+    for i in range(0, len(macs), _CHUNK):
+        chunk = macs[i:i + _CHUNK]
+        marks = ','.join('?' * len(chunk))
+        for mac, ip_int, present in conn.execute(
+                f'SELECT mac, ip_int, present FROM devices WHERE mac IN ({marks})', chunk):
+            known[mac] = (ip_int, present)
+        for mac, port in conn.execute(f'SELECT mac, port FROM device_ports WHERE mac IN ({marks})', chunk):
+            known_ports.setdefault(mac, set()).add(port)
+
+    events = []
+    for device in devices:
+        mac_int = mac_to_int(device['mac'])
+        if mac_int is None:
+            continue
+        ip_int = ip_to_int(device['ip'])
+        new_ports = set(device.get('open_ports', []))
+        old_ports = known_ports.get(device['mac'], set())
+
+        if device['mac'] not in known:
+            events.append((mac_int, ts, EVENT_APPEARED, ip_int, None))
+        else:
+            old_ip, present = known[device['mac']]
+            if not present:
+                events.append((mac_int, ts, EVENT_APPEARED, ip_int, None))
+            if old_ip is not None and old_ip != ip_int:
+                events.append((mac_int, ts, EVENT_IP_CHANGED, ip_int, old_ip))
+
+        events.extend((mac_int, ts, EVENT_PORT_OPENED, port, None) for port in sorted(new_ports - old_ports))
+        events.extend((mac_int, ts, EVENT_PORT_CLOSED, port, None) for port in sorted(old_ports - new_ports))
+    return events
+
+def mark_disappeared(not_seen_since=None, networks=None):
+    """
+    Records a 'disappeared' event for every present device whose last
+    sighting is older than `not_seen_since` (Unix time, default
+    DISAPPEAR_AFTER seconds ago). With `networks` (IPv4 networks), only
+    devices whose address is in one of them are considered.
+
+    Returns:
+        int: Number of devices marked as gone.
+    """
+    ts = int(time.time())
+    if not_seen_since is None:
+        not_seen_since = ts - DISAPPEAR_AFTER
+    sql = 'SELECT mac, ip_int FROM devices WHERE present = 1 AND last_seen < ?'
+    params = [not_seen_since]
+    if networks is not None:
+        networks = [network for network in networks if network.version == 4]
+        if not networks:
+            return 0
+        sql += ' AND (' + ' OR '.join('ip_int BETWEEN ? AND ?' for _ in networks) + ')'
+        for network in networks:
+            params.extend((int(network.network_address), int(network.broadcast_address)))
+    with get_pool().writer('mark_disappeared') as conn:
+        gone = conn.execute(sql, params).fetchall()
+        events = [(mac_to_int(mac), ts, EVENT_DISAPPEARED, ip_int, None)
+                  for mac, ip_int in gone if mac_to_int(mac) is not None]
+        conn.executemany(INSERT_EVENT_SQL, events)
+        conn.executemany('UPDATE devices SET present = 0 WHERE mac = ?', [(mac,) for mac, _ in gone])
+    return len(gone)
+
+def _event_dict(mac, ts, kind, value, old_value):
+    event = {'mac': int_to_mac(mac), 'ts': ts, 'event': EVENT_NAMES.get(kind, str(kind))}
+    if kind in (EVENT_PORT_OPENED, EVENT_PORT_CLOSED):
+        event['port'] = value
+    else:
+        event['ip'] = int_to_ip(value)
+        if kind == EVENT_IP_CHANGED:
+            event['old_ip'] = int_to_ip(old_value)
+    return event
+
+def get_device_history(mac=None, since=None, until=None, events=None, port=None, limit=1000):
+    """
+    Returns history events in a time window, oldest first.
+
+    Queries are bounded by the (mac, ts) or (ts) index, so only the rows in
+    the window are read.
+
+    Args:
+        mac (str): Limit to one device.
+        since (float): Window start (Unix time, inclusive).
+        until (float): Window end (Unix time, inclusive).
+        events (list): Event names to include (see EVENT_NAMES).
+        port (int): Limit port events to this port.
+        limit (int): Maximum number of events.
+
+    Returns:
+        list: Event dicts with mac, ts, event and port or ip/old_ip.
+    """
+    where = []
+    params = []
+    if mac is not None:
+        mac_int = mac_to_int(mac)
+        if mac_int is None:
+            raise ValueError(f"Invalid MAC address: {mac}")
+        where.append('mac = ?')
+        params.append(mac_int)
+    if since is not None:
+        where.append('ts >= ?')
+        params.append(int(since))
+    if until is not None:
+        where.append('ts <= ?')
+        params.append(int(until))
+    if events:
         try:
-            device['open_ports'] = json.loads(device.get('open_ports', '[]'))
-        except:
-            device['open_ports'] = []
-        devices.append(device)
-        
-    conn.close()
-    return devices
+            kinds = [EVENT_KINDS[name] for name in events]
+        except KeyError as e:
+            raise ValueError(f"Unknown event type: {e.args[0]}")
+        where.append(f"kind IN ({','.join('?' * len(kinds))})")
+        params.extend(kinds)
+    if port is not None:
+        where.append('kind IN (?, ?) AND value = ?')
+        params.extend([EVENT_PORT_OPENED, EVENT_PORT_CLOSED, port])
+
+    sql = 'SELECT mac, ts, kind, value, old_value FROM device_events'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY ts, id LIMIT ?'
+    params.append(limit)
+
+    with get_pool().reader() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [_event_dict(*row) for row in rows]
+
+def prune_history(retention_days=None, compact_after_days=None, flap_window=None):
+    """
+    Retention and compaction of the device history:
+    - events older than `retention_days` are deleted;
+    - in events older than `compact_after_days`, port open/close pairs less
+      than `flap_window` seconds apart cancel out and are removed.
+
+    Returns:
+        tuple: (deleted, compacted) event counts.
+    """
+    retention_days = HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+    compact_after_days = HISTORY_COMPACT_AFTER_DAYS if compact_after_days is None else compact_after_days
+    flap_window = FLAP_WINDOW if flap_window is None else flap_window
+    now = time.time()
+
+    deleted = compacted = 0
+    with get_pool().writer('prune_history') as conn:
+        if retention_days > 0:
+            deleted = conn.execute('DELETE FROM device_events WHERE ts < ?',
+                                   (int(now - retention_days * 86400),)).rowcount
+
+        if compact_after_days > 0 and flap_window > 0:
+            pairs = conn.execute('''
+                SELECT id, next_id FROM (
+                    SELECT id, ts, kind,
+                           LEAD(id) OVER w AS next_id,
+                           LEAD(ts) OVER w AS next_ts,
+                           LEAD(kind) OVER w AS next_kind
+                    FROM device_events
+                    WHERE kind IN (?, ?) AND ts < ?
+                    WINDOW w AS (PARTITION BY mac, value ORDER BY ts, id)
+                )
+                WHERE next_id IS NOT NULL AND next_kind != kind AND next_ts - ts <= ?
+                ORDER BY id
+            ''', (EVENT_PORT_OPENED, EVENT_PORT_CLOSED, int(now - compact_after_days * 86400), flap_window)).fetchall()
+
+            # Chains like open/close/open yield overlapping pairs; each event is removed at most once
+            removed = set()
+            for first, second in pairs:
+                if first not in removed and second not in removed:
+                    removed.update((first, second))
+            conn.executemany('DELETE FROM device_events WHERE id = ?', [(i,) for i in removed])
+            compacted = len(removed)
+
+    if deleted or compacted:
+        logger.info(f"Device history: pruned {deleted} and compacted {compacted} events.")
+    return deleted, compacted
 
 def get_cached_vendor(mac):
     """
@@ -108,15 +699,10 @@ def get_cached_vendor(mac):
         return None
         
     oui = mac[:8].lower() # xx:xx:xx
-    
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT vendor FROM vendors WHERE oui = ?', (oui,))
-    result = cursor.fetchone()
-    
-    conn.close()
-    
+
+    with get_pool().reader() as conn:
+        result = conn.execute('SELECT vendor FROM vendors WHERE oui = ?', (oui,)).fetchone()
+
     if result:
         return result[0]
     return None
@@ -129,17 +715,12 @@ def save_cached_vendor(mac, vendor):
         return
         
     oui = mac[:8].lower()
-    
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
+
     try:
-        cursor.execute('''
-            INSERT OR REPLACE INTO vendors (oui, vendor)
-            VALUES (?, ?)
-        ''', (oui, vendor))
-        conn.commit()
+        with get_pool().writer('save_vendor') as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO vendors (oui, vendor)
+                VALUES (?, ?)
+            ''', (oui, vendor))
     except Exception as e:
         logger.error(f"Failed to cache vendor: {e}")
-    finally:
-        conn.close()
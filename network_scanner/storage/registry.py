@@ -0,0 +1,387 @@
+"""
+Process-wide in-memory device registry.
+
+Holds the current state of every known device as compact records, indexed
+by MAC, by IP and by sorted IPv4 address, and is the one place the scan
+loop, the exporter and the web interface read devices from. SQLite stays
+the durable copy: the registry is loaded from it at startup, and every
+change is applied in memory first and then written to the database by a
+background writer thread, in order, so scans and requests never wait for
+a write transaction.
+
+Readers take a snapshot: an immutable view that writers replace as a
+whole (copy-on-write), so lookups, scans over all devices and paginated
+queries need no locking and always see one consistent state.
+"""
+
+import bisect
+import logging
+import queue
+import threading
+import time
+
+from network_scanner.core import instrumentation
+from network_scanner.storage import database
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('mac', 'ip', 'vendor', 'type', 'open_ports', 'metrics_urls', 'last_seen', 'last_full_scan',
+          'srtt', 'rttvar', 'services', 'hostname', 'probed_ports')
+
+# Stored values that a new value of None leaves unchanged (COALESCE in UPSERT_DEVICE_SQL)
+KEPT_IF_NONE = ('last_full_scan', 'srtt', 'rttvar', 'services', 'hostname', 'probed_ports')
+
+
+class DeviceRecord:
+    """
+    Immutable state of one device. Supports read-only dict-style access
+    (record['ip'], record.get('open_ports')), so it can be passed where a
+    stored device row is expected; to_dict() returns a mutable copy.
+    """
+
+    __slots__ = FIELDS + ('ip_int', 'present')
+
+    def __init__(self, mac, ip, vendor='Unknown', type='Unknown', open_ports=(), metrics_urls=(), last_seen=None,
+                 last_full_scan=None, srtt=None, rttvar=None, services=None, hostname=None, probed_ports=None,
+                 present=True):
+        self.mac = mac
+        self.ip = ip
+        self.ip_int = database.ip_to_int(ip)
+        self.vendor = vendor
+        self.type = type
+        self.open_ports = tuple(open_ports or ())
+        self.metrics_urls = tuple(metrics_urls or ())
+        self.last_seen = last_seen
+        self.last_full_scan = last_full_scan
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.services = dict(services) if services is not None else None
+        self.hostname = hostname
+        self.probed_ports = probed_ports
+        self.present = present
+
+    @classmethod
+    def from_dict(cls, device, present=True):
+        return cls(present=present, **{field: device[field] for field in FIELDS if field in device})
+
+    def replace(self, **changes):
+        fields = {field: getattr(self, field) for field in FIELDS}
+        fields['present'] = self.present
+        fields.update(changes)
+        return DeviceRecord(**fields)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self):
+        """
+        Same shape as a device from database.get_all_devices().
+        """
+        device = {field: getattr(self, field) for field in FIELDS}
+        device['open_ports'] = list(self.open_ports)
+        device['metrics_urls'] = list(self.metrics_urls)
+        device['services'] = dict(self.services or {})
+        return device
+
+
+def _sort_value(sort, record):
+    if sort == 'ip':
+        return record.ip_int
+    value = getattr(record, sort)
+    # vendor and type sort case-insensitively, like COLLATE NOCASE
+    return value.lower() if isinstance(value, str) and sort != 'mac' else value
+
+
+def _sort_key(sort, record):
+    # NULLs first, as in SQLite
+    value = _sort_value(sort, record)
+    return (value is not None, value if value is not None else 0, record.mac)
+
+
+class RegistrySnapshot:
+    """
+    Immutable view of the registry at one point in time.
+    """
+
+    __slots__ = ('by_mac', 'by_ip', 'ip_index', '_orders')
+
+    def __init__(self, by_mac, by_ip, ip_index):
+        self.by_mac = by_mac  # mac -> DeviceRecord
+        self.by_ip = by_ip  # ip -> mac of the device last seen with it
+        self.ip_index = ip_index  # sorted [(ip_int, mac)]
+        self._orders = {}  # sort column -> (records, sort keys) in ascending order, built on first use
+
+    def __len__(self):
+        return len(self.by_mac)
+
+    def __iter__(self):
+        return iter(self.by_mac.values())
+
+    def get(self, mac):
+        return self.by_mac.get(mac)
+
+    def lookup_ip(self, ip):
+        mac = self.by_ip.get(ip)
+        return self.by_mac.get(mac) if mac is not None else None
+
+    def in_network(self, network):
+        """
+        Records whose address is in an IPv4 network, in address order.
+        """
+        start = bisect.bisect_left(self.ip_index, (int(network.network_address), ''))
+        end = bisect.bisect_right(self.ip_index, (int(network.broadcast_address), '\uffff'))
+        return [self.by_mac[mac] for _, mac in self.ip_index[start:end]]
+
+    def _ordered(self, sort):
+        order = self._orders.get(sort)
+        if order is None:
+            if sort == 'ip':
+                records = [self.by_mac[mac] for _, mac in self.ip_index]
+            else:
+                records = sorted(self.by_mac.values(), key=lambda record: _sort_key(sort, record))
+            order = self._orders[sort] = (records, [_sort_key(sort, record) for record in records])
+        return order
+
+    def query(self, device_type=None, vendor=None, port=None, seen_since=None,
+              sort='ip', order='asc', limit=100, cursor=None, with_total=False):
+        """
+        In-memory equivalent of database.query_devices: same arguments,
+        filters, keyset cursors and result.
+        """
+        if sort not in database.SORT_COLUMNS:
+            raise ValueError(f"Invalid sort column: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Invalid sort order: {order}")
+        device_type = device_type.lower() if device_type else None
+        vendor = vendor.lower() if vendor else None
+
+        def matches(record):
+            return ((device_type is None or (record.type or '').lower() == device_type)
+                    and (vendor is None or (record.vendor or '').lower() == vendor)
+                    and (port is None or port in record.open_ports)
+                    and (seen_since is None or (record.last_seen is not None and record.last_seen >= seen_since)))
+
+        ordered, keys = self._ordered(sort)
+        start, end = 0, len(ordered)
+        if cursor:
+            value, mac = database.decode_cursor(cursor)
+            if isinstance(value, str) and sort != 'mac':
+                value = value.lower()
+            bound = (value is not None, value if value is not None else 0, mac)
+            if order == 'asc':
+                start = bisect.bisect_right(keys, bound)
+            else:
+                end = bisect.bisect_left(keys, bound)
+        positions = range(start, end) if order == 'asc' else range(end - 1, start - 1, -1)
+
+        page = []
+        next_cursor = None
+        for position in positions:
+            record = ordered[position]
+            if not matches(record):
+                continue
+            if len(page) == limit:
+                last = page[-1]
+                raw = last.ip_int if sort == 'ip' else getattr(last, sort)
+                next_cursor = database.encode_cursor(raw, last.mac)
+                break
+            page.append(record)
+
+        total = sum(1 for record in self.by_mac.values() if matches(record)) if with_total else None
+        return [record.to_dict() for record in page], next_cursor, total
+
+
+class BackgroundWriter:
+    """
+    Runs database writes on one thread, in submission order.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        instrumentation.track_queue("db_writes", self._queue.qsize)
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((func, args))
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                if func is None:
+                    return
+                func(*args)
+            except Exception as e:
+                logger.error(f"Background database write {func.__name__} failed: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """
+        Blocks until every submitted write is done.
+        """
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put((None, ()))
+            thread.join()
+
+
+class DeviceRegistry:
+    """
+    Copy-on-write device state. Writers are serialized by a lock and swap
+    in a new snapshot; readers never block.
+
+    Args:
+        writer (BackgroundWriter): Where database writes go (None = no persistence).
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self._snapshot = RegistrySnapshot({}, {}, [])
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _persist(self, func, *args):
+        if self.writer is not None:
+            self.writer.submit(func, *args)
+
+    def load(self, devices):
+        """
+        Replaces the registry contents with stored devices (no write back).
+        """
+        by_mac = {}
+        for device in devices:
+            by_mac[device['mac']] = DeviceRecord.from_dict(device, present=bool(device.get('present', True)))
+        by_ip = {}
+        for record in sorted(by_mac.values(), key=lambda record: record.last_seen or 0):
+            by_ip[record.ip] = record.mac
+        ip_index = sorted((record.ip_int, record.mac) for record in by_mac.values())
+        with self._lock:
+            self._snapshot = RegistrySnapshot(by_mac, by_ip, ip_index)
+        return len(by_mac)
+
+    def _swap(self, records):
+        # Builds the next snapshot with `records` (mac -> new record) applied
+        current = self._snapshot
+        by_mac = dict(current.by_mac)
+        by_ip = dict(current.by_ip)
+        ip_index = list(current.ip_index)
+        for mac, record in records.items():
+            old = by_mac.get(mac)
+            if old is not None and old.ip_int != record.ip_int:
+                del ip_index[bisect.bisect_left(ip_index, (old.ip_int, mac))]
+            if old is None or old.ip_int != record.ip_int:
+                bisect.insort(ip_index, (record.ip_int, mac))
+            if old is not None and old.ip != record.ip and by_ip.get(old.ip) == mac:
+                del by_ip[old.ip]
+            by_ip[record.ip] = mac
+            by_mac[mac] = record
+        self._snapshot = RegistrySnapshot(by_mac, by_ip, ip_index)
+
+    def upsert(self, devices, now=None):
+        """
+        Merges enriched devices (seen now) into the registry and queues the
+        matching database.upsert_devices write. Same merge rules as the
+        database: fields in KEPT_IF_NONE keep their value when given None.
+        """
+        if not devices:
+            return
+        now = time.time() if now is None else now
+        devices = list(devices)
+        with self._lock:
+            records = {}
+            for device in devices:
+                old = records.get(device['mac']) or self._snapshot.by_mac.get(device['mac'])
+                fields = {field: device[field] for field in FIELDS if field in device}
+                if old is not None:
+                    for field in KEPT_IF_NONE:
+                        if fields.get(field) is None:
+                            fields[field] = getattr(old, field)
+                fields['last_seen'] = now
+                records[device['mac']] = DeviceRecord(**fields)
+            self._swap(records)
+        self._persist(database.upsert_devices, devices, now)
+
+    def set_metrics_urls(self, urls):
+        """
+        Stores re-probed metrics endpoints (mac -> list of URLs).
+        """
+        if not urls:
+            return
+        with self._lock:
+            current = self._snapshot.by_mac
+            self._swap({mac: current[mac].replace(metrics_urls=tuple(found))
+                        for mac, found in urls.items() if mac in current})
+        self._persist(database.update_metrics_urls, dict(urls))
+
+    def mark_disappeared(self, not_seen_since=None, networks=None):
+        """
+        Flags present devices unseen since `not_seen_since` as gone (see
+        database.mark_disappeared) and queues the history write.
+
+        Returns:
+            int: Number of devices marked as gone.
+        """
+        if not_seen_since is None:
+            not_seen_since = int(time.time()) - database.DISAPPEAR_AFTER
+        if networks is not None:
+            networks = [network for network in networks if network.version == 4]
+        with self._lock:
+            snapshot = self._snapshot
+            if networks is None:
+                candidates = snapshot
+            else:
+                candidates = [record for network in networks for record in snapshot.in_network(network)]
+            gone = {record.mac: record.replace(present=False) for record in candidates
+                    if record.present and (record.last_seen or 0) < not_seen_since}
+            if gone:
+                self._swap(gone)
+        if gone:
+            self._persist(database.mark_disappeared, not_seen_since, networks)
+        return len(gone)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Returns the shared registry, persisting to the database in the background.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceRegistry(BackgroundWriter())
+        return _registry
+
+
+def load_from_db():
+    """
+    Fills the shared registry from the database.
+
+    Returns:
+        int: Number of devices loaded.
+    """
+    return get_registry().load(database.get_all_devices(with_present=True))
@@ -0,0 +1,107 @@
+"""
+In-process event bus backing the Server-Sent Events endpoint.
+
+Publishers (scan jobs, the main scan loop) push small incremental events;
+each connected browser gets its own bounded queue. Events are serialized
+once per publish and shared by every subscriber. A subscriber that falls
+too far behind is disconnected rather than slowing down publishers; the
+browser's EventSource reconnects on its own.
+"""
+
+import json
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per subscriber before it is considered too slow
+SUBSCRIBER_QUEUE_SIZE = 500
+# Seconds between keep-alive comments on idle streams
+HEARTBEAT_INTERVAL = 15
+
+
+class EventBus:
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def is_subscribed(self, q):
+        with self._lock:
+            return q in self._subscribers
+
+    def publish(self, event, data, job_id=None):
+        """
+        Sends an event to every subscriber.
+
+        Args:
+            event (str): SSE event name.
+            data (dict): JSON-serializable payload.
+            job_id (str): Optional scan job the event belongs to, used for filtering.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        for q in subscribers:
+            try:
+                q.put_nowait((job_id, message))
+            except queue.Full:
+                logger.debug("Dropping slow event stream subscriber")
+                self.unsubscribe(q)
+
+    def stream(self, job_id=None):
+        """
+        Generator of SSE-formatted messages for one subscriber.
+        If `job_id` is given, only events of that job are sent.
+        """
+        q = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while self.is_subscribed(q):
+                try:
+                    event_job, message = q.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if job_id is None or event_job == job_id:
+                    yield message
+        finally:
+            self.unsubscribe(q)
+
+
+bus = EventBus()
+
+
+def publish(event, data, job_id=None):
+    bus.publish(event, data, job_id)
+
+
+def publish_device(device):
+    """
+    Pushes a newly enriched device to the dashboards.
+    """
+    publish('device', {
+        'ip': device['ip'],
+        'mac': device['mac'],
+        'vendor': device.get('vendor', 'Unknown'),
+        'type': device.get('type', 'Unknown'),
+        'open_ports': device.get('open_ports', []),
+        'metrics_urls': device.get('metrics_urls', []),
+        'hostname': device.get('hostname'),
+        'services': device.get('services') or {},
+        'last_seen': device.get('last_seen') or time.time(),
+    })
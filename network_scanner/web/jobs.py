@@ -0,0 +1,235 @@
+"""
+Bounded manager for on-demand scan jobs started from the web interface.
+
+Jobs wait in a priority queue and are run by a fixed number of worker
+threads, so concurrent "scan all ports" requests can't saturate the host.
+Only one job per target runs at a time; further jobs for the same target
+wait their turn. Finished jobs are kept for JOB_TTL seconds so their
+results can still be read, then evicted.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Full scans running at once across all targets
+MAX_CONCURRENT_JOBS = 2
+# Seconds finished jobs are kept
+JOB_TTL = 3600
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+CANCELLED = 'cancelled'
+ERROR = 'error'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class ScanJob:
+    """
+    State of one scan job. Progress fields are updated by the job function.
+    """
+
+    def __init__(self, target, kind, priority=0, total_ports=0, options=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.target = target
+        self.kind = kind
+        self.priority = priority
+        self.options = options or {}
+        self.status = QUEUED
+        self.progress = 0
+        self.current_port = 0
+        self.total_ports = total_ports
+        self.open_ports = []
+        self.error = None
+        self.created = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        if self.start_time is None:
+            elapsed = 0
+        else:
+            elapsed = (self.end_time or time.time()) - self.start_time
+        return {
+            'job_id': self.id,
+            'ip': self.target,
+            'kind': self.kind,
+            'options': dict(self.options),
+            'priority': self.priority,
+            'status': self.status,
+            'progress': self.progress,
+            'current_port': self.current_port,
+            'total_ports': self.total_ports,
+            'open_ports': list(self.open_ports),
+            'ports_found': len(self.open_ports),
+            'elapsed_time': elapsed,
+            'error': self.error,
+        }
+
+
+class ScanJobManager:
+    """
+    Runs scan jobs with a global concurrency cap, one job per target at a
+    time, highest priority first (FIFO within a priority).
+
+    Args:
+        run_job (callable): Function called with the ScanJob on a worker thread.
+            It should honor job.cancel_event and may update progress fields.
+        on_change (callable): Optional function called with the ScanJob
+            whenever its status changes.
+    """
+
+    def __init__(self, run_job, max_concurrent=MAX_CONCURRENT_JOBS, ttl=JOB_TTL, on_change=None):
+        self.run_job = run_job
+        self.on_change = on_change
+        self.max_concurrent = max_concurrent
+        self.ttl = ttl
+        self._jobs = {}
+        self._latest = {}  # target -> id of the most recent job
+        self._queue = []  # heap of (-priority, seq, job)
+        self._seq = itertools.count()
+        self._running_targets = set()
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def _notify(self, job):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(job)
+        except Exception as e:
+            logger.debug(f"Job change callback failed: {e}")
+
+    def _ensure_workers(self):
+        while len(self._workers) < self.max_concurrent:
+            t = threading.Thread(target=self._work, name=f"scan-job-{len(self._workers)}", daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def _evict(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status not in ACTIVE_STATES and job.end_time and now - job.end_time > self.ttl]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._latest.get(job.target) == job_id:
+                del self._latest[job.target]
+
+    def submit(self, target, kind, priority=0, total_ports=0, options=None):
+        """
+        Queues a job. If an identical job (same target and kind) is already
+        queued or running, that job is returned instead.
+
+        Returns:
+            tuple: (job, created)
+        """
+        with self._cond:
+            self._evict(time.time())
+            for job in self._jobs.values():
+                if job.target == target and job.kind == kind and job.status in ACTIVE_STATES:
+                    return job, False
+
+            job = ScanJob(target, kind, priority, total_ports, options)
+            self._jobs[job.id] = job
+            self._latest[target] = job.id
+            heapq.heappush(self._queue, (-priority, next(self._seq), job))
+            self._ensure_workers()
+            self._cond.notify_all()
+        self._notify(job)
+        return job, True
+
+    def _next_job(self):
+        # Highest priority job whose target has nothing running
+        skipped = []
+        job = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            candidate = entry[2]
+            if candidate.status != QUEUED:
+                continue  # Cancelled while queued
+            if candidate.target in self._running_targets:
+                skipped.append(entry)
+                continue
+            job = candidate
+            break
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return job
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                job.status = RUNNING
+                job.start_time = time.time()
+                self._running_targets.add(job.target)
+            self._notify(job)
+
+            try:
+                self.run_job(job)
+                status = CANCELLED if job.cancel_event.is_set() else COMPLETE
+            except Exception as e:
+                logger.error(f"Scan job {job.id} for {job.target} failed: {e}")
+                job.error = str(e)
+                status = ERROR
+
+            with self._cond:
+                job.status = status
+                if status == COMPLETE:
+                    job.progress = 100
+                job.end_time = time.time()
+                self._running_targets.discard(job.target)
+                self._cond.notify_all()
+            self._notify(job)
+
+    def pending(self):
+        """
+        Number of jobs waiting to run.
+        """
+        with self._cond:
+            return sum(1 for entry in self._queue if entry[2].status == QUEUED)
+
+    def get(self, job_id):
+        with self._cond:
+            self._evict(time.time())
+            return self._jobs.get(job_id)
+
+    def latest_for(self, target):
+        """
+        Returns the most recent job for a target, or None.
+        """
+        with self._cond:
+            self._evict(time.time())
+            job_id = self._latest.get(target)
+            return self._jobs.get(job_id) if job_id else None
+
+    def list(self):
+        with self._cond:
+            self._evict(time.time())
+            return sorted(self._jobs.values(), key=lambda job: job.created, reverse=True)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. Returns False if it already finished.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ACTIVE_STATES:
+                return False
+            job.cancel_event.set()
+            if job.status != QUEUED:
+                return True
+            job.status = CANCELLED
+            job.end_time = time.time()
+        self._notify(job)
+        return True
@@ -1,6 +1,7 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 import logging
-from database import get_all_devices, upsert_device
+from network_scanner.storage.database import get_device_history
+from network_scanner.storage.registry import get_registry
 import threading
 import time
 
@@ -9,108 +10,260 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 import ipaddress
+from network_scanner.core import identifier, instrumentation, synscan
 from network_scanner.core.identifier import scan_ports
+from network_scanner.core.portmodel import pack_ports
+from network_scanner.web import events
+from network_scanner.web.jobs import ScanJobManager, ACTIVE_STATES
 
-# Global state for tracking port scans
-scan_state = {}
+# Connect timeout for full (1-65535) scans. None derives it (and retries of
+# timed-out ports) from the host's RTT estimate.
+FULL_SCAN_TIMEOUT = None
+FULL_SCAN_PORTS = 65535
+
+# Page size limits for /api/devices
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+# Maximum events returned by the history endpoints
+MAX_HISTORY_EVENTS = 5000
+
+# Sampling profiler dumps from the dashboard (--profiler)
+PROFILER_ENABLED = False
+MAX_PROFILE_SECONDS = 60
+
+def run_full_scan(job):
+    """
+    Runs a full port scan job (1-65535) and stores the result in the database.
+    """
+    ip = job.target
+    logger.info(f"Starting full port scan for {ip}")
+
+    def on_progress(scanned, total, last_port):
+        job.progress = int(scanned / total * 100)
+        job.current_port = last_port
+        events.publish('scan-progress', {
+            'job_id': job.id, 'ip': ip, 'progress': job.progress, 'current_port': last_port
+        }, job.id)
+
+    def on_open(port):
+        job.open_ports = sorted(job.open_ports + [port])
+        events.publish('port-found', {'job_id': job.id, 'ip': ip, 'port': port}, job.id)
+
+    # All ports are scanned concurrently by the shared connect engine;
+    # the callbacks keep the job up to date for the progress endpoints.
+    open_ports = scan_ports(ip, ports=range(1, FULL_SCAN_PORTS + 1), timeout=FULL_SCAN_TIMEOUT,
+                            progress=on_progress, on_open=on_open, cancel=job.cancel_event,
+                            mode=job.options.get('mode'))
+    job.open_ports = open_ports
+    if job.cancel_event.is_set():
+        logger.info(f"Full port scan for {ip} cancelled.")
+        return
+
+    # Store the new ports (IP index lookup; written to the database in the background)
+    device = get_registry().snapshot().lookup_ip(ip)
+    if device is not None:
+        updated = device.to_dict()
+        updated['open_ports'] = open_ports
+        updated['probed_ports'] = pack_ports(range(1, FULL_SCAN_PORTS + 1))
+        get_registry().upsert([updated])
+
+    logger.info(f"Full port scan complete for {ip}. Found {len(open_ports)} open ports.")
+
+def publish_job_status(job):
+    """
+    Pushes job state changes to event stream subscribers. Only the final
+    event carries the full list of open ports.
+    """
+    data = {'job_id': job.id, 'ip': job.target, 'status': job.status,
+            'ports_found': len(job.open_ports), 'error': job.error}
+    if job.status not in ACTIVE_STATES:
+        data['open_ports'] = list(job.open_ports)
+        data['elapsed_time'] = job.to_dict()['elapsed_time']
+    events.publish('scan-status', data, job.id)
+
+# Bounded manager for full port scans (job IDs, queueing, cancel, TTL eviction)
+scan_jobs = ScanJobManager(run_full_scan, on_change=publish_job_status)
+instrumentation.track_queue("scan_jobs", scan_jobs.pending)
 
 @app.route('/')
 def index():
-    devices = get_all_devices()
-    # Sort by IP address (default)
+    # The first page is rendered with the dashboard; further pages come from /api/devices
+    devices, next_cursor, total = get_registry().snapshot().query(limit=DEFAULT_PAGE_SIZE, with_total=True)
+    return render_template('index.html', profiler_enabled=PROFILER_ENABLED, syn_available=synscan.available(),
+                           scan_mode=identifier.scan_mode,
+                           initial_page={'devices': devices, 'next_cursor': next_cursor, 'total': total})
+
+@app.route('/api/devices', methods=['GET'])
+def list_devices():
+    """
+    Returns one page of devices, filtered and sorted from a registry snapshot.
+
+    Query parameters:
+        type, vendor: exact match (case-insensitive)
+        port: only devices with this port open
+        seen_since: Unix time; only devices seen since then
+        sort: ip, mac, vendor, type or last_seen (default ip)
+        order: asc or desc (default asc)
+        limit: page size (default 100, max 500)
+        cursor: `next_cursor` from the previous page
+
+    `total` (number of matching devices) is only computed for the first page.
+    """
+    args = request.args
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        port = int(args['port']) if args.get('port') else None
+        seen_since = float(args['seen_since']) if args.get('seen_since') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, port or seen_since'}), 400
+
+    cursor = args.get('cursor') or None
     try:
-        devices.sort(key=lambda x: ipaddress.ip_address(x['ip']))
-    except Exception as e:
-        logger.error(f"Error sorting by IP: {e}")
-        # Fallback to string sort or last seen
-        devices.sort(key=lambda x: x.get('last_seen', 0), reverse=True)
-        
-    return render_template('index.html', devices=devices)
+        devices, next_cursor, total = get_registry().snapshot().query(
+            device_type=args.get('type') or None,
+            vendor=args.get('vendor') or None,
+            port=port,
+            seen_since=seen_since,
+            sort=args.get('sort', 'ip'),
+            order=args.get('order', 'asc'),
+            limit=limit,
+            cursor=cursor,
+            with_total=cursor is None,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'devices': devices, 'next_cursor': next_cursor, 'total': total})
+
+def _history_response(mac=None):
+    args = request.args
+    try:
+        since = float(args['since']) if args.get('since') else None
+        until = float(args['until']) if args.get('until') else None
+        port = int(args['port']) if args.get('port') else None
+        limit = min(max(int(args.get('limit', 1000)), 1), MAX_HISTORY_EVENTS)
+    except ValueError:
+        return jsonify({'error': 'Invalid since, until, port or limit'}), 400
+    kinds = [name for name in args.get('event', '').split(',') if name] or None
+
+    try:
+        history = get_device_history(mac=mac, since=since, until=until, events=kinds, port=port, limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'events': history})
+
+@app.route('/api/history', methods=['GET'])
+def history():
+    """
+    Device change events (appeared, disappeared, ip_changed, port_opened,
+    port_closed) in a time window, oldest first.
+
+    Query parameters: since, until (Unix time), event (comma-separated names),
+    port, limit.
+    """
+    return _history_response()
+
+@app.route('/api/devices/<mac>/history', methods=['GET'])
+def device_history(mac):
+    """
+    Change events of one device. Same parameters as /api/history.
+    """
+    return _history_response(mac)
 
 @app.route('/api/scan-all-ports/<ip>', methods=['POST'])
 def scan_all_ports(ip):
     """
-    Initiates a full port scan (1-65535) for the specified IP.
-    Runs in background thread and stores progress in scan_state.
-    """
-    if ip in scan_state and scan_state[ip].get('status') == 'running':
-        return jsonify({'error': 'Scan already running for this IP'}), 400
-    
-    # Initialize scan state
-    scan_state[ip] = {
-        'status': 'running',
-        'progress': 0,
-        'current_port': 0,
-        'total_ports': 65535,
-        'open_ports': [],
-        'start_time': time.time()
-    }
-    
-    def run_full_scan():
-        try:
-            logger.info(f"Starting full port scan for {ip}")
-            all_ports = list(range(1, 65536))
-            open_ports = []
-            
-            # Scan in chunks for progress updates
-            chunk_size = 1000
-            for i in range(0, len(all_ports), chunk_size):
-                if scan_state[ip].get('status') == 'cancelled':
-                    break
-                    
-                chunk = all_ports[i:i+chunk_size]
-                chunk_open = scan_ports(ip, ports=chunk, timeout=0.1)
-                open_ports.extend(chunk_open)
-                
-                # Update progress
-                scan_state[ip]['progress'] = int((i + chunk_size) / len(all_ports) * 100)
-                scan_state[ip]['current_port'] = chunk[-1]
-                scan_state[ip]['open_ports'] = sorted(open_ports)
-            
-            # Mark as complete
-            scan_state[ip]['status'] = 'complete'
-            scan_state[ip]['progress'] = 100
-            scan_state[ip]['end_time'] = time.time()
-            
-            # Update database with new ports
-            from database import get_all_devices
-            devices = get_all_devices()
-            device = next((d for d in devices if d['ip'] == ip), None)
-            if device:
-                device['open_ports'] = sorted(open_ports)
-                upsert_device(device)
-            
-            logger.info(f"Full port scan complete for {ip}. Found {len(open_ports)} open ports.")
-            
-        except Exception as e:
-            logger.error(f"Error during full port scan for {ip}: {e}")
-            scan_state[ip]['status'] = 'error'
-            scan_state[ip]['error'] = str(e)
-    
-    # Start scan in background thread
-    thread = threading.Thread(target=run_full_scan, daemon=True)
-    thread.start()
-    
-    return jsonify({'status': 'started', 'ip': ip})
+    Queues a full port scan (1-65535) for the specified IP.
+    Accepts an optional integer `priority` (query string or JSON body);
+    higher priorities run first, and an optional `mode`, "connect" or
+    "syn" (default: the scanner's --scan-mode).
+    """
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return jsonify({'error': 'Invalid IP address'}), 400
+
+    body = request.get_json(silent=True) or {}
+    try:
+        priority = int(request.args.get('priority', body.get('priority', 0)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid priority'}), 400
+
+    mode = request.args.get('mode', body.get('mode')) or identifier.scan_mode
+    if mode not in identifier.SCAN_MODES:
+        return jsonify({'error': f"Invalid mode (expected one of: {', '.join(identifier.SCAN_MODES)})"}), 400
+    if mode == 'syn' and not synscan.supports(ip):
+        return jsonify({'error': 'SYN scans need raw socket privileges and an IPv4 address'}), 400
+
+    job, created = scan_jobs.submit(ip, 'full', priority=priority, total_ports=FULL_SCAN_PORTS,
+                                    options={'mode': mode})
+    if not created:
+        return jsonify({'error': 'Scan already running for this IP', 'job_id': job.id}), 400
+
+    return jsonify({'status': 'started', 'ip': ip, 'job_id': job.id, 'state': job.status})
 
 @app.route('/api/scan-progress/<ip>', methods=['GET'])
 def scan_progress(ip):
     """
-    Returns the current progress of a port scan for the specified IP.
+    Returns the current progress of the latest port scan for the specified IP.
     """
-    if ip not in scan_state:
+    job = scan_jobs.latest_for(ip)
+    if job is None:
         return jsonify({'error': 'No scan found for this IP'}), 404
-    
-    state = scan_state[ip]
-    return jsonify({
-        'status': state['status'],
-        'progress': state['progress'],
-        'current_port': state.get('current_port', 0),
-        'total_ports': state['total_ports'],
-        'open_ports': state['open_ports'],
-        'ports_found': len(state['open_ports']),
-        'elapsed_time': time.time() - state['start_time'] if 'start_time' in state else 0
-    })
+    return jsonify(job.to_dict())
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """
+    Server-Sent Events stream of scan progress, found ports, job status
+    changes and newly discovered devices. `?job=<id>` limits it to one job.
+    """
+    stream = events.bus.stream(job_id=request.args.get('job'))
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/scan-jobs', methods=['GET'])
+def list_scan_jobs():
+    """
+    Lists queued, running and recently finished scan jobs.
+    """
+    return jsonify([job.to_dict() for job in scan_jobs.list()])
+
+@app.route('/api/scan-jobs/<job_id>', methods=['GET'])
+def get_scan_job(job_id):
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/scan-jobs/<job_id>/cancel', methods=['POST'])
+def cancel_scan_job(job_id):
+    if not scan_jobs.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify({'status': 'cancelling', 'job_id': job_id})
+
+@app.route('/api/debug/profile', methods=['GET'])
+def profile():
+    """
+    Samples the stacks of every thread for `seconds` (default 10) and
+    returns them in collapsed format (one "thread;outer;...;inner count"
+    line per stack), ready for flame graph tools. Disabled unless the
+    scanner runs with --profiler.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler disabled (start with --profiler)'}), 404
+    try:
+        seconds = min(max(float(request.args.get('seconds', 10)), 0.1), MAX_PROFILE_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds'}), 400
+
+    try:
+        stacks = instrumentation.sample_stacks(seconds)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    filename = time.strftime('network-scanner-%Y%m%d-%H%M%S.folded')
+    return Response(stacks, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 def run_web_server(port=5000):
     """
@@ -14,7 +14,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/marcoscartes/network-device-exporter",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: System Administrators",
@@ -37,6 +37,6 @@ setup(
     },
     include_package_data=True,
     package_data={
-        "network_scanner": ["web/templates/*.html"],
+        "network_scanner": ["web/templates/*.html", "data/*.csv", "data/manuf"],
     },
 )